@@ -0,0 +1,93 @@
+# be-py/ai/cache.py
+from typing import Callable, Dict, Any
+from datetime import datetime, timedelta
+import hashlib, threading
+from pymongo.errors import OperationFailure
+from common.lru import TTLCache
+from common.config import LLM_CACHE_SIZE, LLM_CACHE_TTL_SEC, LLM_CACHE_MONGO
+
+_mem = TTLCache(maxsize=LLM_CACHE_SIZE, ttl=LLM_CACHE_TTL_SEC)
+_counters = {"mongoHits": 0, "mongoMisses": 0, "bypass": 0, "calls": 0}
+_counter_lock = threading.Lock()
+_mongo_ready = False
+
+def _bump(name: str) -> None:
+    with _counter_lock:
+        _counters[name] += 1
+
+def cache_key(engine: str, model: str, prompt: str) -> str:
+    h = hashlib.sha256()
+    for part in (engine, model, prompt):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+def _mongo():
+    global _mongo_ready
+    from common.db import llm_cache
+    if not _mongo_ready:
+        # TTL index: Mongo tự xoá bản ghi hết hạn (tên mặc định, cùng khai báo trong common/indexes.py)
+        try:
+            llm_cache.create_index("expiresAt", expireAfterSeconds=0)
+        except OperationFailure:
+            pass      # đã có index TTL cùng key dưới tên khác
+        _mongo_ready = True
+    return llm_cache
+
+def _mongo_get(key: str):
+    try:
+        d = _mongo().find_one({"_id": key, "expiresAt": {"$gt": datetime.utcnow()}}, {"text": 1})
+    except Exception:
+        return None
+    _bump("mongoHits" if d else "mongoMisses")
+    return d and d.get("text")
+
+def _mongo_set(key: str, engine: str, model: str, text: str) -> None:
+    now = datetime.utcnow()
+    try:
+        _mongo().replace_one({"_id": key}, {
+            "_id": key, "engine": engine, "model": model, "text": text,
+            "createdAt": now, "expiresAt": now + timedelta(seconds=LLM_CACHE_TTL_SEC),
+        }, upsert=True)
+    except Exception:
+        pass
+
+def cached_generate(engine: str, model: str, prompt: str, call: Callable[[], str], use_cache: bool = True) -> str:
+    """Trả kết quả đã cache cho cùng (engine, model, prompt); use_cache=False để luôn gọi model."""
+    if not use_cache:
+        _bump("bypass")
+        _bump("calls")
+        return call()
+    key = cache_key(engine, model, prompt)
+    text = _mem.get(key)
+    if text is not None:
+        return text
+    if LLM_CACHE_MONGO:
+        text = _mongo_get(key)
+        if text is not None:
+            _mem.set(key, text)
+            return text
+    _bump("calls")
+    text = call()
+    # không cache câu trả lời rỗng
+    if text:
+        _mem.set(key, text)
+        if LLM_CACHE_MONGO:
+            _mongo_set(key, engine, model, text)
+    return text
+
+def forget(engine: str, model: str, prompt: str) -> None:
+    """Bỏ câu trả lời đã cache (vd không parse/validate được) để lần sau gọi lại model."""
+    key = cache_key(engine, model, prompt)
+    _mem.pop(key)
+    if LLM_CACHE_MONGO:
+        try:
+            _mongo().delete_one({"_id": key})
+        except Exception:
+            pass
+
+def stats() -> Dict[str, Any]:
+    return {"memory": _mem.stats(), "mongoEnabled": LLM_CACHE_MONGO, **_counters}
+
+def clear() -> None:
+    _mem.clear()
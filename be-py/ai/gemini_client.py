@@ -1,11 +1,46 @@
 # be-py/ai/gemini_client.py
-from google import genai
+from typing import Any, Dict, Optional, Tuple
+import threading
 from common.config import GEMINI_API_KEY
 
-_client = genai.Client(api_key=GEMINI_API_KEY) if GEMINI_API_KEY else None
+DEFAULT_MODEL = "gemini-2.5-flash"
 
-def generate(prompt: str, model: str = "gemini-2.5-flash") -> str:
-    if not _client:
-        raise RuntimeError("GEMINI_API_KEY missing")
-    resp = _client.models.generate_content(model=model, contents=prompt)
-    return resp.text or ""
+class GeminiBackend:
+    """Một genai.Client dùng chung (httpx pool bên trong), tạo khi gọi lần đầu."""
+    name = "gemini"
+    default_model = DEFAULT_MODEL
+
+    def __init__(self, api_key: str = GEMINI_API_KEY):
+        self.api_key = api_key
+        self._client = None
+        self._lock = threading.Lock()
+
+    def available(self) -> bool:
+        return bool(self.api_key)
+
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from google import genai
+                    self._client = genai.Client(api_key=self.api_key)
+        return self._client
+
+    def complete(self, prompt: str, model: str, timeout: float, json_schema: Optional[Dict[str, Any]] = None) -> Tuple[str, Dict[str, Any]]:
+        from google.genai import types
+        cfg: Dict[str, Any] = {"http_options": types.HttpOptions(timeout=int(timeout * 1000))}
+        if json_schema:
+            cfg.update(response_mime_type="application/json", response_json_schema=json_schema)
+        resp = self.client().models.generate_content(
+            model=model, contents=prompt, config=types.GenerateContentConfig(**cfg),
+        )
+        u = getattr(resp, "usage_metadata", None)
+        usage = {
+            "promptTokens": getattr(u, "prompt_token_count", None) or 0,
+            "outputTokens": getattr(u, "candidates_token_count", None) or 0,
+        }
+        return resp.text or "", usage
+
+def generate(prompt: str, model: str = DEFAULT_MODEL, use_cache: bool = True, timeout: Optional[float] = None) -> str:
+    from ai import llm
+    return llm.generate(prompt, "gemini", model=model, use_cache=use_cache, timeout=timeout, failover=False).text
@@ -0,0 +1,246 @@
+# be-py/ai/llm.py
+"""Lớp gọi LLM dùng chung cho mọi service.
+
+    res = llm.generate(prompt, "gemini", model="gemini-2.5-flash", deadline=time.monotonic() + 90)
+    res.text, res.engine, res.model
+
+- Mỗi engine: semaphore giới hạn đồng thời (LLM_CONCURRENCY), timeout mỗi lời gọi (LLM_TIMEOUT_SEC),
+  retry backoff có jitter với lỗi tạm thời (rate limit, timeout, mất kết nối).
+- `deadline` (time.monotonic()) giới hạn cả thời gian chờ semaphore, retry và timeout từng lời gọi.
+- Circuit breaker: lỗi liên tiếp >= LLM_BREAKER_FAILURES thì engine bị bỏ qua trong LLM_BREAKER_COOLDOWN_SEC,
+  sau đó cho 1 lời gọi thử. Khi engine lỗi/đang mở, chuyển sang engine kế tiếp theo LLM_FAILOVER.
+  Hết engine -> LLMUnavailable (planner dùng engine "local" trong trường hợp này).
+"""
+from typing import Any, Callable, Deque, Dict, List, NamedTuple, Optional
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import asyncio, functools, random, threading, time
+from common.config import (
+    LLM_CONCURRENCY, LLM_MAX_RETRIES, LLM_BACKOFF_SEC, LLM_TIMEOUT_SEC,
+    LLM_BREAKER_FAILURES, LLM_BREAKER_COOLDOWN_SEC, LLM_FAILOVER, LLM_POOL_WORKERS,
+)
+from ai.cache import cached_generate, forget as _forget
+from ai.gemini_client import GeminiBackend
+from ai.ollama_client import OllamaBackend
+
+class LLMError(RuntimeError):
+    pass
+
+class LLMTimeout(LLMError):
+    pass
+
+class LLMDeadline(LLMTimeout):
+    """Hết deadline của lời gọi hoặc chờ slot quá lâu — giới hạn phía mình, không phải engine lỗi."""
+
+class LLMUnavailable(LLMError):
+    """Không engine nào trong chuỗi failover gọi được."""
+
+class LLMResult(NamedTuple):
+    text: str
+    engine: str
+    model: str
+
+def _is_transient(e: Exception) -> bool:
+    if isinstance(e, (TimeoutError, ConnectionError, LLMTimeout)):
+        return True
+    code = getattr(e, "status_code", None) or getattr(e, "code", None)
+    if code in (408, 429, 500, 502, 503, 504):
+        return True
+    name = type(e).__name__
+    if "Timeout" in name or "Connect" in name:   # httpx.ReadTimeout, httpx.ConnectError...
+        return True
+    msg = str(e).upper()
+    return "429" in msg or "RESOURCE_EXHAUSTED" in msg or "RATE LIMIT" in msg or "UNAVAILABLE" in msg
+
+class _Breaker:
+    def __init__(self, failures: int, cooldown: float):
+        self.threshold = max(1, failures)
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.cooldown or self._probing:
+                return False
+            self._probing = True      # half-open: chỉ 1 lời gọi thử
+            return True
+
+    def success(self) -> None:
+        with self._lock:
+            self.failures, self.opened_at, self._probing = 0, None, False
+
+    def release(self) -> None:
+        """Trả lượt thử half-open mà không tính thành công/thất bại."""
+        with self._lock:
+            self._probing = False
+
+    def failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+class _Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.c = {"calls": 0, "ok": 0, "errors": 0, "timeouts": 0, "retries": 0, "failovers": 0,
+                  "rejected": 0, "promptTokens": 0, "outputTokens": 0}
+        self.latency: Deque[float] = deque(maxlen=512)
+
+    def bump(self, name: str, n: int = 1) -> None:
+        with self.lock:
+            self.c[name] += n
+
+    def observe(self, sec: float, usage: Dict[str, Any]) -> None:
+        with self.lock:
+            self.c["ok"] += 1
+            self.c["promptTokens"] += int(usage.get("promptTokens") or 0)
+            self.c["outputTokens"] += int(usage.get("outputTokens") or 0)
+            self.latency.append(sec)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            lat = sorted(self.latency)
+            out = dict(self.c)
+        pick = lambda q: round(lat[min(len(lat) - 1, int(q * len(lat)))] * 1000, 1) if lat else None
+        out["latencyMs"] = {"p50": pick(0.5), "p95": pick(0.95), "max": pick(1.0), "samples": len(lat)}
+        return out
+
+class _Engine:
+    def __init__(self, backend, concurrency: int, timeout: float):
+        self.backend = backend
+        self.name = backend.name
+        self.sem = threading.BoundedSemaphore(max(1, concurrency))
+        self.timeout = timeout
+        self.breaker = _Breaker(LLM_BREAKER_FAILURES, LLM_BREAKER_COOLDOWN_SEC)
+        self.metrics = _Metrics()
+
+    def _attempt(self, prompt: str, model: str, deadline: Optional[float], json_schema: Optional[Dict[str, Any]]) -> str:
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if remaining is not None and remaining <= 0:
+            raise LLMDeadline(f"{self.name}: deadline exceeded")
+        if not self.sem.acquire(timeout=remaining):
+            raise LLMDeadline(f"{self.name}: timed out waiting for a slot")
+        try:
+            timeout = self.timeout if deadline is None else max(1.0, min(self.timeout, deadline - time.monotonic()))
+            t0 = time.perf_counter()
+            self.metrics.bump("calls")
+            text, usage = self.backend.complete(prompt, model, timeout, json_schema)
+            self.metrics.observe(time.perf_counter() - t0, usage)
+            return text
+        finally:
+            self.sem.release()
+
+    def call(self, prompt: str, model: str, deadline: Optional[float], json_schema: Optional[Dict[str, Any]] = None) -> str:
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            try:
+                return self._attempt(prompt, model, deadline, json_schema)
+            except Exception as e:
+                self.metrics.bump("timeouts" if "Timeout" in type(e).__name__ else "errors")
+                if attempt >= LLM_MAX_RETRIES or not _is_transient(e):
+                    raise
+                pause = LLM_BACKOFF_SEC * (2 ** attempt) * (0.5 + random.random())
+                if deadline is not None and time.monotonic() + pause >= deadline:
+                    raise
+                self.metrics.bump("retries")
+                time.sleep(pause)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"breaker": self.breaker.state, "consecutiveFailures": self.breaker.failures,
+                "timeoutSec": self.timeout, **self.metrics.snapshot()}
+
+_engines: Dict[str, _Engine] = {
+    "gemini": _Engine(GeminiBackend(), LLM_CONCURRENCY["gemini"], LLM_TIMEOUT_SEC["gemini"]),
+    "ollama": _Engine(OllamaBackend(), LLM_CONCURRENCY["ollama"], LLM_TIMEOUT_SEC["ollama"]),
+}
+
+def _chain(engine: str, failover: bool) -> List[str]:
+    if engine not in _engines:
+        raise ValueError(f"Unknown engine: {engine}")
+    out = [engine]
+    if failover:
+        out += [e for e in LLM_FAILOVER.get(engine, []) if e in _engines and e not in out]
+    return out
+
+def _cache_model(model: str, json_schema: Optional[Dict[str, Any]]) -> str:
+    # cache tách theo chế độ JSON: cùng prompt nhưng câu trả lời dạng khác
+    return f"{model}|json:{json_schema.get('title', '')}" if json_schema else model
+
+def forget(prompt: str, res: LLMResult, json_schema: Optional[Dict[str, Any]] = None) -> None:
+    """Xoá câu trả lời `res` khỏi cache (câu trả lời hỏng không được dùng lại)."""
+    _forget(res.engine, _cache_model(res.model, json_schema), prompt)
+
+def generate(
+    prompt: str,
+    engine: str = "gemini",
+    model: Optional[str] = None,
+    use_cache: bool = True,
+    timeout: Optional[float] = None,
+    deadline: Optional[float] = None,
+    failover: bool = True,
+    json_schema: Optional[Dict[str, Any]] = None,
+) -> LLMResult:
+    """Gọi LLM (có cache). `model` chỉ áp dụng cho engine chính; engine dự phòng dùng model mặc định.
+    json_schema: bật chế độ trả JSON theo schema của engine (xem ai/structured.py)."""
+    if timeout is not None:
+        end = time.monotonic() + timeout
+        deadline = end if deadline is None else min(deadline, end)
+    errors = []
+    for i, name in enumerate(_chain(engine, failover)):
+        eng = _engines[name]
+        mdl = (model if i == 0 else None) or eng.backend.default_model
+        if not eng.backend.available():
+            errors.append(f"{name}: not configured")
+            continue
+        if not eng.breaker.allow():
+            eng.metrics.bump("rejected")
+            errors.append(f"{name}: circuit open")
+            continue
+        if i > 0:
+            eng.metrics.bump("failovers")
+        try:
+            ckey = _cache_model(mdl, json_schema)
+            text = cached_generate(name, ckey, prompt, lambda: eng.call(prompt, mdl, deadline, json_schema), use_cache)
+        except LLMDeadline as e:
+            # hết deadline / hàng chờ đầy: engine không hỏng, breaker giữ nguyên
+            eng.breaker.release()
+            errors.append(f"{name}: {e}")
+            continue
+        except Exception as e:
+            # lỗi do request (vd prompt sai) không làm mở breaker
+            if _is_transient(e) or isinstance(e, LLMError):
+                eng.breaker.failure()
+            else:
+                eng.breaker.success()
+                raise
+            errors.append(f"{name}: {e}")
+            continue
+        eng.breaker.success()
+        return LLMResult(text, name, mdl)
+    raise LLMUnavailable("; ".join(errors) or "no engine")
+
+# thread chờ semaphore của engine nằm ở đây, không chặn executor mặc định (face, Mongo sync...)
+executor = ThreadPoolExecutor(max_workers=max(1, LLM_POOL_WORKERS), thread_name_prefix="llm")
+
+def concurrency(engine: str) -> int:
+    """Số lời gọi đồng thời của engine; code async dùng làm giới hạn dispatch."""
+    return max(1, LLM_CONCURRENCY.get(engine, 1))
+
+async def run_blocking(fn: Callable[..., Any], *args, **kw) -> Any:
+    """Chạy hàm sync có gọi LLM trong thread pool riêng của lớp LLM."""
+    return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(fn, *args, **kw))
+
+def stats() -> Dict[str, Any]:
+    return {name: eng.stats() for name, eng in _engines.items()}
@@ -1,13 +1,43 @@
 # be-py/ai/ollama_client.py
-import ollama
-from common.config import OLLAMA_HOST, OLLAMA_MODEL
-
-_ol = ollama.Client(host=OLLAMA_HOST)
-
-def generate(prompt: str, model: str = None) -> str:
-    mdl = model or OLLAMA_MODEL
-    resp = _ol.chat(model=mdl, messages=[
-        {"role": "system", "content": "You are a nutrition assistant. Output ONLY JSON as instructed."},
-        {"role": "user", "content": prompt},
-    ])
-    return resp["message"]["content"]
+from typing import Any, Dict, Optional, Tuple
+import threading
+from common.config import OLLAMA_HOST, OLLAMA_MODEL, LLM_TIMEOUT_SEC
+
+SYSTEM_PROMPT = "You are a nutrition assistant. Output ONLY JSON as instructed."
+
+class OllamaBackend:
+    """ollama.Client (httpx, giữ kết nối) theo từng timeout; mặc định httpx không có timeout."""
+    name = "ollama"
+
+    def __init__(self, host: str = OLLAMA_HOST, model: str = OLLAMA_MODEL):
+        self.host = host
+        self.default_model = model
+        self._clients: Dict[float, Any] = {}
+        self._lock = threading.Lock()
+
+    def available(self) -> bool:
+        return bool(self.host)
+
+    def client(self, timeout: float):
+        # làm tròn lên bội số 15s: vài client cố định thay vì một client cho mỗi deadline
+        key = float(min(max(15, -(-int(timeout) // 15) * 15), max(15, int(LLM_TIMEOUT_SEC["ollama"]))))
+        c = self._clients.get(key)
+        if c is None:
+            with self._lock:
+                c = self._clients.get(key)
+                if c is None:
+                    import ollama
+                    c = self._clients[key] = ollama.Client(host=self.host, timeout=key)
+        return c
+
+    def complete(self, prompt: str, model: str, timeout: float, json_schema: Optional[Dict[str, Any]] = None) -> Tuple[str, Dict[str, Any]]:
+        resp = self.client(timeout).chat(model=model, format=json_schema or None, messages=[
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt},
+        ])
+        usage = {"promptTokens": resp.get("prompt_eval_count") or 0, "outputTokens": resp.get("eval_count") or 0}
+        return resp["message"]["content"], usage
+
+def generate(prompt: str, model: str = None, use_cache: bool = True, timeout: Optional[float] = None) -> str:
+    from ai import llm
+    return llm.generate(prompt, "ollama", model=model, use_cache=use_cache, timeout=timeout, failover=False).text
@@ -0,0 +1,84 @@
+# be-py/ai/schemas.py
+"""Schema các câu trả lời JSON của LLM: dùng cho chế độ structured output của engine và để validate."""
+from typing import Any, Dict, List, Optional
+from pydantic import BaseModel, ConfigDict, Field, RootModel, field_validator, model_validator
+
+class _Model(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+# --- gợi ý dinh dưỡng (nutrition_service) ---
+
+class Range(_Model):
+    target: Optional[float] = None
+    min: Optional[float] = None
+    max: Optional[float] = None
+
+class SuggestedFood(_Model):
+    foodItemId: str = ""
+    reason: str = ""
+    frequency: str = ""
+
+class AvoidFood(_Model):
+    foodItemId: str = ""
+    reason: str = ""
+
+class Recommendations(_Model):
+    dailyCaloriesTarget: float
+    macronutrients: Dict[str, Range]
+    micronutrients: Dict[str, Range] = Field(default_factory=dict)
+    suggestedFoods: List[SuggestedFood] = Field(default_factory=list)
+    foodsToAvoid: List[AvoidFood] = Field(default_factory=list)
+    mealDistribution: Dict[str, float] = Field(default_factory=dict)
+    specialNotes: str = ""
+
+class RecommendationResult(_Model):
+    recommendations: Recommendations
+    confidence: float = 0.7
+
+# --- thực đơn (nutrition_planner) ---
+
+class MenuItem(_Model):
+    foodItemId: Optional[str] = ""
+    name: str = ""
+    quantity: float = 100
+    unit: str = "g"
+
+class Meals(_Model):
+    breakfast: List[MenuItem] = Field(default_factory=list)
+    lunch: List[MenuItem] = Field(default_factory=list)
+    snack: List[MenuItem] = Field(default_factory=list)
+
+class DayMenu(_Model):
+    meals: Meals
+
+    @model_validator(mode="after")
+    def _not_empty(self):
+        if not (self.meals.breakfast or self.meals.lunch or self.meals.snack):
+            raise ValueError("menu has no items")
+        return self
+
+class BatchMenus(_Model):
+    menus: Dict[str, DayMenu]
+
+# --- phân nhóm học sinh (nutrition_group) ---
+
+class Group(_Model):
+    key: str = ""
+    name: str = ""
+    description: str = ""
+    criteriaSummary: Dict[str, Any] = Field(default_factory=dict)
+    studentIds: List[str] = Field(default_factory=list)
+
+    @field_validator("studentIds", mode="before")
+    @classmethod
+    def _ids(cls, v):
+        if isinstance(v, dict):     # LLM đôi khi trả {"1": "id", ...}
+            v = list(v.values())
+        return [str(x) for x in (v or [])]
+
+class Grouping(RootModel[List[Group]]):
+    @model_validator(mode="after")
+    def _not_empty(self):
+        if not self.root:
+            raise ValueError("no groups")
+        return self
@@ -0,0 +1,121 @@
+# be-py/ai/structured.py
+"""Sinh JSON có cấu trúc từ LLM: bật chế độ JSON/schema của engine, parse, validate bằng pydantic,
+sửa tối đa 1 lần khi câu trả lời hỏng. Lỗi cuối cùng là StructuredOutputError (không trả {} im lặng)."""
+from typing import Any, Dict, Optional, Tuple, Type
+import json, threading, time
+from pydantic import BaseModel, ValidationError
+from ai import llm
+
+class StructuredOutputError(llm.LLMError):
+    pass
+
+_decoder = json.JSONDecoder()
+
+def extract_json(text: str) -> Any:
+    """JSON đầu tiên trong text. Nhanh nhất khi engine đã trả JSON thuần; nếu không thì bỏ ```json fence
+    và raw_decode từ dấu { hoặc [ đầu tiên (tuyến tính, không regex quay lui)."""
+    if not text:
+        raise ValueError("empty response")
+    s = text.strip()
+    try:
+        return json.loads(s)
+    except ValueError:
+        pass
+    if s.startswith("```"):
+        s = s.split("\n", 1)[-1]
+        if s.rstrip().endswith("```"):
+            s = s.rstrip()[:-3]
+    err: Exception = ValueError("no JSON object in response")
+    pos = 0
+    for _ in range(8):     # vài vị trí bắt đầu là đủ; tránh O(n^2) với text rác nhiều dấu {
+        starts = [i for i in (s.find("{", pos), s.find("[", pos)) if i >= 0]
+        if not starts:
+            break
+        i = min(starts)
+        try:
+            return _decoder.raw_decode(s, i)[0]
+        except ValueError as e:
+            err, pos = e, i + 1
+    raise err
+
+_schemas: Dict[type, Dict[str, Any]] = {}
+
+def _schema(cls: Type[BaseModel]) -> Dict[str, Any]:
+    if cls not in _schemas:
+        _schemas[cls] = cls.model_json_schema()
+    return _schemas[cls]
+
+_lock = threading.Lock()
+_stats: Dict[str, Dict[str, Any]] = {}
+
+def _bump(engine: str, **kw) -> None:
+    with _lock:
+        st = _stats.setdefault(engine, {"parsed": 0, "parseErrors": 0, "validationErrors": 0,
+                                        "repairs": 0, "repaired": 0, "failed": 0, "parseMsTotal": 0.0})
+        for k, v in kw.items():
+            st[k] += v
+
+def _validate(engine: str, cls: Type[BaseModel], text: str) -> BaseModel:
+    t0 = time.perf_counter()
+    try:
+        obj = extract_json(text)
+    except ValueError:
+        _bump(engine, parseErrors=1, parseMsTotal=(time.perf_counter() - t0) * 1000)
+        raise
+    try:
+        out = cls.model_validate(obj)
+    except ValidationError:
+        _bump(engine, validationErrors=1, parseMsTotal=(time.perf_counter() - t0) * 1000)
+        raise
+    _bump(engine, parsed=1, parseMsTotal=(time.perf_counter() - t0) * 1000)
+    return out
+
+def _repair_prompt(prompt: str, bad: str, err: Exception) -> str:
+    return f"""{prompt}
+
+---
+Câu trả lời trước không hợp lệ ({str(err)[:400]}):
+{bad[:2000]}
+Hãy trả lại DUY NHẤT JSON hợp lệ đúng cấu trúc trên, không giải thích."""
+
+def generate_model(
+    prompt: str,
+    engine: str,
+    cls: Type[BaseModel],
+    model: Optional[str] = None,
+    use_cache: bool = True,
+    deadline: Optional[float] = None,
+    failover: bool = True,
+) -> Tuple[BaseModel, llm.LLMResult]:
+    schema = _schema(cls)
+    res = llm.generate(prompt, engine, model=model, use_cache=use_cache, deadline=deadline,
+                       failover=failover, json_schema=schema)
+    try:
+        return _validate(res.engine, cls, res.text), res
+    except (ValueError, ValidationError) as e:
+        err = e
+    # sửa 1 lần, cùng engine/model đã trả lời, không cache
+    llm.forget(prompt, res, schema)
+    _bump(res.engine, repairs=1)
+    res2 = llm.generate(_repair_prompt(prompt, res.text, err), res.engine, model=res.model, use_cache=False,
+                        deadline=deadline, failover=False, json_schema=schema)
+    try:
+        out = _validate(res2.engine, cls, res2.text)
+    except (ValueError, ValidationError) as e:
+        _bump(res2.engine, failed=1)
+        raise StructuredOutputError(f"{res2.engine}: invalid {cls.__name__} after repair: {str(e)[:300]}") from e
+    _bump(res2.engine, repaired=1)
+    return out, res2
+
+def generate_json(prompt: str, engine: str, cls: Type[BaseModel], **kw) -> Tuple[Any, llm.LLMResult]:
+    """Như generate_model nhưng trả dict/list (model_dump, bỏ trường None)."""
+    out, res = generate_model(prompt, engine, cls, **kw)
+    return out.model_dump(exclude_none=True), res
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        out = {k: dict(v) for k, v in _stats.items()}
+    for st in out.values():
+        n = st["parsed"] + st["parseErrors"] + st["validationErrors"]
+        st["parseMsAvg"] = round(st.pop("parseMsTotal") / n, 3) if n else None
+    return out
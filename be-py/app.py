@@ -3,13 +3,44 @@ from fastapi import FastAPI
 from routers.attendance import router as attendance_router 
 from routers.nutrition import router as nutrition_router
 from routers.nutrition_group import router as nutrition_group_router
+from routers.jobs import router as jobs_router
 from fastapi.routing import APIRoute
+from common.config import FACE_WARMUP, INDEX_BOOTSTRAP
+from common.responses import BSONResponse
 
-app = FastAPI(title="nuv2-ai-gateway")
+app = FastAPI(title="nuv2-ai-gateway", default_response_class=BSONResponse)
+
+@app.on_event("startup")
+def _bootstrap_indexes():
+    if INDEX_BOOTSTRAP:
+        from common.indexes import ensure_indexes
+        try:
+            print("MONGO INDEXES:", ensure_indexes())
+        except Exception as e:
+            print("MONGO INDEXES FAILED:", e)
+
+@app.on_event("startup")
+def _start_jobs():
+    # job queued/running của process đã dừng được đánh failed; heartbeat cho job của process này
+    from services import jobs
+    jobs.start()
+
+@app.on_event("startup")
+def _warmup_face_models():
+    # mặc định model được nạp khi có request /face đầu tiên; FACE_WARMUP=1 để nạp sẵn
+    if FACE_WARMUP:
+        from services.face_engine import face_pool
+        print("FACE WARMUP:", face_pool.warmup())
+
+@app.on_event("shutdown")
+async def _close_async_mongo():
+    from common import adb
+    await adb.close()
 
 app.include_router(attendance_router, prefix="/face", tags=["face"])
 app.include_router(nutrition_router,  prefix="/nutrition", tags=["nutrition"])
 app.include_router(nutrition_group_router)
+app.include_router(jobs_router)
 
 for r in app.routes:
     if isinstance(r, APIRoute):
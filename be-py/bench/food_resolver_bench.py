@@ -0,0 +1,76 @@
+# be-py/bench/food_resolver_bench.py
+"""So sánh resolver mới với cách map tên cũ (_pick_id_by_name: lowercase exact + substring scan).
+
+    python -m bench.food_resolver_bench [số món catalog] [số truy vấn]
+
+Không cần Mongo: dùng catalog sinh ngẫu nhiên từ tên món tiếng Việt.
+"""
+import random, sys, time
+from services.food_resolver import FoodResolver
+from utils.text import fold
+
+BASES = ["Phở", "Bún", "Cháo", "Cơm", "Canh", "Súp", "Xôi", "Bánh", "Miến", "Mì"]
+MAINS = ["bò", "gà", "cá lóc", "tôm", "thịt heo", "trứng", "đậu hũ", "rau cải", "bí đỏ", "cà rốt", "nấm", "sườn"]
+STYLES = ["", "hầm", "xào", "luộc", "sốt cà", "kho", "chiên", "hấp", "nấu chua", "rim"]
+
+def _legacy_pick_id_by_name(name, catalog):
+    if not name:
+        return None
+    n = name.strip().lower()
+    for it in catalog:
+        if it["name"].strip().lower() == n:
+            return it["_id"]
+    for it in catalog:
+        nm = it["name"].strip().lower()
+        if n in nm or nm in n:
+            return it["_id"]
+    return None
+
+def _catalog(n, rnd):
+    names, seen = [], set()
+    while len(names) < n:
+        nm = " ".join(x for x in (rnd.choice(BASES), rnd.choice(MAINS), rnd.choice(STYLES)) if x)
+        if len(seen) >= len(BASES) * len(MAINS) * len(STYLES):
+            nm = f"{nm} {len(names)}"
+        if nm not in seen:
+            seen.add(nm)
+            names.append(nm)
+    return [{"_id": str(i), "name": nm} for i, nm in enumerate(names)]
+
+def _queries(catalog, n, rnd):
+    """(truy vấn, id đúng) mô phỏng output LLM: đúng tên, mất dấu, thiếu từ, thêm khối lượng."""
+    out = []
+    for _ in range(n):
+        it = rnd.choice(catalog)
+        nm, kind = it["name"], rnd.randrange(4)
+        if kind == 1:
+            nm = fold(nm)
+        elif kind == 2:
+            nm = " ".join(nm.split()[:-1]) or nm
+        elif kind == 3:
+            nm = f"{nm} ({rnd.choice([80, 100, 120])}g)"
+        out.append((nm, it["_id"]))
+    return out
+
+def main(n_items=400, n_queries=2000):
+    rnd = random.Random(7)
+    catalog = _catalog(n_items, rnd)
+    queries = _queries(catalog, n_queries, rnd)
+
+    t0 = time.perf_counter()
+    legacy = [_legacy_pick_id_by_name(q, catalog) for q, _ in queries]
+    t1 = time.perf_counter()
+    resolver = FoodResolver(catalog)
+    t2 = time.perf_counter()
+    fresh = [(h or {}).get("foodItemId") for h in resolver.resolve_many([q for q, _ in queries])]
+    t3 = time.perf_counter()
+
+    def acc(ids):
+        return sum(1 for got, (_, want) in zip(ids, queries) if got == want) / len(queries)
+
+    print(f"catalog={n_items} queries={n_queries}")
+    print(f"legacy  : {1e6 * (t1 - t0) / n_queries:8.1f} us/query  accuracy={acc(legacy):.1%}")
+    print(f"resolver: {1e6 * (t3 - t2) / n_queries:8.1f} us/query  accuracy={acc(fresh):.1%}  (index build {1e3 * (t2 - t1):.1f} ms)")
+
+if __name__ == "__main__":
+    main(*(int(x) for x in sys.argv[1:3]))
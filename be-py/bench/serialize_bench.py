@@ -0,0 +1,98 @@
+# be-py/bench/serialize_bench.py
+"""So sánh encode response cũ (_stringify + jsonable_encoder + json.dumps của JSONResponse)
+với common.responses.dumps (orjson + default hook) trên document nutritional_recommendations.
+
+    python -m bench.serialize_bench [số document] [số vòng]
+
+Không cần Mongo: document sinh theo đúng dạng save_nutrition / menu_draft.
+"""
+import json, random, sys, time
+from datetime import datetime, timedelta
+from bson import ObjectId
+from common.responses import dumps, orjson
+
+try:
+    from fastapi.encoders import jsonable_encoder
+except ImportError:
+    jsonable_encoder = None
+
+def _legacy_stringify(obj):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    if isinstance(obj, list):
+        return [_legacy_stringify(x) for x in obj]
+    if isinstance(obj, dict):
+        return {k: _legacy_stringify(v) for k, v in obj.items()}
+    return obj
+
+def _legacy(payload):
+    out = _legacy_stringify(payload)
+    if jsonable_encoder is not None:
+        out = jsonable_encoder(out)
+    return json.dumps(out, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+def _rng(rnd, base):
+    t = round(base * rnd.uniform(0.9, 1.1), 1)
+    return {"target": t, "min": round(t * 0.8, 1), "max": round(t * 1.2, 1)}
+
+def _recommendation(rnd, now):
+    return {
+        "_id": ObjectId(),
+        "studentId": ObjectId(),
+        "generatedDate": now - timedelta(days=rnd.randint(0, 90)),
+        "inputData": {
+            "age": rnd.randint(30, 72), "weight": round(rnd.uniform(12, 25), 1), "height": round(rnd.uniform(85, 120), 1),
+            "bmi": round(rnd.uniform(13, 20), 2), "allergies": rnd.sample(["sữa", "trứng", "tôm", "đậu phộng"], rnd.randint(0, 2)),
+            "activityLevel": "moderate", "healthConditions": [],
+            "recentIntakeHistory": [str(ObjectId()) for _ in range(rnd.randint(5, 20))],
+        },
+        "recommendations": {
+            "dailyCaloriesTarget": rnd.randint(1100, 1500),
+            "macronutrients": {k: _rng(rnd, b) for k, b in (("protein", 45), ("fat", 40), ("carbohydrate", 180))},
+            "micronutrients": {k: _rng(rnd, b) for k, b in (("calcium", 600), ("iron", 8), ("vitaminA", 400), ("vitaminC", 25), ("vitaminD", 15))},
+            "suggestedFoods": [{"foodItemId": str(ObjectId()), "reason": "Giàu đạm, dễ tiêu hoá cho trẻ", "frequency": "daily"} for _ in range(8)],
+            "foodsToAvoid": [{"foodItemId": str(ObjectId()), "reason": "Dị ứng"} for _ in range(2)],
+            "mealDistribution": {"breakfast": 30, "lunch": 50, "snack": 20},
+            "specialNotes": "Tăng rau xanh, hạn chế đồ ngọt. " * 3,
+        },
+        "aiModel": "gemini-2.5-flash", "confidence": 0.7, "appliedToMenu": False,
+        "createdAt": now, "updatedAt": now,
+    }
+
+def _draft(rnd, now):
+    meal = lambda n: {"items": [{"foodItemId": str(ObjectId()), "name": "Cháo gà bí đỏ", "quantity": 120.0, "unit": "g"} for _ in range(n)]}
+    return {
+        "_id": ObjectId(), "type": "menu_draft", "classId": ObjectId(),
+        "studentGroup": {"bmi": "normal", "allergySig": "no-allergy", "name": "nhóm bình thường",
+                         "studentIds": [ObjectId() for _ in range(rnd.randint(5, 25))]},
+        "date": now - timedelta(days=rnd.randint(0, 30)),
+        "meals": {"breakfast": meal(2), "lunch": meal(3), "snack": meal(1)},
+        "aiModel": "gemini-2.5-flash", "generatedDate": now, "appliedToMenu": False, "createdAt": now, "updatedAt": now,
+    }
+
+def _time(fn, payload, rounds):
+    fn(payload)
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        out = fn(payload)
+    return (time.perf_counter() - t0) / rounds * 1000, len(out)
+
+def main(n_docs: int, rounds: int):
+    rnd = random.Random(7)
+    now = datetime(2025, 3, 1, 7, 30, 15, 123456)
+    payloads = {
+        "list (recommendations)": {"ok": True, "items": [_recommendation(rnd, now) for _ in range(n_docs)], "nextCursor": None},
+        "drafts (menu_draft)": {"ok": True, "items": [_draft(rnd, now) for _ in range(n_docs)], "total": n_docs},
+    }
+    print(f"encoder: {'orjson' if orjson else 'json (orjson chưa cài)'}; jsonable_encoder: {'có' if jsonable_encoder else 'không'}")
+    for name, p in payloads.items():
+        legacy_ms, legacy_len = _time(_legacy, p, rounds)
+        new_ms, new_len = _time(dumps, p, rounds)
+        assert json.loads(_legacy(p)) == json.loads(dumps(p)), name
+        print(f"{name:24} {n_docs} docs  legacy {legacy_ms:8.2f} ms ({legacy_len} B)  new {new_ms:7.2f} ms ({new_len} B)  x{legacy_ms / new_ms:.1f}")
+
+if __name__ == "__main__":
+    a = sys.argv[1:]
+    main(int(a[0]) if a else 50, int(a[1]) if len(a) > 1 else 50)
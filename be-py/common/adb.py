@@ -0,0 +1,33 @@
+# be-py/common/adb.py
+"""Truy cập Mongo async (pymongo AsyncMongoClient) cho các endpoint `async def`, cùng tên collection
+như common.db. Chỉ dùng trong event loop của app (router); job/thread nền vẫn dùng common.db.
+
+    from common import adb
+    doc = await adb.nutri_recs.find_one({"_id": oid})
+"""
+from pymongo import AsyncMongoClient
+from pymongo.errors import ConfigurationError
+from .config import MONGODB_URI
+from .db import CLIENT_OPTIONS
+
+# AsyncMongoClient chỉ kết nối ở lần thao tác đầu tiên, tạo lúc import là an toàn
+client = AsyncMongoClient(MONGODB_URI, **CLIENT_OPTIONS)
+
+try:
+    db = client.get_default_database()
+except ConfigurationError:
+    db = client["nuv2"]
+
+# Short-hands collections
+students     = db["students"]
+measurements = db["physical_measurements"]
+intakes      = db["daily_food_intake"]
+health       = db["daily_health_status"]
+nutri_recs   = db["nutritional_recommendations"]
+food_items   = db["food_items"]
+classes      = db["classes"]
+jobs         = db["jobs"]
+llm_cache    = db["llm_cache"]
+
+async def close() -> None:
+    await client.close()
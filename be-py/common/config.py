@@ -7,3 +7,108 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
 MONGODB_URI    = os.getenv("MONGODB_URI", "mongodb://127.0.0.1:27017/nuv2")
 OLLAMA_HOST    = os.getenv("OLLAMA_HOST", "http://127.0.0.1:11434")
 OLLAMA_MODEL   = os.getenv("OLLAMA_MODEL", "gpt-oss:20b")
+
+# Face gallery cache (giây); NestJS ghi faceImages trực tiếp nên cần TTL để tự làm mới
+FACE_GALLERY_TTL_SEC = float(os.getenv("FACE_GALLERY_TTL_SEC", "300"))
+
+# Face inference pool
+_CPUS = os.cpu_count() or 2
+FACE_WORKERS       = int(os.getenv("FACE_WORKERS", str(max(1, _CPUS // 2))))
+FACE_INTRA_THREADS = int(os.getenv("FACE_INTRA_THREADS", str(max(1, _CPUS // max(1, FACE_WORKERS)))))
+FACE_QUEUE_MAX     = int(os.getenv("FACE_QUEUE_MAX", "16"))
+FACE_TIMEOUT_SEC   = float(os.getenv("FACE_TIMEOUT_SEC", "20"))
+
+# Face models: chỉ nạp các module cần (buffalo_l còn genderage, landmark_2d/3d)
+FACE_MODEL_NAME = os.getenv("FACE_MODEL_NAME", "buffalo_l")
+FACE_MODULES    = [m.strip() for m in os.getenv("FACE_MODULES", "detection,recognition").split(",") if m.strip()]
+FACE_DET_SIZE   = tuple(int(x) for x in os.getenv("FACE_DET_SIZE", "640,640").split(","))
+FACE_WARMUP     = os.getenv("FACE_WARMUP", "0").lower() in ("1", "true", "yes")
+# "auto" chọn det_size theo ảnh, "fixed" luôn dùng FACE_DET_SIZE, "aligned" bỏ qua detection
+FACE_DET_MODE   = os.getenv("FACE_DET_MODE", "auto")
+
+# /face/embed_batch: giới hạn số ảnh, dung lượng mỗi ảnh và tổng dung lượng (MB, sau giải nén)
+FACE_BATCH_MAX_FILES    = int(os.getenv("FACE_BATCH_MAX_FILES", "5000"))
+FACE_BATCH_MAX_IMAGE_MB = float(os.getenv("FACE_BATCH_MAX_IMAGE_MB", "10"))
+FACE_BATCH_MAX_TOTAL_MB = float(os.getenv("FACE_BATCH_MAX_TOTAL_MB", "1024"))
+
+# LLM: số lời gọi đồng thời mỗi engine, retry khi bị rate limit
+LLM_CONCURRENCY = {
+    "gemini": int(os.getenv("GEMINI_CONCURRENCY", "5")),
+    "ollama": int(os.getenv("OLLAMA_CONCURRENCY", "1")),
+}
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_SEC = float(os.getenv("LLM_BACKOFF_SEC", "1.0"))
+# thread pool riêng cho lời gọi LLM từ code async (không dùng executor mặc định của event loop)
+LLM_POOL_WORKERS = int(os.getenv("LLM_POOL_WORKERS", str(2 * sum(LLM_CONCURRENCY.values()))))
+
+# Background jobs
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# số job chờ tối đa mỗi process (ngoài JOB_WORKERS đang chạy); quá thì từ chối (429)
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", "32"))
+# heartbeat job queued/running của process (giây); quá JOB_STALE_SEC không heartbeat -> job mồ côi, đánh failed
+JOB_HEARTBEAT_SEC = float(os.getenv("JOB_HEARTBEAT_SEC", "15"))
+JOB_STALE_SEC     = float(os.getenv("JOB_STALE_SEC", "90"))
+# job kiểm tra cancelRequested trong Mongo tối đa mỗi JOB_CANCEL_POLL_SEC (huỷ từ worker khác)
+JOB_CANCEL_POLL_SEC = float(os.getenv("JOB_CANCEL_POLL_SEC", "2"))
+
+# LLM response cache (engine + model + prompt hash)
+LLM_CACHE_SIZE    = int(os.getenv("LLM_CACHE_SIZE", "512"))
+LLM_CACHE_TTL_SEC = float(os.getenv("LLM_CACHE_TTL_SEC", "21600"))
+LLM_CACHE_MONGO   = os.getenv("LLM_CACHE_MONGO", "0").lower() in ("1", "true", "yes")
+
+# Cache số đo mới nhất theo học sinh (giây); 0 = tắt (mặc định). Chỉ bật khi nơi ghi số đo
+# gọi /nutrition/cache/measurements/invalidate, nếu không BMI có thể cũ tới hết TTL.
+MEASUREMENT_CACHE_TTL_SEC = float(os.getenv("MEASUREMENT_CACHE_TTL_SEC", "0"))
+
+# Tạo index khai báo trong common/indexes.py khi khởi động (idempotent)
+INDEX_BOOTSTRAP = os.getenv("INDEX_BOOTSTRAP", "1").lower() in ("1", "true", "yes")
+
+# Food catalog trong bộ nhớ: chu kỳ kiểm tra version (giây)
+FOOD_CATALOG_REFRESH_SEC = float(os.getenv("FOOD_CATALOG_REFRESH_SEC", "30"))
+# Ngưỡng confidence khi map tên món LLM -> food_items; thấp hơn thì để foodItemId=None
+FOOD_MATCH_MIN_CONFIDENCE = float(os.getenv("FOOD_MATCH_MIN_CONFIDENCE", "0.5"))
+
+# Ghi menu_draft theo lô trong transaction (cần replica set); mặc định insert_many(ordered=False)
+DRAFT_WRITE_TRANSACTION = os.getenv("DRAFT_WRITE_TRANSACTION", "0").lower() in ("1", "true", "yes")
+
+# LLM client: timeout mỗi lời gọi (giây), circuit breaker, chuỗi failover (vd "gemini:ollama;ollama:")
+LLM_TIMEOUT_SEC = {
+    "gemini": float(os.getenv("GEMINI_TIMEOUT_SEC", "60")),
+    "ollama": float(os.getenv("OLLAMA_TIMEOUT_SEC", "120")),
+}
+LLM_BREAKER_FAILURES     = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN_SEC = float(os.getenv("LLM_BREAKER_COOLDOWN_SEC", "30"))
+LLM_FAILOVER = {
+    k.strip(): [x.strip() for x in v.split(",") if x.strip()]
+    for k, _, v in (p.partition(":") for p in os.getenv("LLM_FAILOVER", "gemini:ollama;ollama:").split(";") if p.strip())
+}
+# Tổng thời gian tối đa cho các lời gọi LLM trong một lần lập thực đơn (giây)
+LLM_PLAN_DEADLINE_SEC = float(os.getenv("LLM_PLAN_DEADLINE_SEC", "300"))
+# Lập thực đơn: số mục (nhóm x ngày) gộp trong một lời gọi LLM
+PLAN_BATCH_SIZE = int(os.getenv("PLAN_BATCH_SIZE", "5"))
+
+# Cache tổng số bản ghi của các API danh sách (giây)
+PAGE_TOTAL_TTL_SEC = float(os.getenv("PAGE_TOTAL_TTL_SEC", "30"))
+
+# Mongo connection pool / timeouts (dùng cho cả client sync và async)
+MONGO_MAX_POOL_SIZE        = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE        = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_CONNECT_TIMEOUT_MS   = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SELECT_TIMEOUT_MS    = int(os.getenv("MONGO_SELECT_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS    = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "30000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "10000"))
+
+# Read-through cache cho /nutrition/latest và /nutrition/detail (giây); 0 = tắt.
+# READ_CACHE_REDIS_URL: tầng dùng chung giữa các worker (cần cài redis); khi bật, cache trong process
+# chỉ giữ READ_CACHE_LOCAL_TTL_SEC vì invalidate ở worker khác không xoá được bản local.
+# Không có Redis thì TTL mặc định ngắn: invalidate chỉ xoá được cache của worker nhận request ghi.
+READ_CACHE_REDIS_URL     = os.getenv("READ_CACHE_REDIS_URL", "")
+READ_CACHE_TTL_SEC       = float(os.getenv("READ_CACHE_TTL_SEC", "300" if READ_CACHE_REDIS_URL else "5"))
+READ_CACHE_SIZE          = int(os.getenv("READ_CACHE_SIZE", "5000"))
+READ_CACHE_LOCAL_TTL_SEC = float(os.getenv("READ_CACHE_LOCAL_TTL_SEC", "5"))
+
+# Chỉ mục món gần đây theo lớp (class_recent_dishes), cập nhật khi ghi menu_draft:
+# giữ bao nhiêu ngày, chu kỳ bán rã của trọng số lặp món (ngày), cache trong process (giây)
+RECENT_DISHES_KEEP_DAYS      = int(os.getenv("RECENT_DISHES_KEEP_DAYS", "30"))
+RECENT_DISHES_HALF_LIFE_DAYS = float(os.getenv("RECENT_DISHES_HALF_LIFE_DAYS", "3"))
+RECENT_DISHES_CACHE_TTL_SEC  = float(os.getenv("RECENT_DISHES_CACHE_TTL_SEC", "60"))
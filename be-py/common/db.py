@@ -1,9 +1,21 @@
 # be-py/common/db.py
 from pymongo import MongoClient
 from pymongo.errors import ConfigurationError
-from .config import MONGODB_URI
+from .config import (
+    MONGODB_URI, MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE, MONGO_CONNECT_TIMEOUT_MS,
+    MONGO_SELECT_TIMEOUT_MS, MONGO_SOCKET_TIMEOUT_MS, MONGO_WAIT_QUEUE_TIMEOUT_MS,
+)
 
-client = MongoClient(MONGODB_URI)
+CLIENT_OPTIONS = dict(
+    maxPoolSize=MONGO_MAX_POOL_SIZE,
+    minPoolSize=MONGO_MIN_POOL_SIZE,
+    connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+    serverSelectionTimeoutMS=MONGO_SELECT_TIMEOUT_MS,
+    socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+    waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+)
+
+client = MongoClient(MONGODB_URI, **CLIENT_OPTIONS)
 
 try:
     db = client.get_default_database()   
@@ -18,3 +30,5 @@ health       = db["daily_health_status"]
 nutri_recs   = db["nutritional_recommendations"]
 food_items   = db["food_items"]
 classes      = db["classes"]  
+jobs         = db["jobs"]
+llm_cache    = db["llm_cache"]
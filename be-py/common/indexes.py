@@ -0,0 +1,111 @@
+# be-py/common/indexes.py
+"""Khai báo index cho các collection be-py dùng, tạo idempotent và kiểm tra query plan.
+
+    python -m common.indexes            # tạo index còn thiếu
+    python -m common.indexes --verify   # tạo + explain các query shape, exit 1 nếu có COLLSCAN
+"""
+from typing import Any, Dict, List, Tuple
+import sys
+from bson import ObjectId
+from pymongo import ASCENDING as ASC, DESCENDING as DESC, IndexModel
+from pymongo.errors import OperationFailure
+from .db import db
+
+# không đặt name=: tên mặc định (vd "createdAt_-1") trùng với index đã tạo tay / do NestJS tạo,
+# khai báo cùng key dưới tên khác sẽ bị Mongo từ chối (IndexOptionsConflict).
+# daily_food_intake / daily_health_status: dùng index unique {studentId: 1, date: 1} của NestJS.
+INDEXES: Dict[str, List[IndexModel]] = {
+    "nutritional_recommendations": [
+        IndexModel([("studentId", ASC), ("generatedDate", DESC), ("_id", DESC)]),
+        IndexModel([("type", ASC), ("classId", ASC), ("date", DESC), ("_id", DESC)]),
+        IndexModel([("type", ASC), ("date", DESC), ("_id", DESC)]),
+        IndexModel([("createdAt", DESC)]),
+        IndexModel([("idempotencyKey", ASC), ("idempotencySeq", ASC)], unique=True,
+                   partialFilterExpression={"idempotencyKey": {"$exists": True}}),
+    ],
+    "class_recent_dishes": [
+        IndexModel([("classId", ASC), ("date", DESC), ("name", ASC)], unique=True),
+        IndexModel([("expiresAt", ASC)], expireAfterSeconds=0),
+    ],
+    "physical_measurements": [
+        IndexModel([("studentId", ASC), ("measurementDate", DESC)]),
+    ],
+    "food_items": [
+        IndexModel([("isActive", ASC)]),
+    ],
+    "student_groupings": [
+        IndexModel([("classId", ASC), ("createdAt", DESC), ("_id", DESC)]),
+    ],
+    "jobs": [
+        IndexModel([("status", ASC), ("createdAt", DESC)]),
+    ],
+    "llm_cache": [
+        IndexModel([("expiresAt", ASC)], expireAfterSeconds=0),
+    ],
+}
+
+_X = ObjectId()
+# (collection, filter, sort) — đúng dạng truy vấn mà các router/service đang chạy
+QUERY_SHAPES: List[Tuple[str, str, Dict[str, Any], List[Tuple[str, int]]]] = [
+    ("/nutrition/latest", "nutritional_recommendations", {"studentId": _X}, [("generatedDate", -1)]),
+    ("/nutrition/list", "nutritional_recommendations", {"studentId": _X}, [("generatedDate", -1), ("_id", -1)]),
+    ("/nutrition/drafts?classId", "nutritional_recommendations", {"type": "menu_draft", "classId": _X}, [("date", -1), ("_id", -1)]),
+    ("/nutrition/drafts", "nutritional_recommendations", {"type": "menu_draft"}, [("date", -1), ("_id", -1)]),
+    ("draft idempotency replay", "nutritional_recommendations", {"idempotencyKey": "x"}, [("idempotencySeq", 1)]),
+    ("planner recent dishes", "class_recent_dishes", {"classId": _X, "date": {"$gte": _X.generation_time}}, []),
+    ("context intakes", "daily_food_intake", {"studentId": {"$in": [_X]}, "date": {"$gte": _X.generation_time}}, []),
+    ("context health", "daily_health_status", {"studentId": {"$in": [_X]}, "date": {"$gte": _X.generation_time}}, [("studentId", 1), ("date", -1)]),
+    ("latest measurements", "physical_measurements", {"studentId": {"$in": [_X]}}, [("studentId", 1), ("measurementDate", -1)]),
+    ("food catalog", "food_items", {"isActive": True}, []),
+    ("/nutrition/group/list", "student_groupings", {"classId": _X}, [("createdAt", -1), ("_id", -1)]),
+]
+
+def ensure_indexes() -> Dict[str, List[str]]:
+    """Tạo các index đã khai báo; gọi lại nhiều lần không sao. Trả tên index theo collection.
+    Tạo từng index riêng: một index xung đột chỉ bỏ qua index đó, không cả collection."""
+    out: Dict[str, List[str]] = {}
+    for coll, models in INDEXES.items():
+        out[coll] = []
+        for m in models:
+            try:
+                out[coll] += db[coll].create_indexes([m])
+            except OperationFailure as e:
+                # index cùng key nhưng khác tên/tuỳ chọn đã tồn tại (tạo tay trước đây) -> giữ nguyên
+                out[coll].append(f"skipped {m.document['name']}: {e.details.get('errmsg') if e.details else e}")
+    return out
+
+def _stages(plan: Dict[str, Any]) -> List[str]:
+    out = [plan.get("stage", "")]
+    for k in ("inputStage", "queryPlan"):
+        if isinstance(plan.get(k), dict):
+            out += _stages(plan[k])
+    for sub in plan.get("inputStages", []) or []:
+        out += _stages(sub)
+    return out
+
+def verify_query_plans() -> List[Dict[str, Any]]:
+    """explain() từng query shape; mỗi phần tử có "collscan": True nếu winning plan quét toàn collection."""
+    report = []
+    for label, coll, flt, sort in QUERY_SHAPES:
+        cur = db[coll].find(flt)
+        if sort:
+            cur = cur.sort(sort)
+        plan = cur.limit(1).explain().get("queryPlanner", {}).get("winningPlan", {})
+        stages = _stages(plan)
+        report.append({"query": label, "collection": coll, "stages": stages, "collscan": "COLLSCAN" in stages})
+    return report
+
+def main(argv: List[str]) -> int:
+    for coll, names in ensure_indexes().items():
+        print(f"[index] {coll}: {', '.join(names)}")
+    if "--verify" not in argv:
+        return 0
+    bad = 0
+    for r in verify_query_plans():
+        flag = "COLLSCAN" if r["collscan"] else "ok"
+        print(f"[plan] {flag:8} {r['query']} ({r['collection']}): {' <- '.join(r['stages'])}")
+        bad += r["collscan"]
+    return 1 if bad else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,120 @@
+# be-py/common/paging.py
+"""Phân trang keyset (cursor) cho các API danh sách.
+
+    items, next_cursor, total = keyset_page(coll, q, [("date", -1), ("_id", -1)], limit, cursor, projection)
+    items, next_cursor, total = await akeyset_page(adb_coll, ...)   # cùng tham số, collection async
+
+Cursor là base64 của giá trị sort của phần tử cuối trang (opaque với client); sort phải kết thúc bằng _id
+để thứ tự là duy nhất. Tổng số (count_documents) là tuỳ chọn và được cache ngắn hạn theo (collection, filter).
+"""
+from typing import Any, Dict, List, Optional, Tuple
+from datetime import datetime
+import base64, json
+from bson import ObjectId
+from common.lru import TTLCache
+from common.config import PAGE_TOTAL_TTL_SEC
+
+class BadCursor(ValueError):
+    pass
+
+def _enc(v: Any) -> Any:
+    if isinstance(v, ObjectId):
+        return {"$o": str(v)}
+    if isinstance(v, datetime):
+        return {"$d": v.isoformat()}
+    return v
+
+def _dec(v: Any) -> Any:
+    # chỉ nhận scalar hoặc {"$o"}/{"$d"}: object/list khác sẽ thành toán tử Mongo trong filter
+    if v is None or isinstance(v, (str, int, float, bool)):
+        return v
+    if isinstance(v, dict) and len(v) == 1 and isinstance(next(iter(v.values())), str):
+        if "$o" in v:
+            return ObjectId(v["$o"])
+        if "$d" in v:
+            return datetime.fromisoformat(v["$d"])
+    raise ValueError("bad cursor value")
+
+def _get(doc: Dict[str, Any], path: str) -> Any:
+    for part in path.split("."):
+        doc = (doc or {}).get(part)
+    return doc
+
+def encode_cursor(doc: Dict[str, Any], sort: List[Tuple[str, int]]) -> str:
+    raw = json.dumps([_enc(_get(doc, f)) for f, _ in sort], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, sort: List[Tuple[str, int]]) -> List[Any]:
+    try:
+        vals = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(vals, list) or len(vals) != len(sort):
+            raise ValueError
+        return [_dec(v) for v in vals]
+    except Exception:
+        raise BadCursor("Invalid cursor")
+
+def after(sort: List[Tuple[str, int]], values: List[Any]) -> Dict[str, Any]:
+    """Filter "đứng sau" values theo thứ tự sort: (a < va) OR (a = va AND b < vb) ..."""
+    ors = []
+    for i, (f, d) in enumerate(sort):
+        clause = {sort[j][0]: values[j] for j in range(i)}
+        clause[f] = {"$lt" if d < 0 else "$gt": values[i]}
+        ors.append(clause)
+    return {"$or": ors}
+
+_totals = TTLCache(maxsize=1024, ttl=PAGE_TOTAL_TTL_SEC)
+
+def _total_key(coll, q: Dict[str, Any]) -> Tuple[str, str]:
+    return (coll.name, repr(sorted(q.items())))
+
+def cached_total(coll, q: Dict[str, Any]) -> int:
+    return _totals.get_or_set(_total_key(coll, q), lambda: coll.count_documents(q))
+
+async def acached_total(coll, q: Dict[str, Any]) -> int:
+    key = _total_key(coll, q)
+    n = _totals.get(key)
+    if n is None:
+        n = await coll.count_documents(q)
+        _totals.set(key, n)
+    return n
+
+def _page_filter(q: Dict[str, Any], sort: List[Tuple[str, int]], cursor: Optional[str]) -> Dict[str, Any]:
+    if cursor:
+        return {"$and": [q, after(sort, decode_cursor(cursor, sort))]}
+    return dict(q)
+
+def _cut(docs: List[Dict[str, Any]], sort: List[Tuple[str, int]], limit: int) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    more = len(docs) > limit
+    docs = docs[:limit]
+    return docs, (encode_cursor(docs[-1], sort) if more and docs else None)
+
+def keyset_page(
+    coll,
+    q: Dict[str, Any],
+    sort: List[Tuple[str, int]],
+    limit: int,
+    cursor: Optional[str] = None,
+    projection: Optional[Dict[str, Any]] = None,
+    with_total: bool = False,
+) -> Tuple[List[Dict[str, Any]], Optional[str], Optional[int]]:
+    """(items, nextCursor hoặc None nếu hết, total hoặc None). Lấy limit+1 để biết còn trang sau."""
+    flt = _page_filter(q, sort, cursor)
+    docs, nxt = _cut(list(coll.find(flt, projection).sort(sort).limit(limit + 1)), sort, limit)
+    total = cached_total(coll, q) if with_total else None
+    return docs, nxt, total
+
+async def akeyset_page(
+    coll,
+    q: Dict[str, Any],
+    sort: List[Tuple[str, int]],
+    limit: int,
+    cursor: Optional[str] = None,
+    projection: Optional[Dict[str, Any]] = None,
+    with_total: bool = False,
+) -> Tuple[List[Dict[str, Any]], Optional[str], Optional[int]]:
+    """Như keyset_page với collection của common.adb."""
+    flt = _page_filter(q, sort, cursor)
+    docs = await coll.find(flt, projection).sort(sort).limit(limit + 1).to_list()
+    docs, nxt = _cut(docs, sort, limit)
+    total = await acached_total(coll, q) if with_total else None
+    return docs, nxt, total
@@ -0,0 +1,136 @@
+# be-py/common/read_cache.py
+"""Cache read-through cho response JSON đã encode, kèm ETag (If-None-Match -> 304).
+
+    entry = await aget_or_load(("latest", sid), load)    # load: async () -> payload | None (None = không cache)
+    return respond(entry, if_none_match)
+
+Tầng 1 là TTLCache trong process; tầng 2 (tuỳ chọn) là Redis khi đặt READ_CACHE_REDIS_URL và cài redis.
+Write path gọi invalidate(...) ngay sau khi ghi; key có thể kèm version của doc (vd updatedAt) để
+thay đổi từ nơi khác (NestJS) không cần invalidate.
+"""
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+import hashlib, threading
+from fastapi.responses import Response
+from common.lru import TTLCache
+from common.responses import dumps
+from common.config import READ_CACHE_TTL_SEC, READ_CACHE_SIZE, READ_CACHE_REDIS_URL, READ_CACHE_LOCAL_TTL_SEC
+
+try:
+    import redis
+    import redis.asyncio
+except ImportError:        # redis là tuỳ chọn
+    redis = None
+
+Entry = Tuple[str, bytes]        # (etag, body)
+
+_shared = bool(READ_CACHE_REDIS_URL) and redis is not None
+_local = TTLCache(maxsize=READ_CACHE_SIZE, ttl=READ_CACHE_LOCAL_TTL_SEC if _shared else READ_CACHE_TTL_SEC or 1)
+_counters = {"loads": 0, "notModified": 0, "invalidations": 0, "redisHits": 0, "redisMisses": 0, "redisErrors": 0}
+_lock = threading.Lock()
+# tăng mỗi lần invalidate; load bắt đầu trước đó thì không ghi vào cache (tránh ghi đè bằng dữ liệu cũ)
+_epoch = 0
+_aredis = None
+_redis = None
+
+def _bump(name: str) -> None:
+    with _lock:
+        _counters[name] += 1
+
+def _rkey(key: Tuple[Hashable, ...]) -> str:
+    return "nuv2:rc:" + ":".join(str(k) for k in key)
+
+def _async_redis():
+    global _aredis
+    if _shared and _aredis is None:
+        _aredis = redis.asyncio.Redis.from_url(READ_CACHE_REDIS_URL)
+    return _aredis
+
+def _sync_redis():
+    global _redis
+    if _shared and _redis is None:
+        _redis = redis.Redis.from_url(READ_CACHE_REDIS_URL)
+    return _redis
+
+def etag_of(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+async def aget(key: Tuple[Hashable, ...]) -> Optional[Entry]:
+    hit = _local.get(key)
+    if hit is not None or not _shared:
+        return hit
+    epoch = _epoch
+    try:
+        raw = await _async_redis().get(_rkey(key))
+    except Exception:
+        _bump("redisErrors")
+        return None
+    if raw is None:
+        _bump("redisMisses")
+        return None
+    etag, body = raw.split(b"\n", 1)
+    hit = (etag.decode(), body)
+    # invalidate chạy trong lúc chờ Redis: giá trị vừa đọc có thể đã bị xoá, không đưa lại vào cache local
+    if epoch == _epoch:
+        _local.set(key, hit)
+    _bump("redisHits")
+    return hit
+
+async def aset(key: Tuple[Hashable, ...], body: bytes, epoch: Optional[int] = None) -> Entry:
+    entry = (etag_of(body), body)
+    if READ_CACHE_TTL_SEC <= 0 or (epoch is not None and epoch != _epoch):
+        return entry
+    _local.set(key, entry)
+    if _shared:
+        try:
+            await _async_redis().set(_rkey(key), entry[0].encode() + b"\n" + body, ex=max(1, int(READ_CACHE_TTL_SEC)))
+        except Exception:
+            _bump("redisErrors")
+    return entry
+
+async def aget_or_load(key: Tuple[Hashable, ...], load: Callable[[], Awaitable[Any]]) -> Optional[Entry]:
+    """Entry từ cache, nếu không có thì gọi load(); load trả None -> trả None và không cache."""
+    hit = await aget(key)
+    if hit is not None:
+        return hit
+    epoch = _epoch
+    _bump("loads")
+    payload = await load()
+    if payload is None:
+        return None
+    return await aset(key, dumps(payload), epoch)
+
+def invalidate(*keys: Tuple[Hashable, ...]) -> None:
+    """Xoá các key (cả Redis nếu bật); không truyền key = xoá toàn bộ cache trong process."""
+    global _epoch
+    with _lock:
+        _epoch += 1
+        _counters["invalidations"] += 1
+    if not keys:
+        _local.clear()
+        return
+    for k in keys:
+        _local.pop(k)
+    if _shared:
+        try:
+            _sync_redis().delete(*(_rkey(k) for k in keys))
+        except Exception:
+            _bump("redisErrors")
+
+def _matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    return any(t.strip().removeprefix("W/") == etag for t in if_none_match.split(","))
+
+def respond(entry: Entry, if_none_match: Optional[str] = None) -> Response:
+    etag, body = entry
+    # no-cache: client được giữ bản sao nhưng phải hỏi lại (rẻ, thường là 304)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if if_none_match and _matches(if_none_match, etag):
+        _bump("notModified")
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        out = dict(_counters)
+    return {**out, "shared": _shared, "local": _local.stats()}
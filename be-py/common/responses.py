@@ -0,0 +1,49 @@
+# be-py/common/responses.py
+"""Encode response JSON trực tiếp từ document Mongo (ObjectId, datetime, Decimal128...), không cần
+_stringify/jsonable_encoder. Dùng orjson nếu có, nếu không thì json chuẩn với cùng default hook.
+
+Trả `BSONResponse(...)` từ endpoint để bỏ qua jsonable_encoder của FastAPI; app cũng đặt nó làm
+default_response_class cho các endpoint trả dict.
+"""
+from typing import Any
+from datetime import date, datetime
+import base64, json
+from bson import ObjectId, Decimal128
+from bson.binary import Binary
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:        # orjson là tuỳ chọn
+    orjson = None
+
+def _default(o: Any) -> Any:
+    if isinstance(o, ObjectId):
+        return str(o)
+    if isinstance(o, (datetime, date)):        # chỉ tới đây khi dùng json chuẩn; orjson tự encode
+        return o.isoformat()
+    if isinstance(o, Decimal128):
+        return float(o.to_decimal())
+    if isinstance(o, (bytes, Binary)):
+        return base64.b64encode(bytes(o)).decode()
+    if isinstance(o, (set, frozenset, tuple)):
+        return list(o)
+    if hasattr(o, "tolist"):                  # numpy scalar/array
+        return o.tolist()
+    raise TypeError(f"Type is not JSON serializable: {type(o).__name__}")
+
+if orjson is not None:
+    # datetime naive -> "2025-01-02T00:00:00", giống isoformat() của _stringify trước đây
+    _OPTS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, default=_default, option=_OPTS)
+else:
+    def dumps(obj: Any) -> bytes:
+        return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+class BSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
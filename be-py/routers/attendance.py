@@ -1,140 +1,295 @@
 # be-py/routers/attendance.py
 from fastapi import APIRouter, UploadFile, File, Form
-from fastapi.responses import JSONResponse
-from typing import List, Optional
+from fastapi.responses import StreamingResponse
+from common.responses import BSONResponse, dumps
+from typing import Awaitable, Callable, List, Optional, Tuple
 import numpy as np
-import cv2, base64, json
-from insightface.app import FaceAnalysis
-
-face_app = FaceAnalysis(name='buffalo_l', providers=['CPUExecutionProvider'])
-face_app.prepare(ctx_id=0, det_size=(640, 640))
+import cv2, json, asyncio, contextlib, functools
+from bson.errors import InvalidId
+from services.face_matcher import Gallery, match_faces
+from services import face_gallery
+from services.face_batch import open_zip_images, read_zip_image, embed_one, MAX_IMAGE_BYTES, MAX_TOTAL_BYTES
+from services.face_engine import face_pool, InferenceBusy, InferenceTimeout
+from services import face_pipeline
+from utils.aio import bounded_as_completed, finish_on_cancel
+from common.config import FACE_MODEL_NAME, FACE_BATCH_MAX_IMAGE_MB, FACE_BATCH_MAX_TOTAL_MB
 
 router = APIRouter()
 
+def _overload_response(e: Exception) -> BSONResponse:
+    code = 429 if isinstance(e, InferenceBusy) else 504
+    return BSONResponse({"ok": False, "message": str(e)}, status_code=code)
+
+def _bad_det_mode(mode: Optional[str]) -> Optional[BSONResponse]:
+    if mode and mode.lower() not in face_pipeline.DET_MODES:
+        return BSONResponse({"ok": False, "message": f"detMode phải là một trong {', '.join(face_pipeline.DET_MODES)}"},
+                            status_code=400)
+    return None
+
 def _read_image_to_bgr(image_bytes: bytes) -> np.ndarray:
     arr = np.frombuffer(image_bytes, np.uint8)
     img = cv2.imdecode(arr, cv2.IMREAD_COLOR)  
     return img
 
-def _best_face_embedding(img_bgr: np.ndarray) -> Optional[np.ndarray]:
-    faces = face_app.get(img_bgr)
-    if not faces:
-        return None
+def _best_face_embedding(face_app, image_bytes: bytes, mode: Optional[str] = None) -> Tuple[Optional[np.ndarray], dict]:
+    faces, emb, metrics = face_pipeline.run(face_app, _read_image_to_bgr(image_bytes), mode, expected_faces=1)
+    if emb is not None or not faces:
+        return emb, metrics
     f = max(faces, key=lambda x: getattr(x, "det_score", 0.0))
     emb = getattr(f, "normed_embedding", None)
-    return emb
-
-def _decode_embedding(b64: str) -> Optional[np.ndarray]:
-    try:
-        buf = base64.b64decode(b64.encode("ascii"))
-        return np.frombuffer(buf, dtype=np.float32)
-    except Exception:
-        return None
+    return emb, metrics
 
-def _cosine(a: np.ndarray, b: np.ndarray) -> float:
-    return float(np.dot(a, b))
+def _all_faces(face_app, image_bytes: bytes, mode: Optional[str] = None) -> Tuple[list, dict]:
+    # ảnh nhiều mặt không có fast path "aligned"
+    if (mode or "").lower() == "aligned":
+        mode = "auto"
+    faces, _, metrics = face_pipeline.run(face_app, _read_image_to_bgr(image_bytes), mode, expected_faces=20)
+    return faces, metrics
 
 @router.get("/health")
 def health():
-    return {"ok": True, "service": "attendance", "model": "buffalo_l"}
+    return {
+        "ok": True, "service": "attendance", "model": FACE_MODEL_NAME,
+        "pool": face_pool.stats(), "paths": face_pipeline.path_stats(),
+    }
+
+@router.post("/warmup")
+async def warmup():
+    try:
+        return {"ok": True, "pool": await asyncio.to_thread(face_pool.warmup)}
+    except Exception as e:
+        return BSONResponse({"ok": False, "message": str(e)}, status_code=500)
 
 @router.post("/embed")
-async def embed(image: UploadFile = File(...)):
+async def embed(
+    image: UploadFile = File(...),
+    detMode: Optional[str] = Form(None),      # auto | fixed | aligned
+):
+    bad = _bad_det_mode(detMode)
+    if bad:
+        return bad
     try:
         content = await image.read()
-        img = _read_image_to_bgr(content)
-        emb = _best_face_embedding(img)
+        emb, metrics = await face_pool.run(_best_face_embedding, content, detMode)
+        if emb is None:
+            return BSONResponse({"ok": False, "message": "Không phát hiện khuôn mặt", "metrics": metrics}, status_code=200)
+        b64 = face_gallery.encode_embedding(emb)
+        return {"ok": True, "embedding": b64, "metrics": metrics}
+    except (InferenceBusy, InferenceTimeout) as e:
+        return _overload_response(e)
+    except Exception as e:
+        return BSONResponse({"ok": False, "message": str(e)}, status_code=500)
+
+@router.post("/embed_batch")
+async def embed_batch(
+    images: Optional[List[UploadFile]] = File(None),
+    archive: Optional[UploadFile] = File(None),   # zip chứa nhiều ảnh
+):
+    """Trả NDJSON: mỗi dòng một ảnh (theo thứ tự xử lý xong), dòng cuối là tổng kết.
+    Ảnh được đọc khi tới lượt (tối đa face_pool.workers ảnh cùng lúc), không nạp cả lô/zip vào RAM."""
+    uploads = list(images or [])
+    if sum(f.size or 0 for f in uploads) > MAX_TOTAL_BYTES:
+        return BSONResponse({"ok": False, "message": f"Tổng dung lượng ảnh vượt quá {FACE_BATCH_MAX_TOTAL_MB:g} MB"},
+                            status_code=400)
+    sources: List[Tuple[str, Callable[[], Awaitable[bytes]]]] = []
+    for f in uploads:
+        sources.append((f.filename or "image", lambda f=f: _read_upload(f)))
+    zf = None
+    if archive is not None:
+        try:
+            zf, infos = await asyncio.to_thread(open_zip_images, archive.file)
+        except Exception as e:
+            return BSONResponse({"ok": False, "message": f"Zip không hợp lệ: {e}"}, status_code=400)
+        for info in infos:
+            sources.append((info.filename, lambda info=info: asyncio.to_thread(read_zip_image, zf, info)))
+    if not sources:
+        return BSONResponse({"ok": False, "message": "Thiếu images hoặc archive"}, status_code=400)
+
+    async def one(name: str, load: Callable[[], Awaitable[bytes]]) -> dict:
+        try:
+            # thread đọc zip phải xong trước khi archive bị đóng, kể cả khi client ngắt kết nối
+            data = await finish_on_cancel(load())
+        except Exception as e:
+            return {"file": name, "ok": False, "message": str(e)}
+        try:
+            return await face_pool.run(embed_one, name, data)
+        except (InferenceBusy, InferenceTimeout) as e:
+            return {"file": name, "ok": False, "message": str(e)}
+
+    async def gen():
+        # tự giới hạn số ảnh gửi vào pool cùng lúc để batch không chiếm hết hàng đợi của request khác;
+        # ảnh chỉ được đọc khi tới lượt
+        calls = [functools.partial(one, name, load) for name, load in sources]
+        done = failed = 0
+        try:
+            # aclosing: client ngắt ở yield thì đóng ngay generator bên trong (huỷ và chờ các ảnh đang xử lý)
+            async with contextlib.aclosing(bounded_as_completed(calls, face_pool.workers)) as results:
+                async for i, rec in results:
+                    if isinstance(rec, Exception):
+                        rec = {"file": sources[i][0], "ok": False, "message": str(rec)}
+                    done += 1
+                    failed += 0 if rec.get("ok") else 1
+                    rec["progress"] = {"done": done, "total": len(sources)}
+                    yield dumps(rec) + b"\n"
+        finally:
+            if zf is not None:
+                zf.close()
+        yield dumps({"summary": True, "total": len(sources), "ok": done - failed, "failed": failed}) + b"\n"
+
+    return StreamingResponse(gen(), media_type="application/x-ndjson")
+
+async def _read_upload(f: UploadFile) -> bytes:
+    data = await f.read(MAX_IMAGE_BYTES + 1)
+    if len(data) > MAX_IMAGE_BYTES:
+        raise ValueError(f"Ảnh vượt quá {FACE_BATCH_MAX_IMAGE_MB:g} MB")
+    return data
+
+def _resolve_gallery(gallery: Optional[str], classId: Optional[str]) -> Gallery:
+    if classId:
+        return face_gallery.get_class_gallery(classId)
+    if gallery:
+        return Gallery.from_items(json.loads(gallery))
+    raise ValueError("Thiếu classId hoặc gallery")
+
+async def _embeddings_from_request(image: Optional[UploadFile], embeddings: Optional[str]) -> List[str]:
+    out: List[str] = []
+    if embeddings:
+        arr = json.loads(embeddings)
+        out.extend([arr] if isinstance(arr, str) else [x for x in arr if x])
+    if image is not None:
+        emb, _ = await face_pool.run(_best_face_embedding, await image.read())
         if emb is None:
-            return JSONResponse({"ok": False, "message": "Không phát hiện khuôn mặt"}, status_code=200)
-        b64 = base64.b64encode(emb.astype(np.float32).tobytes()).decode("ascii")
-        return {"ok": True, "embedding": b64}
+            raise ValueError("Không phát hiện khuôn mặt")
+        out.append(face_gallery.encode_embedding(emb))
+    return out
+
+@router.post("/gallery/{studentId}")
+async def gallery_register(
+    studentId: str,
+    image: Optional[UploadFile] = File(None),
+    embeddings: Optional[str] = Form(None),    # JSON: ["<b64>", ...]
+):
+    try:
+        embs = await _embeddings_from_request(image, embeddings)
+        if not embs:
+            return BSONResponse({"ok": False, "message": "Thiếu image hoặc embeddings"}, status_code=400)
+        n = face_gallery.add_embeddings(studentId, embs)
+        return {"ok": True, "studentId": studentId, "added": n}
+    except (InferenceBusy, InferenceTimeout) as e:
+        return _overload_response(e)
+    except (ValueError, InvalidId) as e:
+        return BSONResponse({"ok": False, "message": str(e)}, status_code=400)
+    except Exception as e:
+        return BSONResponse({"ok": False, "message": str(e)}, status_code=500)
+
+@router.put("/gallery/{studentId}")
+async def gallery_update(
+    studentId: str,
+    image: Optional[UploadFile] = File(None),
+    embeddings: Optional[str] = Form(None),
+):
+    try:
+        embs = await _embeddings_from_request(image, embeddings)
+        n = face_gallery.replace_embeddings(studentId, embs)
+        return {"ok": True, "studentId": studentId, "count": n}
+    except (InferenceBusy, InferenceTimeout) as e:
+        return _overload_response(e)
+    except (ValueError, InvalidId) as e:
+        return BSONResponse({"ok": False, "message": str(e)}, status_code=400)
     except Exception as e:
-        return JSONResponse({"ok": False, "message": str(e)}, status_code=500)
+        return BSONResponse({"ok": False, "message": str(e)}, status_code=500)
+
+@router.delete("/gallery/{studentId}")
+def gallery_delete(studentId: str, faceId: Optional[str] = None):
+    try:
+        face_gallery.delete_embeddings(studentId, faceId)
+        return {"ok": True, "studentId": studentId}
+    except (ValueError, InvalidId) as e:
+        return BSONResponse({"ok": False, "message": str(e)}, status_code=400)
+    except Exception as e:
+        return BSONResponse({"ok": False, "message": str(e)}, status_code=500)
+
+@router.post("/gallery/class/{classId}/reload")
+def gallery_reload(classId: str):
+    face_gallery.invalidate(classId)
+    try:
+        gal = face_gallery.get_class_gallery(classId)
+    except InvalidId as e:
+        return BSONResponse({"ok": False, "message": str(e)}, status_code=400)
+    return {"ok": True, "classId": classId, "students": len(gal)}
 
 @router.post("/match")
 async def match(
     image: UploadFile = File(...),
-    gallery: str = Form(...),             
+    gallery: Optional[str] = Form(None),      # payload cũ: JSON base64 embeddings
+    classId: Optional[str] = Form(None),      # dùng gallery lưu sẵn phía server
     threshold: float = Form(0.45),        
+    detMode: Optional[str] = Form(None),      # "aligned": ảnh đã crop sẵn một mặt
 ):
+    bad = _bad_det_mode(detMode)
+    if bad:
+        return bad
     try:
         content = await image.read()
-        img = _read_image_to_bgr(content)
-        probe = _best_face_embedding(img)
+        probe, metrics = await face_pool.run(_best_face_embedding, content, detMode)
         if probe is None:
-            return {"ok": False, "message": "Không phát hiện khuôn mặt"}
-
-        gal: List[dict] = json.loads(gallery)
-        best_id, best_sim = None, -1.0
-        for item in gal:
-            sid = item.get("studentId")
-            emb_b64 = item.get("embedding") or ""
-            gal_emb = _decode_embedding(emb_b64)
-            if gal_emb is None or gal_emb.shape[0] == 0:
-                continue
-            sim = _cosine(probe, gal_emb)
-            if sim > best_sim:
-                best_sim, best_id = sim, sid
-
-        if best_id is None or best_sim < threshold:
-            return {"ok": False, "message": "Không có ai vượt ngưỡng"}
+            return {"ok": False, "message": "Không phát hiện khuôn mặt", "metrics": metrics}
+
+        gal = await asyncio.to_thread(_resolve_gallery, gallery, classId)
+        res = match_faces(probe, gal, threshold, top_k=1)
+        best = res[0]["best"] if res else None
+        if not best:
+            return {"ok": False, "message": "Không có ai vượt ngưỡng", "metrics": metrics}
 
         return {
             "ok": True,
-            "studentId": best_id,
-            "similarity": best_sim * 100.0,  
+            "studentId": best["studentId"],
+            "similarity": best["similarity"],  
+            "metrics": metrics,
         }
+    except (InferenceBusy, InferenceTimeout) as e:
+        return _overload_response(e)
+    except (ValueError, InvalidId) as e:
+        return BSONResponse({"ok": False, "message": str(e)}, status_code=400)
     except Exception as e:
-        return JSONResponse({"ok": False, "message": str(e)}, status_code=500)
+        return BSONResponse({"ok": False, "message": str(e)}, status_code=500)
 
 @router.post("/match_many")
 async def match_many(
     image: UploadFile = File(...),
-    gallery: str = Form(...),              
+    gallery: Optional[str] = Form(None),
+    classId: Optional[str] = Form(None),
     threshold: float = Form(0.45),
+    detMode: Optional[str] = Form(None),
 ):
+    bad = _bad_det_mode(detMode)
+    if bad:
+        return bad
     try:
         content = await image.read()
-        img = _read_image_to_bgr(content)
-        faces = face_app.get(img)
+        faces, metrics = await face_pool.run(_all_faces, content, detMode)
         if not faces:
-            return {"ok": False, "message": "Không phát hiện khuôn mặt"}
+            return {"ok": False, "message": "Không phát hiện khuôn mặt", "metrics": metrics}
 
-        gal: List[dict] = json.loads(gallery)
-        parsed = []
-        gal_vecs = []
-        for it in gal:
-            sid = it.get("studentId")
-            emb_b64 = it.get("embedding") or ""
-            vec = _decode_embedding(emb_b64)
-            if vec is not None and vec.shape[0] > 0:
-                gal_vecs.append((sid, vec))
-
-        for f in faces:
-            emb = getattr(f, "normed_embedding", None)
-            if emb is None:
-                continue
-            # so khớp
-            best_id, best_sim = None, -1.0
-            cands = []
-            for sid, vec in gal_vecs:
-                sim = _cosine(emb, vec)
-                cands.append({"studentId": sid, "similarity": sim * 100.0})
-                if sim > best_sim:
-                    best_sim, best_id = sim, sid
+        gal = await asyncio.to_thread(_resolve_gallery, gallery, classId)
+        faces = [f for f in faces if getattr(f, "normed_embedding", None) is not None]
+        if not faces:
+            return {"ok": True, "faces": [], "metrics": metrics}
+
+        # so khớp toàn bộ khuôn mặt với gallery trong một phép nhân ma trận
+        probes = np.stack([f.normed_embedding for f in faces])
+        results = match_faces(probes, gal, threshold, top_k=5)
 
+        parsed = []
+        for f, r in zip(faces, results):
             box = getattr(f, "bbox", None)
             box_list = list(map(float, box)) if box is not None else []
+            parsed.append({"box": box_list, "best": r["best"], "candidates": r["candidates"]})
 
-            parsed.append({
-                "box": box_list,
-                "best": (best_id and best_sim >= threshold) and {
-                    "studentId": best_id,
-                    "similarity": best_sim * 100.0
-                } or None,
-                "candidates": sorted(cands, key=lambda x: x["similarity"], reverse=True)[:5]
-            })
-
-        return {"ok": True, "faces": parsed}
+        return {"ok": True, "faces": parsed, "metrics": metrics}
+    except (InferenceBusy, InferenceTimeout) as e:
+        return _overload_response(e)
+    except (ValueError, InvalidId) as e:
+        return BSONResponse({"ok": False, "message": str(e)}, status_code=400)
     except Exception as e:
-        return JSONResponse({"ok": False, "message": str(e)}, status_code=500)
+        return BSONResponse({"ok": False, "message": str(e)}, status_code=500)
@@ -0,0 +1,48 @@
+# be-py/routers/jobs.py
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel, Field
+from typing import Dict, Any
+from bson.errors import InvalidId
+from services import jobs as job_service
+
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+class SubmitReq(BaseModel):
+    kind: str = Field(..., pattern="^(generate-class|plan-menus|group-analyze)$")
+    params: Dict[str, Any] = Field(default_factory=dict)
+
+def _get_or_404(id: str, with_result: bool = False) -> Dict[str, Any]:
+    try:
+        d = job_service.get(id, with_result)
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Invalid id")
+    if not d:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return d
+
+@router.post("")
+def submit_ep(req: SubmitReq):
+    try:
+        job_id = job_service.submit(req.kind, req.params)
+    except job_service.JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"ok": True, "jobId": job_id, "status": "queued"}
+
+@router.get("/{id}")
+def status_ep(id: str):
+    return {"ok": True, "item": _get_or_404(id)}
+
+@router.get("/{id}/result")
+def result_ep(id: str):
+    d = _get_or_404(id, with_result=True)
+    if d["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Job {d['status']}")
+    return d.get("result") or {}
+
+@router.post("/{id}/cancel")
+def cancel_ep(id: str):
+    _get_or_404(id)
+    status = job_service.cancel(id)
+    return {"ok": True, "status": status, "cancelRequested": status in ("queued", "running")}
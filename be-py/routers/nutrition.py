@@ -4,30 +4,21 @@ from services.nutrition_service import generate_single, generate_for_class, plan
 from bson import ObjectId
 from datetime import datetime
 from common.db import nutri_recs, students
-from fastapi import APIRouter, Body, Query, HTTPException
+from fastapi import APIRouter, Body, Query, HTTPException, Header
 from typing import Literal
 from services.nutrition_service import (
-    generate_single, generate_for_class,
-    plan_menus_for_class, plan_menus_for_student
+    generate_single, agenerate_for_class, iter_generate_for_class,
+    plan_menus_for_class, plan_menus_for_student,
+    iter_plan_menus_for_class, iter_plan_menus_for_student,
 )
+from utils.stream import stream_records, wants_sse
+from common.responses import BSONResponse
+from common.paging import akeyset_page, acached_total, encode_cursor, BadCursor
+from common import adb, read_cache
 
 
 from datetime import datetime
 
-def _stringify(obj):
-    """Đệ quy: ObjectId -> str, datetime -> iso, list/dict -> map lại."""
-    if isinstance(obj, ObjectId):
-        return str(obj)
-    if isinstance(obj, datetime):
-        
-        return obj.isoformat()
-    if isinstance(obj, list):
-        return [_stringify(x) for x in obj]
-    if isinstance(obj, dict):
-        return {k: _stringify(v) for k, v in obj.items()}
-    return obj
-
-
 router = APIRouter()
 
 @router.post("/generate")
@@ -35,92 +26,212 @@ def generate(
     studentId: str = Body(...),
     period: Literal["day","week"] = Body("day"),
     engine: Literal["gemini","ollama"] = Body("gemini"),
+    noCache: bool = Body(False),
 ):
-    return generate_single(studentId, period, engine)
+    return generate_single(studentId, period, engine, use_cache=not noCache)
 
 @router.post("/generate-class")
-def generate_class(
+async def generate_class(
+    classId: str = Body(...),
+    period: Literal["day","week"] = Body("day"),
+    engine: Literal["gemini","ollama"] = Body("gemini"),
+    noCache: bool = Body(False),
+):
+    return await agenerate_for_class(classId, period, engine, use_cache=not noCache)
+
+@router.post("/generate-class/stream")
+async def generate_class_stream(
     classId: str = Body(...),
     period: Literal["day","week"] = Body("day"),
     engine: Literal["gemini","ollama"] = Body("gemini"),
+    noCache: bool = Body(False),
+    format: str | None = Query(None, description='"ndjson" (mặc định) | "sse"'),
+    accept: str | None = Header(None),
 ):
-    return generate_for_class(classId, period, engine)
+    """Mỗi học sinh một bản ghi ngay khi xong (kèm progress), bản ghi cuối là summary."""
+    async def records():
+        ok = failed = 0
+        async for it in iter_generate_for_class(classId, period, engine, use_cache=not noCache):
+            failed += 1 if it.get("error") else 0
+            ok += 0 if it.get("error") else 1
+            yield it
+        yield {"summary": True, "ok": True, "classId": classId, "total": ok + failed, "succeeded": ok, "failed": failed}
+    return stream_records(records(), wants_sse(format, accept))
+
+@router.get("/llm-cache")
+def llm_cache_stats():
+    from ai.cache import stats
+    return {"ok": True, "stats": stats()}
+
+@router.get("/llm-stats")
+def llm_stats():
+    from ai import llm, structured
+    return {"ok": True, "engines": llm.stats(), "parsing": structured.stats()}
+
+@router.post("/cache/measurements/invalidate")
+def invalidate_measurements(studentIds: list[str] | None = Body(None, embed=True)):
+    from services.measurement_service import invalidate
+    invalidate(studentIds)
+    return {"ok": True}
+
+@router.post("/cache/recommendations/invalidate")
+def invalidate_recommendations(studentIds: list[str] | None = Body(None, embed=True)):
+    """Xoá /latest đã cache của các học sinh (ghi gợi ý ngoài be-py); không truyền gì = xoá hết.
+    /detail không cần: key gồm updatedAt của doc."""
+    read_cache.invalidate(*(("latest", s) for s in studentIds or []))
+    return {"ok": True}
+
+@router.get("/read-cache")
+def read_cache_stats():
+    return {"ok": True, "stats": read_cache.stats()}
 
 @router.get("/latest")
-def latest(studentId: str):
-    d = nutri_recs.find_one({"studentId": ObjectId(studentId)}, sort=[("generatedDate",-1)])
-    if not d:
-        return {"ok": False, "message": "No recommendation"}
-    out = _stringify(d)
-    out["_id"] = str(d["_id"])
-    out["studentId"] = str(d.get("studentId", "")) if d.get("studentId") else None
-    return {"ok": True, "data": out}
+async def latest(studentId: str, if_none_match: str | None = Header(None)):
+    oid = ObjectId(studentId)
+
+    async def load():
+        d = await adb.nutri_recs.find_one({"studentId": oid}, sort=[("generatedDate",-1)])
+        if not d:
+            return {"ok": False, "message": "No recommendation"}
+        return {"ok": True, "data": d}
+
+    return read_cache.respond(await read_cache.aget_or_load(("latest", str(oid)), load), if_none_match)
+
+# view=summary: bỏ các trường lớn (inputData, recommendations chi tiết, meals)
+REC_SUMMARY = {"studentId": 1, "generatedDate": 1, "aiModel": 1, "confidence": 1, "appliedToMenu": 1,
+               "recommendations.dailyCaloriesTarget": 1, "createdAt": 1}
+DRAFT_SUMMARY = {"type": 1, "classId": 1, "date": 1, "aiModel": 1, "appliedToMenu": 1, "createdAt": 1,
+                 "studentGroup.name": 1, "studentGroup.bmi": 1, "studentGroup.allergySig": 1, "studentGroup.studentCount": 1}
+REC_SORT = [("generatedDate", -1), ("_id", -1)]
+DRAFT_SORT = [("date", -1), ("_id", -1)]
 
 @router.get("/list")
-def list_rec(studentId: str, limit: int = 10):
-    cur = nutri_recs.find({"studentId": ObjectId(studentId)}).sort("generatedDate",-1).limit(limit)
-    out = []
-    for d in cur:
-        x = _stringify(d)
-        x["_id"] = str(d["_id"])
-        x["studentId"] = str(d.get("studentId", "")) if d.get("studentId") else None
-        out.append(x)
-    return {"ok": True, "items": out}
+async def list_rec(
+    studentId: str,
+    limit: int = Query(10, ge=1, le=100),
+    cursor: str | None = None,
+    view: Literal["summary","full"] = "full",
+    withTotal: bool = False,
+):
+    try:
+        docs, nxt, total = await akeyset_page(adb.nutri_recs, {"studentId": ObjectId(studentId)}, REC_SORT, limit,
+                                              cursor, None if view == "full" else REC_SUMMARY, withTotal)
+    except BadCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    res = {"ok": True, "items": docs, "nextCursor": nxt}
+    if withTotal:
+        res["total"] = total
+    return BSONResponse(res)
 
 @router.get("/detail/{rec_id}")
-def detail(rec_id: str):
+async def detail(rec_id: str, if_none_match: str | None = Header(None)):
     try:
         oid = ObjectId(rec_id)
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid id")
 
-    doc = nutri_recs.find_one({"_id": oid})
-    if not doc:
+    # NestJS (saveFromDrafts) sửa appliedToMenu + updatedAt trực tiếp: kiểm tra version bằng projection nhỏ
+    ver = await adb.nutri_recs.find_one({"_id": oid}, {"updatedAt": 1})
+    if not ver:
+        raise HTTPException(status_code=404, detail="Not found")
+
+    async def load():
+        doc = await adb.nutri_recs.find_one({"_id": oid})
+        return {"ok": True, "item": doc} if doc else None
+
+    entry = await read_cache.aget_or_load(("detail", str(oid), str(ver.get("updatedAt") or "")), load)
+    if entry is None:
         raise HTTPException(status_code=404, detail="Not found")
+    return read_cache.respond(entry, if_none_match)
 
-    
-    safe = _stringify(doc)
-    
-    safe["_id"] = str(doc["_id"])
-    if "studentId" in doc:
-        safe["studentId"] = str(doc["studentId"])
+PLAN_ENGINES = ("gemini", "ollama", "local")
 
-    return {"ok": True, "item": safe}
+def _plan_engine(body: dict) -> Literal["gemini","ollama","local"]:
+    engine = body.get("engine") or "gemini"
+    if engine not in PLAN_ENGINES:
+        raise HTTPException(status_code=400, detail=f"engine phải là một trong {', '.join(PLAN_ENGINES)}")
+    return engine
 
 @router.post("/plan-menus")
-def plan_menus(body: dict = Body(...)):
+def plan_menus(body: dict = Body(...), idem_key: str | None = Header(None, alias="Idempotency-Key")):
+    class_id = body.get("classId")
+    if not class_id:
+        raise HTTPException(status_code=400, detail="Missing classId")
+    start_date = body.get("startDate") or datetime.utcnow().date().isoformat()
+    days = int(body.get("days") or 1)
+    engine = _plan_engine(body)
+    return plan_menus_for_class(class_id, start_date, days, engine,
+                                 idempotency_key=idem_key, transaction=body.get("transaction"))
+
+@router.post("/plan-menus/stream")
+def plan_menus_stream(
+    body: dict = Body(...),
+    idem_key: str | None = Header(None, alias="Idempotency-Key"),
+    format: str | None = Query(None, description='"ndjson" (mặc định) | "sse"'),
+    accept: str | None = Header(None),
+):
     class_id = body.get("classId")
     if not class_id:
         raise HTTPException(status_code=400, detail="Missing classId")
     start_date = body.get("startDate") or datetime.utcnow().date().isoformat()
     days = int(body.get("days") or 1)
-    engine: Literal["gemini","ollama"] = body.get("engine","gemini")
-    return plan_menus_for_class(class_id, start_date, days, engine)
+    engine = _plan_engine(body)
+    return stream_records(iter_plan_menus_for_class(class_id, start_date, days, engine,
+                                                    idempotency_key=idem_key, transaction=body.get("transaction")),
+                          wants_sse(format, accept))
 
 @router.post("/plan-student")
-def plan_student(body: dict = Body(...)):
+def plan_student(body: dict = Body(...), idem_key: str | None = Header(None, alias="Idempotency-Key")):
     student_id = body.get("studentId")
     if not student_id:
         raise HTTPException(status_code=400, detail="Missing studentId")
     start_date = body.get("startDate") or datetime.utcnow().date().isoformat()
     days = int(body.get("days") or 1)
-    engine: Literal["gemini","ollama"] = body.get("engine","gemini")
-    return plan_menus_for_student(student_id, start_date, days, engine)
+    engine = _plan_engine(body)
+    return plan_menus_for_student(student_id, start_date, days, engine,
+                                  idempotency_key=idem_key, transaction=body.get("transaction"))
+
+@router.post("/plan-student/stream")
+def plan_student_stream(
+    body: dict = Body(...),
+    idem_key: str | None = Header(None, alias="Idempotency-Key"),
+    format: str | None = Query(None, description='"ndjson" (mặc định) | "sse"'),
+    accept: str | None = Header(None),
+):
+    student_id = body.get("studentId")
+    if not student_id:
+        raise HTTPException(status_code=400, detail="Missing studentId")
+    start_date = body.get("startDate") or datetime.utcnow().date().isoformat()
+    days = int(body.get("days") or 1)
+    engine = _plan_engine(body)
+    return stream_records(iter_plan_menus_for_student(student_id, start_date, days, engine,
+                                                      idempotency_key=idem_key, transaction=body.get("transaction")),
+                          wants_sse(format, accept))
 
 @router.get("/drafts")
-def list_menu_drafts(classId: str | None = None, page: int = Query(1, ge=1), pageSize: int = Query(10, ge=1, le=50)):
+async def list_menu_drafts(
+    classId: str | None = None,
+    page: int = Query(1, ge=1),
+    pageSize: int = Query(10, ge=1, le=50),
+    cursor: str | None = None,
+    view: Literal["summary","full"] = "full",
+    withTotal: bool = True,
+):
+    """Phân trang theo cursor (nextCursor của trang trước); `page` chỉ còn để tương thích (skip, chậm ở trang sâu)."""
     q = {"type": "menu_draft"}
     if classId:
         q["classId"] = ObjectId(classId)
-    total = nutri_recs.count_documents(q)
-    cur = (nutri_recs.find(q).sort([("date",-1),("_id",-1)])
-           .skip((page-1)*pageSize).limit(pageSize))
-    out=[]
-    for d in cur:
-        d["_id"]=str(d["_id"])
-        if d.get("classId"): d["classId"]=str(d["classId"])
-        sg=d.get("studentGroup") or {}
-        sg["studentIds"]=[str(x) for x in sg.get("studentIds",[])]
-        d["studentGroup"]=sg
-        out.append(d)
-    return {"ok": True, "page": page, "pageSize": pageSize, "total": total, "items": out}
\ No newline at end of file
+    proj = None if view == "full" else DRAFT_SUMMARY
+    if cursor or page == 1:
+        try:
+            docs, nxt, total = await akeyset_page(adb.nutri_recs, q, DRAFT_SORT, pageSize, cursor, proj, withTotal)
+        except BadCursor as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    else:
+        docs = await adb.nutri_recs.find(q, proj).sort(DRAFT_SORT).skip((page-1)*pageSize).limit(pageSize + 1).to_list()
+        nxt = encode_cursor(docs[pageSize-1], DRAFT_SORT) if len(docs) > pageSize else None
+        docs = docs[:pageSize]
+        total = await acached_total(adb.nutri_recs, q) if withTotal else None
+    for d in docs:
+        d.setdefault("studentGroup", {})
+    return BSONResponse({"ok": True, "page": page, "pageSize": pageSize, "total": total, "nextCursor": nxt, "items": docs})
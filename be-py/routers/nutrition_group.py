@@ -1,7 +1,9 @@
 # be-py/routers/nutrition_group.py
 from fastapi import APIRouter, HTTPException, Query
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Literal
+from common.paging import BadCursor
+from common.responses import BSONResponse
 from services.nutrition_group import analyze_grouping, save_grouping, list_groupings, get_grouping, regen_grouping
 
 router = APIRouter(prefix="/nutrition/group", tags=["nutrition-group"])
@@ -11,6 +13,7 @@ class AnalyzeReq(BaseModel):
     groupCount: Optional[int] = Field(None, ge=1, le=5)
     engine: Optional[str] = Field("gemini", pattern="^(gemini|ollama)$")
     teacherHint: Optional[str] = None
+    noCache: bool = False
 
 @router.post("/analyze")
 def analyze_ep(req: AnalyzeReq):
@@ -19,6 +22,7 @@ def analyze_ep(req: AnalyzeReq):
         group_count=req.groupCount,
         engine=req.engine or "gemini",
         teacher_hint=req.teacherHint or "",
+        use_cache=not req.noCache,
     )
     return data  
 class SaveReq(BaseModel):
@@ -37,15 +41,25 @@ def save_ep(req: SaveReq):
     return {"ok": True, "id": item_id}
 
 @router.get("/list")
-def list_ep(classId: str, page: int = Query(1, ge=1), pageSize: int = Query(10, ge=1, le=100)):
-    return list_groupings(classId, page, pageSize)  
+async def list_ep(
+    classId: str,
+    page: int = Query(1, ge=1),
+    pageSize: int = Query(10, ge=1, le=100),
+    cursor: Optional[str] = None,
+    view: Literal["summary", "full"] = "full",
+    withTotal: bool = True,
+):
+    try:
+        return BSONResponse(await list_groupings(classId, page, pageSize, cursor, view, withTotal))
+    except BadCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/{id}")
-def detail_ep(id: str):
-    item = get_grouping(id)
+async def detail_ep(id: str):
+    item = await get_grouping(id)
     if not item:
         raise HTTPException(status_code=404, detail="Not Found")
-    return {"ok": True, "item": item}
+    return BSONResponse({"ok": True, "item": item})
 
 @router.post("/{id}/regen")
 def regen_ep(id: str):
@@ -1,5 +1,5 @@
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Header
 from pydantic import BaseModel, Field, validator
 from typing import Optional, Literal
 from services.nutrition_planner import plan_menus_for_class, plan_menus_for_student
@@ -21,6 +21,8 @@ class PlanMenusReq(BaseModel):
     days: int = Field(..., ge=1, le=7, description="Số ngày (1..7)")
     engine: EngineStr = Field("gemini", description='"gemini" | "ollama" | "local"')
     groupId: Optional[str] = Field(None, description="ID phân nhóm đã lưu (tùy chọn)")
+    batchSize: Optional[int] = Field(None, ge=1, le=35, description="Số (nhóm x ngày) mỗi lời gọi LLM; 1 = từng mục")
+    transaction: Optional[bool] = Field(None, description="Ghi các nháp trong một transaction (cần replica set)")
 
     @validator("startDate")
     def _vd_start_date(cls, v):
@@ -32,6 +34,7 @@ class PlanStudentReq(BaseModel):
     startDate: str = Field(..., description="YYYY-MM-DD")
     days: int = Field(..., ge=1, le=7)
     engine: EngineStr = Field("gemini")
+    transaction: Optional[bool] = Field(None, description="Ghi các nháp trong một transaction (cần replica set)")
 
     @validator("startDate")
     def _vd_start_date(cls, v):
@@ -39,25 +42,30 @@ class PlanStudentReq(BaseModel):
         return v
 
 @router.post("/plan-menus")
-def plan_menus_ep(req: PlanMenusReq):
+def plan_menus_ep(req: PlanMenusReq, idem_key: Optional[str] = Header(None, alias="Idempotency-Key")):
     data = plan_menus_for_class(
         class_id=req.classId,
         start_date=req.startDate,
         days=req.days,
         engine=req.engine,
         group_id=req.groupId,
+        batch_size=req.batchSize,
+        idempotency_key=idem_key,
+        transaction=req.transaction,
     )
     if not data.get("ok"):
         raise HTTPException(status_code=400, detail=data.get("message", "Không sinh được menu"))
     return data
 
 @router.post("/plan-student")
-def plan_student_ep(req: PlanStudentReq):
+def plan_student_ep(req: PlanStudentReq, idem_key: Optional[str] = Header(None, alias="Idempotency-Key")):
     data = plan_menus_for_student(
         student_id=req.studentId,
         start_date=req.startDate,
         days=req.days,
         engine=req.engine,
+        idempotency_key=idem_key,
+        transaction=req.transaction,
     )
     if not data.get("ok"):
         raise HTTPException(status_code=400, detail=data.get("message", "Không sinh được menu"))
@@ -0,0 +1,134 @@
+# be-py/services/draft_writer.py
+"""Ghi nháp thực đơn / gợi ý theo lô (unit of work) vào nutritional_recommendations.
+
+    w = DraftWriter(idempotency_key="plan-menus:<key>")
+    for ...: w.add(doc)
+    ids = w.commit()        # 1 insert_many(ordered=False), id theo đúng thứ tự add
+
+Có idempotency_key: mỗi doc mang (idempotencyKey, idempotencySeq, idempotencyTotal) với unique index, nên
+request retry không tạo bản trùng; `committed(key)` trả các doc đã ghi để trả lại kết quả cũ khi đã đủ
+idempotencyTotal doc. `total` là số doc của cả lần chạy (ghi nhiều lần / lỗi giữa chừng thì ít hơn số doc
+trong một commit); mặc định là số doc của commit.
+"""
+from typing import Any, Dict, List, Optional
+import logging
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+from common.db import client, nutri_recs
+from common.config import DRAFT_WRITE_TRANSACTION
+from common import read_cache
+from services import recent_dishes
+
+_DUP_KEY = 11000
+log = logging.getLogger(__name__)
+
+class DraftWriter:
+    def __init__(self, idempotency_key: Optional[str] = None, transaction: Optional[bool] = None, coll=nutri_recs,
+                 total: Optional[int] = None):
+        self.key = idempotency_key or None
+        self.total = total
+        self.transaction = DRAFT_WRITE_TRANSACTION if transaction is None else bool(transaction)
+        self.coll = coll
+        self.docs: List[Dict[str, Any]] = []
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def add(self, doc: Dict[str, Any], seq: Optional[int] = None) -> int:
+        """Thêm doc vào lô, trả vị trí. _id được gán ngay (client-side) nếu chưa có.
+
+        seq: idempotencySeq cố định (khi thứ tự add không ổn định giữa các lần retry, vd. gom theo thứ tự
+        hoàn thành); mặc định là vị trí."""
+        doc.setdefault("_id", ObjectId())
+        if self.key:
+            doc["idempotencyKey"] = self.key
+            doc["idempotencySeq"] = len(self.docs) if seq is None else seq
+        self.docs.append(doc)
+        return len(self.docs) - 1
+
+    def _insert(self, docs: List[Dict[str, Any]]) -> None:
+        if self.transaction:
+            # cần replica set; cả lô ghi hoặc không ghi gì
+            with client.start_session() as s:
+                s.with_transaction(lambda sess: self.coll.insert_many(docs, ordered=False, session=sess))
+        else:
+            self.coll.insert_many(docs, ordered=False)
+
+    def commit(self) -> List[str]:
+        """Ghi cả lô; trả id (str) theo thứ tự add.
+
+        Có idempotency key và một phần lô đã được ghi ở lần trước (cùng idempotencySeq): vị trí đó dùng
+        doc đã lưu — id và nội dung; `self.stored[vị trí]` là doc đã lưu để caller dựng lại preview
+        (xem fill_previews)."""
+        self.stored: Dict[int, Dict[str, Any]] = {}
+        if not self.docs:
+            return []
+        if self.key:
+            for d in self.docs:
+                d["idempotencyTotal"] = self.total or len(self.docs)
+        try:
+            self._insert(self.docs)
+        except BulkWriteError as e:
+            errs = e.details.get("writeErrors") or []
+            if not self.key or any(x.get("code") != _DUP_KEY for x in errs):
+                raise
+            by_seq = {d["idempotencySeq"]: d for d in self.coll.find({"idempotencyKey": self.key})}
+            for i, d in enumerate(self.docs):
+                old = by_seq.get(d["idempotencySeq"])
+                if old is not None and old["_id"] != d["_id"]:
+                    self.stored[i] = old
+            if self.transaction:
+                # transaction đã huỷ cả lô: ghi lại các doc chưa có bản lưu (lỗi lần này thì ném ra)
+                rest = [d for i, d in enumerate(self.docs) if i not in self.stored]
+                if rest:
+                    self._insert(rest)
+        ids = [self.stored[i]["_id"] if i in self.stored else d["_id"] for i, d in enumerate(self.docs)]
+        try:
+            recent_dishes.record(d for i, d in enumerate(self.docs) if i not in self.stored)
+        except Exception:
+            # chỉ mục món gần đây là phụ, không làm hỏng lần ghi nháp
+            log.exception("recent dishes update failed")
+        # gợi ý theo học sinh đổi kết quả /nutrition/latest; menu_draft theo nhóm thì không
+        sids = {str(d["studentId"]) for d in self.docs if d.get("studentId")}
+        if sids:
+            read_cache.invalidate(*(("latest", s) for s in sids))
+        self.docs = []
+        return [str(x) for x in ids]
+
+def committed(key: Optional[str], coll=nutri_recs) -> List[Dict[str, Any]]:
+    """Các doc đã ghi với idempotency key (theo thứ tự seq); rỗng nếu chưa ghi hoặc ghi dở."""
+    docs = stored_docs(key, coll)
+    if not docs or len(docs) != (docs[0].get("idempotencyTotal") or len(docs)):
+        return []
+    return docs
+
+def stored_docs(key: Optional[str], coll=nutri_recs) -> List[Dict[str, Any]]:
+    """Mọi doc đã ghi với idempotency key (kể cả khi ghi dở), theo thứ tự seq."""
+    if not key:
+        return []
+    return list(coll.find({"idempotencyKey": key}).sort("idempotencySeq", 1))
+
+def previews_from_docs(docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Dựng lại previews (cùng dạng plan_menus_*) từ các menu_draft đã lưu."""
+    out = []
+    for d in docs:
+        sg = d.get("studentGroup") or {}
+        dt = d.get("date")
+        out.append({
+            "recId": str(d["_id"]),
+            "date": dt.date().isoformat() if hasattr(dt, "date") else dt,
+            "groupName": sg.get("name"),
+            "studentCount": sg.get("studentCount") or len(sg.get("studentIds") or []),
+            "meals": d.get("meals"),
+        })
+    return out
+
+def fill_previews(previews: List[Dict[str, Any]], ids: List[str], stored: Dict[int, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Gán recId cho previews (cùng thứ tự add); vị trí đã ghi từ lần trước thì thay bằng preview dựng từ
+    doc đã lưu, để id và nội dung trả về khớp nhau."""
+    for i, rid in enumerate(ids):
+        if i in stored:
+            previews[i] = previews_from_docs([stored[i]])[0]
+        else:
+            previews[i]["recId"] = rid
+    return previews
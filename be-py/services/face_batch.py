@@ -0,0 +1,85 @@
+# be-py/services/face_batch.py
+from typing import Any, BinaryIO, Dict, List, Tuple
+import os, zipfile
+import numpy as np
+import cv2
+from services.face_gallery import encode_embedding
+from common.config import FACE_BATCH_MAX_FILES, FACE_BATCH_MAX_IMAGE_MB, FACE_BATCH_MAX_TOTAL_MB
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+MAX_IMAGE_BYTES = int(FACE_BATCH_MAX_IMAGE_MB * 1024 * 1024)
+MAX_TOTAL_BYTES = int(FACE_BATCH_MAX_TOTAL_MB * 1024 * 1024)
+ZIP_METHODS = {zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED}
+
+def open_zip_images(fileobj: BinaryIO) -> Tuple[zipfile.ZipFile, List[zipfile.ZipInfo]]:
+    """Mở zip từ file (không đọc cả archive vào RAM) và chọn các entry ảnh; kiểm tra số ảnh và
+    tổng dung lượng giải nén khai báo trong header trước khi đọc entry nào. Sai -> ValueError."""
+    zf = zipfile.ZipFile(fileobj)
+    infos = [i for i in zf.infolist() if not i.is_dir() and "__MACOSX" not in i.filename
+             and os.path.splitext(i.filename)[1].lower() in IMAGE_EXTS]
+    if len(infos) > FACE_BATCH_MAX_FILES:
+        zf.close()
+        raise ValueError(f"Zip vượt quá {FACE_BATCH_MAX_FILES} ảnh")
+    if sum(i.file_size for i in infos) > MAX_TOTAL_BYTES:
+        zf.close()
+        raise ValueError(f"Zip vượt quá {FACE_BATCH_MAX_TOTAL_MB:g} MB sau giải nén")
+    return zf, infos
+
+def read_zip_image(zf: zipfile.ZipFile, info: zipfile.ZipInfo) -> bytes:
+    """Bytes của một entry, tối đa MAX_IMAGE_BYTES (đọc có giới hạn, không tin file_size trong header)."""
+    if info.compress_type not in ZIP_METHODS:
+        raise ValueError("Kiểu nén không hỗ trợ")
+    if info.file_size > MAX_IMAGE_BYTES:
+        raise ValueError(f"Ảnh vượt quá {FACE_BATCH_MAX_IMAGE_MB:g} MB")
+    with zf.open(info) as f:
+        data = f.read(MAX_IMAGE_BYTES + 1)
+    if len(data) > MAX_IMAGE_BYTES:
+        raise ValueError(f"Ảnh vượt quá {FACE_BATCH_MAX_IMAGE_MB:g} MB")
+    return data
+
+def decode_image(data: bytes) -> np.ndarray:
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("Không đọc được ảnh")
+    return img
+
+def face_quality(img_bgr: np.ndarray, face) -> Dict[str, float]:
+    """Chỉ số chất lượng đơn giản: kích thước mặt (px), độ nét (phương sai Laplacian), độ sáng."""
+    h, w = img_bgr.shape[:2]
+    x1, y1, x2, y2 = [int(round(v)) for v in face.bbox]
+    x1, y1 = max(0, x1), max(0, y1)
+    x2, y2 = min(w, x2), min(h, y2)
+    size = float(max(0, min(x2 - x1, y2 - y1)))
+    if size <= 0:
+        return {"faceSize": 0.0, "sharpness": 0.0, "brightness": 0.0}
+    gray = cv2.cvtColor(img_bgr[y1:y2, x1:x2], cv2.COLOR_BGR2GRAY)
+    return {
+        "faceSize": size,
+        "sharpness": float(cv2.Laplacian(gray, cv2.CV_64F).var()),
+        "brightness": float(gray.mean()),
+    }
+
+def embed_one(face_app, name: str, data: bytes) -> Dict[str, Any]:
+    """Chạy detect + recognition cho một ảnh, trả record NDJSON (mặt tốt nhất đứng đầu)."""
+    try:
+        img = decode_image(data)
+        faces = face_app.get(img)
+    except Exception as e:
+        return {"file": name, "ok": False, "message": str(e)}
+    if not faces:
+        return {"file": name, "ok": False, "message": "Không phát hiện khuôn mặt"}
+    faces = sorted(faces, key=lambda f: getattr(f, "det_score", 0.0), reverse=True)
+    out: List[Dict[str, Any]] = []
+    for f in faces:
+        emb = getattr(f, "normed_embedding", None)
+        if emb is None:
+            continue
+        out.append({
+            "box": list(map(float, f.bbox)),
+            "detScore": float(getattr(f, "det_score", 0.0)),
+            "quality": face_quality(img, f),
+            "embedding": encode_embedding(emb),
+        })
+    if not out:
+        return {"file": name, "ok": False, "message": "Không trích xuất được embedding"}
+    return {"file": name, "ok": True, "faces": out}
@@ -0,0 +1,130 @@
+# be-py/services/face_engine.py
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+import asyncio, queue, threading, time
+from common.config import (
+    FACE_WORKERS, FACE_QUEUE_MAX, FACE_TIMEOUT_SEC, FACE_INTRA_THREADS,
+    FACE_MODEL_NAME, FACE_MODULES, FACE_DET_SIZE,
+)
+
+class InferenceBusy(Exception):
+    """Hàng đợi inference đã đầy -> router trả 429."""
+
+class InferenceTimeout(Exception):
+    """Quá thời gian chờ inference -> router trả 504."""
+
+def _new_face_app() -> Tuple[Any, Dict[str, Any]]:
+    """Nạp FaceAnalysis chỉ với các module cấu hình (mặc định detection + recognition)."""
+    t0 = time.perf_counter()
+    # import trễ: worker chỉ phục vụ nutrition không phải nạp onnxruntime/insightface
+    import onnxruntime as ort
+    from insightface.app import FaceAnalysis
+    t1 = time.perf_counter()
+    opts = ort.SessionOptions()
+    opts.intra_op_num_threads = FACE_INTRA_THREADS
+    opts.inter_op_num_threads = 1
+    app = FaceAnalysis(
+        name=FACE_MODEL_NAME,
+        allowed_modules=FACE_MODULES or None,
+        providers=['CPUExecutionProvider'],
+        sess_options=opts,
+    )
+    t2 = time.perf_counter()
+    app.prepare(ctx_id=0, det_size=FACE_DET_SIZE)
+    t3 = time.perf_counter()
+    timing = {
+        "modules": sorted(app.models.keys()),
+        "importSec": round(t1 - t0, 3),
+        "loadSec": round(t2 - t1, 3),
+        "prepareSec": round(t3 - t2, 3),
+    }
+    return app, timing
+
+class InferencePool:
+    """N instance FaceAnalysis, mỗi instance chạy trên 1 worker thread, hàng đợi có giới hạn.
+
+    Inference chạy ngoài event loop; khi số request đang chờ + đang chạy vượt
+    workers + queue_max thì từ chối ngay (InferenceBusy) thay vì xếp hàng vô hạn.
+    Model chỉ được nạp khi có request đầu tiên (trong worker thread) hoặc khi gọi warmup().
+    """
+
+    def __init__(self, workers: int, queue_max: int, timeout: float):
+        self.workers = max(1, workers)
+        self.queue_max = max(0, queue_max)
+        self.timeout = timeout
+        # slot None = instance chưa nạp
+        self._apps: "queue.Queue[Any]" = queue.Queue()
+        for _ in range(self.workers):
+            self._apps.put(None)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="face-infer")
+        self._pending = 0
+        self._lock = threading.Lock()
+        self.timings: List[Dict[str, Any]] = []
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "loaded": len(self.timings),
+            "queueMax": self.queue_max,
+            "pending": self._pending,
+            "loadTimings": self.timings,
+        }
+
+    def _checkout(self) -> Any:
+        app = self._apps.get()
+        if app is None:
+            try:
+                app, timing = _new_face_app()
+            except Exception:
+                self._apps.put(None)
+                raise
+            with self._lock:
+                self.timings.append(timing)
+        return app
+
+    def warmup(self) -> dict:
+        """Nạp toàn bộ instance ngay (gọi lúc startup hoặc qua /face/warmup)."""
+        apps = []
+        try:
+            for _ in range(self.workers):
+                apps.append(self._checkout())
+        finally:
+            for app in apps:
+                self._apps.put(app)
+        return self.stats()
+
+    def _admit(self) -> None:
+        with self._lock:
+            if self._pending >= self.workers + self.queue_max:
+                raise InferenceBusy("Hệ thống nhận diện đang quá tải, thử lại sau")
+            self._pending += 1
+
+    def _release(self) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    def _call(self, fn: Callable[..., Any], args: tuple) -> Any:
+        try:
+            app = self._checkout()
+        except Exception:
+            self._release()
+            raise
+        try:
+            return fn(app, *args)
+        finally:
+            self._apps.put(app)
+            # giảm khi worker thật sự xong (kể cả request đã timeout) để backpressure phản ánh tải thật
+            self._release()
+
+    async def run(self, fn: Callable[..., Any], *args, timeout: Optional[float] = None) -> Any:
+        """Chạy fn(face_app, *args) trên worker pool."""
+        self._admit()
+        loop = asyncio.get_running_loop()
+        fut = loop.run_in_executor(self._executor, self._call, fn, args)
+        try:
+            # shield: không huỷ job đã xếp hàng, để _call luôn chạy và trả lại slot
+            return await asyncio.wait_for(asyncio.shield(fut), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            raise InferenceTimeout("Quá thời gian xử lý ảnh")
+
+face_pool = InferencePool(FACE_WORKERS, FACE_QUEUE_MAX, FACE_TIMEOUT_SEC)
@@ -0,0 +1,120 @@
+# be-py/services/face_gallery.py
+from typing import Dict, List, Optional, Tuple
+from datetime import datetime
+import threading, time, base64
+import numpy as np
+from bson import ObjectId
+from common.db import students
+from common.config import FACE_GALLERY_TTL_SEC
+from services.face_matcher import Gallery, decode_embedding, EMB_DIM
+
+# classId -> (loadedAt, Gallery)
+_cache: Dict[str, Tuple[float, Gallery]] = {}
+_lock = threading.Lock()
+# tăng mỗi lần invalidate (theo lớp và toàn cục); lần load bắt đầu trước đó không được ghi đè cache
+_epochs: Dict[str, int] = {}
+_epoch_all = 0
+
+def encode_embedding(vec: np.ndarray) -> str:
+    return base64.b64encode(np.asarray(vec, dtype=np.float32).tobytes()).decode("ascii")
+
+def _load_class(class_id: str) -> Gallery:
+    cur = students.find(
+        {"classId": ObjectId(class_id), "isActive": {"$ne": False}},
+        {"_id": 1, "faceImages.encodedFace": 1},
+    )
+    pairs = []
+    for s in cur:
+        sid = str(s["_id"])
+        for fi in s.get("faceImages") or []:
+            vec = decode_embedding((fi or {}).get("encodedFace") or "")
+            if vec is not None and vec.shape[0] > 0:
+                pairs.append((sid, vec))
+    return Gallery.from_vectors(pairs)
+
+def _epoch(class_id: str) -> Tuple[int, int]:
+    return (_epoch_all, _epochs.get(class_id, 0))
+
+def get_class_gallery(class_id: str) -> Gallery:
+    now = time.monotonic()
+    hit = _cache.get(class_id)
+    if hit and now - hit[0] < FACE_GALLERY_TTL_SEC:
+        return hit[1]
+    with _lock:
+        epoch = _epoch(class_id)
+    gal = _load_class(class_id)
+    with _lock:
+        if _epoch(class_id) == epoch:
+            _cache[class_id] = (now, gal)
+    return gal
+
+def invalidate(class_id: Optional[str] = None) -> None:
+    global _epoch_all
+    with _lock:
+        if class_id is None:
+            _epoch_all += 1
+            _cache.clear()
+        else:
+            _epochs[class_id] = _epochs.get(class_id, 0) + 1
+            _cache.pop(class_id, None)
+
+def validate_embeddings(embeddings: List[str]) -> List[str]:
+    """Mỗi embedding phải là base64 của đúng EMB_DIM float32 hữu hạn; sai -> ValueError."""
+    out = []
+    for i, e in enumerate(embeddings):
+        vec = decode_embedding(e) if isinstance(e, str) else None
+        if vec is None or vec.shape[0] != EMB_DIM or not np.isfinite(vec).all():
+            raise ValueError(f"Embedding #{i} không hợp lệ (cần base64 của {EMB_DIM} float32)")
+        out.append(e)
+    return out
+
+def _items(embeddings: List[str]) -> List[Dict]:
+    now = datetime.utcnow()
+    return [{"_id": ObjectId(), "encodedFace": e, "uploadedAt": now} for e in validate_embeddings([e for e in embeddings if e])]
+
+def _class_of(student_id: str) -> Optional[str]:
+    s = students.find_one({"_id": ObjectId(student_id)}, {"classId": 1})
+    if not s:
+        raise ValueError("Student not found")
+    return str(s["classId"]) if s.get("classId") else None
+
+def _invalidate_class(cls_id: Optional[str]) -> None:
+    # học sinh chưa có lớp không nằm trong gallery nào; invalidate(None) sẽ xoá cache của mọi lớp
+    if cls_id:
+        invalidate(cls_id)
+
+def add_embeddings(student_id: str, embeddings: List[str]) -> int:
+    """Thêm embedding (base64 float32) vào students.faceImages, cùng định dạng NestJS đang lưu."""
+    items = _items(embeddings)
+    cls_id = _class_of(student_id)
+    if items:
+        students.update_one({"_id": ObjectId(student_id)}, {"$push": {"faceImages": {"$each": items}}})
+    _invalidate_class(cls_id)
+    return len(items)
+
+def replace_embeddings(student_id: str, embeddings: List[str]) -> int:
+    """Bỏ embedding cũ (giữ nguyên ảnh) và thêm bộ embedding mới trong một lần update."""
+    items = _items(embeddings)
+    cls_id = _class_of(student_id)
+    # pipeline update: $unset + $push cùng path faceImages không gộp được trong một update thường
+    students.update_one({"_id": ObjectId(student_id)}, [{"$set": {"faceImages": {"$concatArrays": [
+        {"$map": {"input": {"$ifNull": ["$faceImages", []]}, "as": "fi",
+                  "in": {"$unsetField": {"field": "encodedFace", "input": "$$fi"}}}},
+        {"$literal": items},
+    ]}}}])
+    _invalidate_class(cls_id)
+    return len(items)
+
+def delete_embeddings(student_id: str, face_id: Optional[str] = None) -> None:
+    cls_id = _class_of(student_id)
+    if face_id:
+        students.update_one(
+            {"_id": ObjectId(student_id), "faceImages._id": ObjectId(face_id)},
+            {"$unset": {"faceImages.$.encodedFace": ""}},
+        )
+    else:
+        students.update_one(
+            {"_id": ObjectId(student_id)},
+            {"$unset": {"faceImages.$[].encodedFace": ""}},
+        )
+    _invalidate_class(cls_id)
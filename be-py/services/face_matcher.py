@@ -0,0 +1,94 @@
+# be-py/services/face_matcher.py
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+import base64
+
+EMB_DIM = 512
+
+def decode_embedding(b64: str) -> Optional[np.ndarray]:
+    try:
+        buf = base64.b64decode(b64.encode("ascii"))
+        return np.frombuffer(buf, dtype=np.float32)
+    except Exception:
+        return None
+
+class Gallery:
+    """Gallery đã đóng gói: ma trận float32 liền bộ nhớ (R x D), các hàng cùng studentId nằm liền nhau."""
+
+    def __init__(self, ids: List[str], matrix: np.ndarray, row_starts: Optional[np.ndarray] = None):
+        self.ids = ids
+        self.matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        # None => mỗi học sinh đúng 1 hàng, không cần gộp
+        self.row_starts = row_starts
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def from_vectors(cls, pairs: List[Tuple[str, np.ndarray]]) -> "Gallery":
+        by_sid: Dict[str, List[np.ndarray]] = {}
+        dim = None
+        for sid, vec in pairs:
+            if sid is None or vec is None or vec.shape[0] == 0:
+                continue
+            if dim is None:
+                dim = vec.shape[0]
+            if vec.shape[0] != dim:
+                continue
+            by_sid.setdefault(str(sid), []).append(vec)
+        if not by_sid:
+            return cls([], np.zeros((0, dim or EMB_DIM), dtype=np.float32))
+
+        ids = list(by_sid.keys())
+        rows = [v for sid in ids for v in by_sid[sid]]
+        mat = np.vstack(rows).astype(np.float32, copy=False)
+        if len(rows) == len(ids):
+            return cls(ids, mat)
+        counts = np.fromiter((len(by_sid[sid]) for sid in ids), dtype=np.int64, count=len(ids))
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        return cls(ids, mat, starts)
+
+    @classmethod
+    def from_items(cls, items: List[dict]) -> "Gallery":
+        """items: [{"studentId": ..., "embedding": <base64 float32>}] như payload cũ."""
+        pairs = []
+        for it in items or []:
+            vec = decode_embedding(it.get("embedding") or "")
+            if vec is not None:
+                pairs.append((it.get("studentId"), vec))
+        return cls.from_vectors(pairs)
+
+def score_matrix(probes: np.ndarray, gallery: Gallery) -> np.ndarray:
+    """Cosine (embedding đã chuẩn hoá) của F probe với toàn bộ gallery: F x N học sinh."""
+    P = np.ascontiguousarray(probes, dtype=np.float32)
+    if P.ndim == 1:
+        P = P[None, :]
+    S = P @ gallery.matrix.T
+    if gallery.row_starts is not None:
+        S = np.maximum.reduceat(S, gallery.row_starts, axis=1)
+    return S
+
+def _top_k(row: np.ndarray, k: int) -> np.ndarray:
+    n = row.shape[0]
+    if k >= n:
+        return np.argsort(-row)
+    part = np.argpartition(-row, k - 1)[:k]
+    return part[np.argsort(-row[part])]
+
+def match_faces(probes: np.ndarray, gallery: Gallery, threshold: float, top_k: int = 5) -> List[Dict[str, Any]]:
+    """Mỗi probe -> {"best": {...}|None, "candidates": [...top_k]}; similarity theo thang 0..100."""
+    if len(gallery) == 0 or probes is None or len(probes) == 0:
+        return [{"best": None, "candidates": []} for _ in range(0 if probes is None else len(probes))]
+    S = score_matrix(probes, gallery)
+    k = max(1, min(int(top_k), len(gallery)))
+    out = []
+    for row in S:
+        idx = _top_k(row, k)
+        cands = [{"studentId": gallery.ids[j], "similarity": float(row[j]) * 100.0} for j in idx]
+        b = int(idx[0])
+        best_sim = float(row[b])
+        out.append({
+            "best": {"studentId": gallery.ids[b], "similarity": best_sim * 100.0} if best_sim >= threshold else None,
+            "candidates": cands,
+        })
+    return out
@@ -0,0 +1,98 @@
+# be-py/services/face_pipeline.py
+from typing import Any, Dict, List, Optional, Tuple
+import threading, time
+import numpy as np
+import cv2
+from common.config import FACE_DET_SIZE, FACE_DET_MODE
+
+DET_MIN, DET_MAX = 160, max(FACE_DET_SIZE)
+
+DET_MODES = ("auto", "fixed", "aligned")
+
+# đếm số request theo path để /face/health hiển thị
+_path_counts: Dict[str, int] = {}
+_path_lock = threading.Lock()
+
+def path_stats() -> Dict[str, int]:
+    return dict(_path_counts)
+
+def _count(path: str) -> None:
+    with _path_lock:
+        _path_counts[path] = _path_counts.get(path, 0) + 1
+
+def _round32(x: float) -> int:
+    return int(max(DET_MIN, min(DET_MAX, 32 * round(x / 32))))
+
+def choose_det_size(h: int, w: int, expected_faces: int) -> Tuple[int, int]:
+    """Kích thước input detector theo ảnh và số mặt dự kiến.
+
+    Một mặt (check-in) thì mặt chiếm phần lớn khung hình -> 320 là đủ;
+    ảnh lớp nhiều mặt giữ mức cấu hình; ảnh nhỏ hơn mức đó thì không phóng to.
+    """
+    long_side = max(h, w)
+    if expected_faces <= 1:
+        target = min(long_side, 320)
+    elif expected_faces <= 4:
+        target = min(long_side, 480)
+    else:
+        target = min(long_side, DET_MAX)
+    s = _round32(target)
+    return (s, s)
+
+def detect_faces(face_app, img: np.ndarray, det_size: Tuple[int, int], max_num: int = 0) -> List[Any]:
+    """Như FaceAnalysis.get nhưng cho phép đổi det_size theo từng request và chỉ chạy recognition."""
+    from insightface.app.common import Face
+    bboxes, kpss = face_app.det_model.detect(img, input_size=det_size, max_num=max_num, metric='default')
+    if bboxes is None or bboxes.shape[0] == 0:
+        return []
+    rec = face_app.models.get('recognition')
+    out = []
+    for i in range(bboxes.shape[0]):
+        f = Face(bbox=bboxes[i, 0:4], kps=kpss[i] if kpss is not None else None, det_score=bboxes[i, 4])
+        if rec is not None and f.kps is not None:
+            rec.get(img, f)
+        out.append(f)
+    return out
+
+def embed_aligned(face_app, img: np.ndarray) -> Optional[np.ndarray]:
+    """Fast path: ảnh đã là mặt căn chỉnh sẵn (ArcFace 112x112), bỏ qua detection."""
+    rec = face_app.models.get('recognition')
+    if rec is None or img is None:
+        return None
+    size = tuple(rec.input_size)
+    if img.shape[1] != size[0] or img.shape[0] != size[1]:
+        img = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+    emb = rec.get_feat(img).flatten()
+    n = np.linalg.norm(emb)
+    return (emb / n).astype(np.float32) if n > 0 else None
+
+def run(face_app, img: np.ndarray, mode: Optional[str], expected_faces: int) -> Tuple[List[Any], Optional[np.ndarray], Dict[str, Any]]:
+    """Trả (faces, embedding fast-path, metrics). mode: "auto" | "fixed" | "aligned"."""
+    if img is None:
+        raise ValueError("Không đọc được ảnh")
+    mode = (mode or FACE_DET_MODE).lower()
+    if mode not in DET_MODES:
+        raise ValueError(f"detMode không hợp lệ: {mode}")
+    h, w = img.shape[:2]
+    t0 = time.perf_counter()
+    if mode == "aligned":
+        emb = embed_aligned(face_app, img)
+        _count("aligned")
+        return [], emb, {"path": "aligned", "imageSize": [w, h], "inferMs": round((time.perf_counter() - t0) * 1000, 1)}
+
+    det_size = choose_det_size(h, w, expected_faces) if mode == "auto" else tuple(FACE_DET_SIZE)
+    faces = detect_faces(face_app, img, det_size)
+    if not faces and mode == "auto" and det_size[0] < DET_MAX:
+        # mặt nhỏ hơn dự kiến: thử lại ở kích thước đầy đủ
+        det_size = tuple(FACE_DET_SIZE)
+        faces = detect_faces(face_app, img, det_size)
+        mode = "auto-retry"
+    path = f"detect-{mode}"
+    _count(path)
+    return faces, None, {
+        "path": path,
+        "imageSize": [w, h],
+        "detSize": list(det_size),
+        "faces": len(faces),
+        "inferMs": round((time.perf_counter() - t0) * 1000, 1),
+    }
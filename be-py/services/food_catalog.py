@@ -0,0 +1,91 @@
+# be-py/services/food_catalog.py
+from typing import Any, Dict, List, Optional, Tuple
+import threading, time
+from common.db import food_items
+from common.config import FOOD_CATALOG_REFRESH_SEC, FOOD_MATCH_MIN_CONFIDENCE
+from services.food_resolver import FoodResolver
+
+_PROJ = {"_id": 1, "name": 1, "unit": 1, "category": 1, "nutrition": 1, "allergens": 1, "isVegetarian": 1, "isHalal": 1}
+
+class FoodCatalog:
+    """Danh mục món ăn đã index sẵn: id, bitset theo allergen và bộ resolve tên (tạo khi cần)."""
+
+    def __init__(self, items: List[Dict[str, Any]], version: Tuple = ()):
+        self.items = items
+        self.version = version
+        self.by_id: Dict[str, Dict[str, Any]] = {it["_id"]: it for it in items}
+        self._resolver: Optional[FoodResolver] = None
+        # allergen (lowercase) -> bitset các món chứa allergen đó
+        self._allergen_bits: Dict[str, int] = {}
+        for i, it in enumerate(items):
+            for a in it.get("allergens") or []:
+                a = (a or "").lower()
+                if a:
+                    self._allergen_bits[a] = self._allergen_bits.get(a, 0) | (1 << i)
+        self._all_bits = (1 << len(items)) - 1
+        self._views: Dict[str, "FoodCatalog"] = {}
+        self._views_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def allergen_mask(self, key: str) -> int:
+        """Bitset các món có allergen chứa `key` (cùng ngữ nghĩa substring như trước)."""
+        key = key.lower()
+        mask = 0
+        for a, bits in self._allergen_bits.items():
+            if key in a:
+                mask |= bits
+        return mask
+
+    def without_allergen(self, allergy: Optional[str]) -> "FoodCatalog":
+        if not allergy or allergy == "none":
+            return self
+        key = allergy.lower()
+        view = self._views.get(key)
+        if view is None:
+            keep = self._all_bits & ~self.allergen_mask(key)
+            view = FoodCatalog([it for i, it in enumerate(self.items) if keep >> i & 1], self.version)
+            with self._views_lock:
+                self._views[key] = view
+        return view
+
+    @property
+    def resolver(self) -> FoodResolver:
+        if self._resolver is None:
+            self._resolver = FoodResolver(self.items, FOOD_MATCH_MIN_CONFIDENCE)
+        return self._resolver
+
+def _load_items() -> List[Dict[str, Any]]:
+    out: List[Dict[str, Any]] = []
+    for d in food_items.find({"isActive": {"$ne": False}}, _PROJ):
+        d["_id"] = str(d["_id"])
+        out.append(d)
+    return out
+
+def _current_version() -> Tuple:
+    last = food_items.find_one({}, {"updatedAt": 1}, sort=[("updatedAt", -1)])
+    return (food_items.estimated_document_count(), last and last.get("updatedAt"))
+
+_catalog: Optional[FoodCatalog] = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+def get_catalog(force: bool = False) -> FoodCatalog:
+    """Catalog dùng chung cả process; kiểm tra version (count + updatedAt mới nhất) tối đa mỗi FOOD_CATALOG_REFRESH_SEC."""
+    global _catalog, _checked_at
+    now = time.monotonic()
+    if not force and _catalog is not None and now - _checked_at < FOOD_CATALOG_REFRESH_SEC:
+        return _catalog
+    with _lock:
+        if not force and _catalog is not None and now - _checked_at < FOOD_CATALOG_REFRESH_SEC:
+            return _catalog
+        ver = _current_version()
+        if force or _catalog is None or ver != _catalog.version:
+            _catalog = FoodCatalog(_load_items(), ver)
+        _checked_at = time.monotonic()
+        return _catalog
+
+def invalidate() -> None:
+    global _checked_at
+    _checked_at = 0.0
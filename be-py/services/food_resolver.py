@@ -0,0 +1,77 @@
+# be-py/services/food_resolver.py
+from typing import Any, Dict, List, Optional, Sequence
+from collections import Counter
+from utils.text import fold
+
+MAX_CANDIDATES = 20
+
+def _grams(s: str) -> List[str]:
+    p = f" {s} "
+    return [p[i:i+3] for i in range(len(p) - 2)]
+
+class FoodResolver:
+    """Map tên món do LLM trả về -> food_items, chịu được thiếu dấu, sai hoa thường và tên không đầy đủ.
+
+    Chuẩn hoá (NFD, bỏ dấu, tách token) rồi tra n-gram index; trả match kèm confidence 0..1.
+    """
+
+    def __init__(self, items: Sequence[Dict[str, Any]], min_confidence: float = 0.5):
+        self.items = items
+        self.min_confidence = min_confidence
+        self._norm = [fold(it.get("name") or "") for it in items]
+        self._tok = [set(n.split()) for n in self._norm]
+        self._ngram_len = []
+        self.exact: Dict[str, int] = {}
+        self._grams: Dict[str, List[int]] = {}
+        for i, n in enumerate(self._norm):
+            self.exact.setdefault(n, i)
+            gs = set(_grams(n))
+            self._ngram_len.append(len(gs))
+            for g in gs:
+                self._grams.setdefault(g, []).append(i)
+
+    def _hit(self, i: int, confidence: float, method: str) -> Dict[str, Any]:
+        it = self.items[i]
+        return {"foodItemId": str(it["_id"]), "name": it.get("name"), "confidence": round(confidence, 3), "method": method}
+
+    def resolve(self, name: str) -> Optional[Dict[str, Any]]:
+        q = fold(name)
+        if not q:
+            return None
+        i = self.exact.get(q)
+        if i is not None:
+            return self._hit(i, 1.0, "exact")
+
+        qg = set(_grams(q))
+        shared = Counter()
+        for g in qg:
+            shared.update(self._grams.get(g, ()))
+        if not shared:
+            return None
+        qt = set(q.split())
+        best, best_key = None, None
+        for i, n_shared in shared.most_common(MAX_CANDIDATES):
+            dice = 2.0 * n_shared / (len(qg) + self._ngram_len[i])
+            ct = self._tok[i]
+            common = len(qt & ct)
+            overlap = common / min(len(qt), len(ct)) if qt and ct else 0.0
+            conf = max(dice, (dice + overlap) / 2)
+            # cùng điểm: ưu tiên tên ngắn hơn, rồi thứ tự trong catalog
+            key = (conf, -len(self._norm[i]), -i)
+            if best_key is None or key > best_key:
+                best, best_key = i, key
+        conf = best_key[0]
+        if conf < self.min_confidence:
+            return None
+        return self._hit(best, conf, "fuzzy")
+
+    def resolve_many(self, names: Sequence[str]) -> List[Optional[Dict[str, Any]]]:
+        """Resolve cả thực đơn một lượt; tên lặp lại chỉ tính một lần."""
+        seen: Dict[str, Optional[Dict[str, Any]]] = {}
+        out = []
+        for nm in names:
+            key = fold(nm)
+            if key not in seen:
+                seen[key] = self.resolve(nm)
+            out.append(seen[key])
+        return out
@@ -0,0 +1,218 @@
+# be-py/services/jobs.py
+from typing import Any, Callable, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from concurrent.futures import TimeoutError as FutureTimeout
+import asyncio, logging, os, socket, threading, time, traceback, uuid
+from bson import ObjectId
+from common.db import jobs
+from common.config import JOB_WORKERS, JOB_QUEUE_MAX, JOB_HEARTBEAT_SEC, JOB_STALE_SEC, JOB_CANCEL_POLL_SEC
+
+log = logging.getLogger(__name__)
+
+class JobCancelled(Exception):
+    pass
+
+class JobQueueFull(RuntimeError):
+    pass
+
+class JobContext:
+    """Truyền vào hàm chạy job: báo tiến độ và kiểm tra yêu cầu huỷ."""
+
+    def __init__(self, job_id: ObjectId):
+        self.job_id = job_id
+        self._cancel = False
+        self._polled_at = float("-inf")
+
+    def report(self, done: int, total: int, note: str = "") -> None:
+        jobs.update_one({"_id": self.job_id}, {"$set": {
+            "progress": {"done": done, "total": total, "note": note},
+            "updatedAt": datetime.utcnow(),
+        }})
+
+    def cancelled(self) -> bool:
+        """Huỷ trong process này thấy ngay; huỷ qua worker khác đọc từ Mongo, tối đa mỗi JOB_CANCEL_POLL_SEC."""
+        if self._cancel or self.job_id in _cancel_flags:
+            return True
+        now = time.monotonic()
+        if now - self._polled_at >= JOB_CANCEL_POLL_SEC:
+            self._polled_at = now
+            d = jobs.find_one({"_id": self.job_id}, {"cancelRequested": 1})
+            self._cancel = bool(d and d.get("cancelRequested"))
+        return self._cancel
+
+    def check(self) -> None:
+        if self.cancelled():
+            raise JobCancelled()
+
+def _run_generate_class(p: Dict[str, Any], ctx: JobContext) -> Dict[str, Any]:
+    from services.nutrition_service import iter_generate_for_class
+
+    async def run():
+        items = []
+        # should_stop: huỷ thì không dispatch học sinh mới, chỉ chờ các lời gọi đang chạy
+        async for it in iter_generate_for_class(p["classId"], p.get("period", "day"), p.get("engine", "gemini"),
+                                                should_stop=ctx.cancelled, use_cache=not p.get("noCache")):
+            prog = it.pop("progress", {})
+            items.append(it)
+            ctx.report(prog.get("done", len(items)), prog.get("total", 0))
+        ctx.check()
+        return {"ok": True, "classId": p["classId"], "items": items}
+    return asyncio.run(run())
+
+def _run_plan_menus(p: Dict[str, Any], ctx: JobContext) -> Dict[str, Any]:
+    from services.nutrition_service import iter_plan_menus_for_class
+    start_date = p.get("startDate") or datetime.utcnow().date().isoformat()
+
+    async def run():
+        summary: Dict[str, Any] = {}
+        # huỷ: không dispatch nhóm mới; nháp đã sinh vẫn được ghi (chạy lại cùng idempotencyKey sinh tiếp phần thiếu)
+        async for it in iter_plan_menus_for_class(p["classId"], start_date, int(p.get("days") or 1),
+                                                  p.get("engine", "gemini"), idempotency_key=p.get("idempotencyKey"),
+                                                  should_stop=ctx.cancelled):
+            if it.pop("summary", False):
+                summary = it
+                continue
+            prog = it.get("progress") or {}
+            ctx.report(prog.get("done", 0), prog.get("total", 0))
+        ctx.check()
+        return summary
+    return asyncio.run(run())
+
+def _run_group_analyze(p: Dict[str, Any], ctx: JobContext) -> Dict[str, Any]:
+    from services.nutrition_group import analyze_grouping
+    from ai import llm
+    # một lời gọi LLM: huỷ thì bỏ kết quả ngay, không chờ lời gọi xong (deadline của lớp LLM giới hạn nó)
+    fut = llm.executor.submit(
+        analyze_grouping,
+        class_id=p["classId"],
+        group_count=p.get("groupCount"),
+        engine=p.get("engine") or "gemini",
+        teacher_hint=p.get("teacherHint") or "",
+    )
+    while True:
+        try:
+            return fut.result(timeout=JOB_CANCEL_POLL_SEC)
+        except FutureTimeout:
+            ctx.check()
+
+JOB_KINDS: Dict[str, Callable[[Dict[str, Any], JobContext], Dict[str, Any]]] = {
+    "generate-class": _run_generate_class,
+    "plan-menus": _run_plan_menus,
+    "group-analyze": _run_group_analyze,
+}
+
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+_cancel_flags: set = set()
+_inflight: set = set()
+_lock = threading.Lock()
+# process sở hữu job (heartbeat); khác nhau giữa các worker uvicorn và sau mỗi lần restart
+OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+_heartbeat: Optional[threading.Thread] = None
+
+def _finish(job_id: ObjectId, status: str, **fields) -> None:
+    now = datetime.utcnow()
+    jobs.update_one({"_id": job_id}, {"$set": {"status": status, "finishedAt": now, "updatedAt": now, **fields}})
+    with _lock:
+        _cancel_flags.discard(job_id)
+
+def _worker(job_id: ObjectId, kind: str, params: Dict[str, Any]) -> None:
+    ctx = JobContext(job_id)
+    try:
+        ctx.check()
+        now = datetime.utcnow()
+        jobs.update_one({"_id": job_id}, {"$set": {"status": "running", "startedAt": now, "updatedAt": now}})
+        result = JOB_KINDS[kind](params, ctx)
+        _finish(job_id, "done", result=result)
+    except JobCancelled:
+        _finish(job_id, "cancelled")
+    except Exception as e:
+        _finish(job_id, "failed", error=str(e), trace=traceback.format_exc(limit=5))
+    finally:
+        with _lock:
+            _inflight.discard(job_id)
+
+def submit(kind: str, params: Dict[str, Any]) -> str:
+    if kind not in JOB_KINDS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    if not params.get("classId"):
+        raise ValueError("Missing classId")
+    now = datetime.utcnow()
+    job_id = ObjectId()
+    with _lock:
+        if len(_inflight) >= JOB_WORKERS + JOB_QUEUE_MAX:
+            raise JobQueueFull(f"Job queue full ({len(_inflight)} jobs)")
+        _inflight.add(job_id)
+    doc = {
+        "_id": job_id,
+        "kind": kind,
+        "params": params,
+        "status": "queued",
+        "progress": {"done": 0, "total": 0, "note": ""},
+        "cancelRequested": False,
+        "owner": OWNER,
+        "heartbeatAt": now,
+        "createdAt": now,
+        "updatedAt": now,
+    }
+    try:
+        jobs.insert_one(doc)
+    except Exception:
+        with _lock:
+            _inflight.discard(job_id)
+        raise
+    _executor.submit(_worker, job_id, kind, params)
+    return str(job_id)
+
+def recover_orphans() -> int:
+    """Job queued/running mà process sở hữu đã chết (không heartbeat quá JOB_STALE_SEC) -> failed."""
+    now = datetime.utcnow()
+    res = jobs.update_many(
+        {"status": {"$in": ["queued", "running"]}, "owner": {"$ne": OWNER},
+         "$or": [{"heartbeatAt": {"$lt": now - timedelta(seconds=JOB_STALE_SEC)}}, {"heartbeatAt": {"$exists": False}}]},
+        {"$set": {"status": "failed", "error": "orphaned: worker stopped before the job finished",
+                  "finishedAt": now, "updatedAt": now}},
+    )
+    return res.modified_count
+
+def _beat() -> None:
+    while True:
+        try:
+            with _lock:
+                ids = list(_inflight)
+            if ids:
+                jobs.update_many({"_id": {"$in": ids}}, {"$set": {"heartbeatAt": datetime.utcnow()}})
+            recover_orphans()
+        except Exception:
+            log.exception("job heartbeat failed")
+        time.sleep(JOB_HEARTBEAT_SEC)
+
+def start() -> None:
+    """Gọi lúc khởi động app: dọn job mồ côi từ lần chạy trước và bật heartbeat."""
+    global _heartbeat
+    if _heartbeat is None:
+        _heartbeat = threading.Thread(target=_beat, name="job-heartbeat", daemon=True)
+        _heartbeat.start()
+
+def get(job_id: str, with_result: bool = False) -> Optional[Dict[str, Any]]:
+    proj = None if with_result else {"result": 0, "trace": 0}
+    d = jobs.find_one({"_id": ObjectId(job_id)}, proj)
+    if not d:
+        return None
+    d["_id"] = str(d["_id"])
+    return d
+
+def cancel(job_id: str) -> Optional[str]:
+    """Đánh dấu huỷ; job đang chạy dừng ở điểm kiểm tra tiếp theo. Trả trạng thái hiện tại."""
+    oid = ObjectId(job_id)
+    d = jobs.find_one_and_update(
+        {"_id": oid, "status": {"$in": ["queued", "running"]}},
+        {"$set": {"cancelRequested": True, "updatedAt": datetime.utcnow()}},
+        projection={"status": 1},
+    )
+    if d:
+        with _lock:
+            _cancel_flags.add(oid)
+        return d["status"]
+    d = jobs.find_one({"_id": oid}, {"status": 1})
+    return d and d["status"]
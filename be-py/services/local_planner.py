@@ -0,0 +1,181 @@
+# be-py/services/local_planner.py
+"""Engine "local": tự xếp thực đơn từ food_items.nutrition, không cần LLM.
+
+Greedy chọn món cho từng bữa theo mục tiêu kcal/macro của bữa, sau đó local search
+(đổi món + chỉnh khẩu phần) để giảm sai lệch; món trùng gần đây / trong cùng đợt bị phạt.
+Kết quả xác định (cùng input -> cùng thực đơn).
+"""
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from collections import Counter
+from services.food_catalog import FoodCatalog
+
+MEALS = ("breakfast", "lunch", "snack")
+SLOTS = {"breakfast": 2, "lunch": 3, "snack": 1}
+DEFAULT_DISTRIBUTION = {"breakfast": 30, "lunch": 50, "snack": 20}
+NUTRIENTS = ("calories", "protein", "fat", "carbohydrate")
+WEIGHTS = {"calories": 1.0, "protein": 0.6, "fat": 0.4, "carbohydrate": 0.4}
+
+# kcal/ngày cho trẻ mầm non theo nhóm BMI; macro theo tỉ lệ năng lượng 15% đạm, 30% béo, 55% bột đường
+DEFAULT_KCAL = {"underweight": 1450, "normal": 1300, "overweight": 1150, "obese": 1050, "unknown": 1300}
+
+QTY_MIN, QTY_MAX, QTY_STEP = 30.0, 250.0, 10.0
+REPEAT_RECENT = 0.15
+REPEAT_IN_PLAN = 0.25
+SEARCH_ROUNDS = 3
+POOL_SIZE = 150
+
+def default_targets(bmi: Optional[str]) -> Dict[str, Any]:
+    kcal = DEFAULT_KCAL.get(bmi or "unknown", DEFAULT_KCAL["normal"])
+    return {
+        "dailyCaloriesTarget": kcal,
+        "macronutrients": {
+            "protein": {"target": round(kcal * 0.15 / 4)},
+            "fat": {"target": round(kcal * 0.30 / 9)},
+            "carbohydrate": {"target": round(kcal * 0.55 / 4)},
+        },
+        "mealDistribution": dict(DEFAULT_DISTRIBUTION),
+    }
+
+def _meal_targets(rec: Dict[str, Any]) -> Dict[str, Dict[str, float]]:
+    """Chia mục tiêu ngày (schema recommendations) theo mealDistribution."""
+    macros = rec.get("macronutrients") or {}
+    day = {
+        "calories": float(rec.get("dailyCaloriesTarget") or 0),
+        "protein": float((macros.get("protein") or {}).get("target") or 0),
+        "fat": float((macros.get("fat") or {}).get("target") or 0),
+        "carbohydrate": float((macros.get("carbohydrate") or {}).get("target") or 0),
+    }
+    dist = rec.get("mealDistribution") or DEFAULT_DISTRIBUTION
+    total = sum(float(dist.get(m) or 0) for m in MEALS) or 100.0
+    return {m: {k: v * float(dist.get(m) or 0) / total for k, v in day.items()} for m in MEALS}
+
+def _per_unit(it: Dict[str, Any]) -> Tuple[float, ...]:
+    """Dinh dưỡng cho 1 đơn vị quantity: g/ml tính theo 100, đơn vị khác (cái, hộp...) tính theo 1."""
+    n = it.get("nutrition") or {}
+    unit = (it.get("unit") or "g").strip().lower()
+    base = 100.0 if unit in ("g", "gram", "gam", "ml") else 1.0
+    return tuple(float(n.get(k) or 0) / base for k in NUTRIENTS)
+
+def _qty_bounds(it: Dict[str, Any]) -> Tuple[float, float, float]:
+    unit = (it.get("unit") or "g").strip().lower()
+    if unit in ("g", "gram", "gam", "ml"):
+        return QTY_MIN, QTY_MAX, QTY_STEP
+    return 1.0, 3.0, 1.0
+
+class _Meal:
+    def __init__(self, target: Dict[str, float]):
+        self.target = [target[k] for k in NUTRIENTS]
+        self.items: List[Tuple[int, float]] = []   # (chỉ số món trong pool, quantity)
+
+def _deviation(totals: List[float], target: List[float]) -> float:
+    err = 0.0
+    for k, (a, t) in enumerate(zip(totals, target)):
+        if t > 0:
+            err += WEIGHTS[NUTRIENTS[k]] * ((a - t) / t) ** 2
+    return err
+
+class _Solver:
+    def __init__(self, pool: List[Dict[str, Any]], penalty: List[float]):
+        self.pool = pool
+        self.unit = [_per_unit(it) for it in pool]
+        self.bounds = [_qty_bounds(it) for it in pool]
+        self.penalty = penalty
+
+    def totals(self, items: Iterable[Tuple[int, float]]) -> List[float]:
+        out = [0.0] * len(NUTRIENTS)
+        for i, q in items:
+            for k, v in enumerate(self.unit[i]):
+                out[k] += v * q
+        return out
+
+    def cost(self, meal: _Meal, items: List[Tuple[int, float]]) -> float:
+        return _deviation(self.totals(items), meal.target) + sum(self.penalty[i] for i, _ in items)
+
+    def best_qty(self, meal: _Meal, fixed: List[Tuple[int, float]], i: int) -> Tuple[float, float]:
+        """Khẩu phần tối ưu cho món i khi các món khác cố định: chi phí là bậc 2 theo q nên có nghiệm đóng."""
+        lo, hi, step = self.bounds[i]
+        base = self.totals(fixed)
+        num = den = 0.0
+        for k, (u, f, t) in enumerate(zip(self.unit[i], base, meal.target)):
+            if t > 0:
+                w = WEIGHTS[NUTRIENTS[k]] / (t * t)
+                num += w * u * (t - f)
+                den += w * u * u
+        q = num / den if den > 0 else lo
+        q = min(hi, max(lo, round(q / step) * step))
+        return q, self.cost(meal, fixed + [(i, q)])
+
+    def fill(self, meal: _Meal, slots: int, taken: set) -> None:
+        """Greedy: thêm lần lượt món giảm chi phí nhiều nhất."""
+        for _ in range(slots):
+            best = None
+            for i in range(len(self.pool)):
+                if i in taken:
+                    continue
+                q, c = self.best_qty(meal, meal.items, i)
+                if best is None or c < best[2]:
+                    best = (i, q, c)
+            if best is None:
+                return
+            meal.items.append((best[0], best[1]))
+            taken.add(best[0])
+
+    def improve(self, meal: _Meal, taken: set) -> None:
+        """Local search: thử đổi từng món (và khẩu phần) cho tới khi không còn cải thiện."""
+        for _ in range(SEARCH_ROUNDS):
+            improved = False
+            for pos in range(len(meal.items)):
+                cur_cost = self.cost(meal, meal.items)
+                others = meal.items[:pos] + meal.items[pos+1:]
+                cur_i = meal.items[pos][0]
+                best = None
+                for i in range(len(self.pool)):
+                    if i in taken and i != cur_i:
+                        continue
+                    q, c = self.best_qty(meal, others, i)
+                    if c < cur_cost - 1e-9 and (best is None or c < best[2]):
+                        best = (i, q, c)
+                if best:
+                    taken.discard(cur_i)
+                    taken.add(best[0])
+                    meal.items[pos] = (best[0], best[1])
+                    improved = True
+            if not improved:
+                return
+
+def _pool(catalog: FoodCatalog, used: Counter, recent: Counter) -> Tuple[List[Dict[str, Any]], List[float]]:
+    items = [it for it in catalog.items if float((it.get("nutrition") or {}).get("calories") or 0) > 0]
+    def pen(it):
+        nm = (it.get("name") or "").strip().lower()
+        return REPEAT_RECENT * recent.get(nm, 0) + REPEAT_IN_PLAN * used.get(it["_id"], 0)
+    # giới hạn pool: món ít bị phạt trước, giữ thứ tự catalog khi bằng nhau
+    ranked = sorted(range(len(items)), key=lambda i: (pen(items[i]), i))[:POOL_SIZE]
+    ranked.sort()
+    pool = [items[i] for i in ranked]
+    return pool, [pen(it) for it in pool]
+
+def plan_day(
+    catalog: FoodCatalog,
+    targets: Dict[str, Any],
+    recent: Optional[Counter] = None,
+    used: Optional[Counter] = None,
+) -> Dict[str, Any]:
+    """Thực đơn 1 ngày cùng dạng với nutrition_planner.menu_from_ai_json. `used` được cập nhật để các ngày sau tránh lặp."""
+    recent = recent or Counter()
+    used = used if used is not None else Counter()
+    pool, penalty = _pool(catalog, used, recent)
+    solver = _Solver(pool, penalty)
+    per_meal = _meal_targets(targets)
+    taken: set = set()
+    out: Dict[str, Any] = {}
+    for m in MEALS:
+        meal = _Meal(per_meal[m])
+        solver.fill(meal, SLOTS[m], taken)
+        solver.improve(meal, taken)
+        items = []
+        for i, q in meal.items:
+            it = pool[i]
+            used[it["_id"]] += 1
+            items.append({"foodItemId": it["_id"], "name": it.get("name"), "quantity": q, "unit": it.get("unit") or "g"})
+        out[m] = {"items": items}
+    return out
@@ -0,0 +1,89 @@
+# be-py/services/measurement_service.py
+from typing import Any, Dict, Iterable, List, Optional
+import threading
+from bson import ObjectId
+from common.db import measurements
+from common.lru import TTLCache
+from common.config import MEASUREMENT_CACHE_TTL_SEC
+from utils.bmi import bmi_status
+
+LATEST_INDEX = [("studentId", 1), ("measurementDate", -1)]
+
+_cache = TTLCache(maxsize=20000, ttl=MEASUREMENT_CACHE_TTL_SEC or 1)
+_index_checked = False
+_index_lock = threading.Lock()
+
+def ensure_latest_index() -> None:
+    """Kiểm tra (một lần mỗi process) index (studentId, measurementDate) hỗ trợ $sort/$group; tạo nếu thiếu."""
+    global _index_checked
+    if _index_checked:
+        return
+    with _index_lock:
+        if _index_checked:
+            return
+        try:
+            info = measurements.index_information().values()
+            if not any(list(v.get("key", [])) == LATEST_INDEX for v in info):
+                measurements.create_index(LATEST_INDEX, name="studentId_1_measurementDate_-1")
+        except Exception:
+            # không có quyền tạo index thì vẫn chạy được, chỉ chậm hơn
+            pass
+        _index_checked = True
+
+def _as_oids(ids: Iterable[Any]) -> List[ObjectId]:
+    return [x if isinstance(x, ObjectId) else ObjectId(x) for x in ids]
+
+def latest_measurements(student_ids: Iterable[Any]) -> Dict[str, Dict[str, Any]]:
+    """Số đo mới nhất của mỗi học sinh trong một aggregation; học sinh chưa có số đo không có trong kết quả."""
+    oids = _as_oids(student_ids)
+    out: Dict[str, Dict[str, Any]] = {}
+    missing: List[ObjectId] = []
+    for oid in oids:
+        hit = _cache.get(str(oid)) if MEASUREMENT_CACHE_TTL_SEC > 0 else None
+        if hit is None:
+            missing.append(oid)
+        elif hit:
+            out[str(oid)] = hit
+    if not missing:
+        return out
+
+    ensure_latest_index()
+    found = {}
+    for d in measurements.aggregate([
+        {"$match": {"studentId": {"$in": missing}}},
+        {"$sort": {"studentId": 1, "measurementDate": -1}},
+        {"$group": {
+            "_id": "$studentId",
+            "weight": {"$first": "$weight"},
+            "height": {"$first": "$height"},
+            "bmi": {"$first": "$bmi"},
+            "measurementDate": {"$first": "$measurementDate"},
+        }},
+    ]):
+        found[str(d.pop("_id"))] = d
+    for oid in missing:
+        sid = str(oid)
+        m = found.get(sid)
+        if MEASUREMENT_CACHE_TTL_SEC > 0:
+            # {} = đã kiểm tra, chưa có số đo
+            _cache.set(sid, m or {})
+        if m:
+            out[sid] = m
+    return out
+
+def latest_bmi_map(student_ids: Iterable[Any]) -> Dict[str, str]:
+    oids = _as_oids(student_ids)
+    latest = latest_measurements(oids)
+    out = {}
+    for oid in oids:
+        m = latest.get(str(oid))
+        out[str(oid)] = (m and bmi_status(m.get("bmi"))) or "unknown"
+    return out
+
+def invalidate(student_ids: Optional[Iterable[Any]] = None) -> None:
+    """Gọi khi có số đo mới (hoặc NestJS báo qua /nutrition/cache/measurements/invalidate)."""
+    if student_ids is None:
+        _cache.clear()
+        return
+    for sid in student_ids:
+        _cache.pop(str(sid))
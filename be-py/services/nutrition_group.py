@@ -2,28 +2,16 @@
 from typing import List, Dict, Any, Optional, Tuple
 from bson import ObjectId
 from datetime import datetime
-from common.db import students, classes, measurements, db
-from utils.bmi import bmi_status
-from ai.gemini_client import generate as gemini_generate
-from ai.ollama_client import generate as ollama_generate
-import json, re
-
-def _parse_ai_json(raw: str):
-    if not raw or not isinstance(raw, str):
-        return {}
-    try:
-        return json.loads(raw)
-    except Exception:
-        pass
-    try:
-        m = re.search(r"(\{.*\}|\[.*\])", raw, flags=re.S)
-        if m:
-            return json.loads(m.group(1))
-    except Exception:
-        pass
-    return {}
+from common.db import students, classes, db
+from services.measurement_service import latest_bmi_map
+from common.paging import akeyset_page, acached_total, encode_cursor
+from common import adb
+from ai.structured import generate_model
+from ai.schemas import Grouping
+import json
 
 _groupings = db["student_groupings"]
+_agroupings = adb.db["student_groupings"]
 
 def _oid(x: str) -> ObjectId:
     return ObjectId(x)
@@ -41,16 +29,9 @@ def _load_roster(class_id: str) -> List[Dict[str, Any]]:
         {"_id":1,"fullName":1,"healthInfo":1}
     ))
 
-def _latest_bmi_map(student_ids: List[ObjectId]) -> Dict[str, str]:
-    out = {}
-    for sid in student_ids:
-        m = measurements.find_one({"studentId": sid}, sort=[("measurementDate",-1)])
-        out[str(sid)] = (m and bmi_status(m.get("bmi"))) or "unknown"
-    return out
-
 def _bucketize(roster: List[Dict[str,Any]]) -> Dict[str, List[str]]:
     ids = [s["_id"] for s in roster]
-    bmi_map = _latest_bmi_map(ids)
+    bmi_map = latest_bmi_map(ids)
     buckets: Dict[str, List[str]] = {}
     for s in roster:
         sid = str(s["_id"])
@@ -78,10 +59,7 @@ def _merge_buckets_to_limit(buckets: Dict[str,List[str]], limit: int) -> List[Di
     out.append({"key": "mixed|mixed", "name": "Hỗn hợp", "studentIds": others})
     return out
 
-def analyze_grouping(class_id: str, group_count: Optional[int], engine: str, teacher_hint: str) -> Dict[str,Any]:
-    from ai.gemini_client import generate as gemini_generate
-    from ai.ollama_client import generate as ollama_generate
-
+def analyze_grouping(class_id: str, group_count: Optional[int], engine: str, teacher_hint: str, use_cache: bool = True) -> Dict[str,Any]:
     cls = classes.find_one({"_id": _oid(class_id)}, {"name": 1})
     if not cls:
         return {"ok": False, "message": "Class not found"}
@@ -90,12 +68,12 @@ def analyze_grouping(class_id: str, group_count: Optional[int], engine: str, tea
     if not roster:
         return {"ok": False, "message": "No students found"}
 
+    bmi_map = latest_bmi_map([s["_id"] for s in roster])
     data_points = []
     for s in roster:
         info = s.get("healthInfo", {}) or {}
         sid = str(s["_id"])
-        m = measurements.find_one({"studentId": s["_id"]}, sort=[("measurementDate", -1)])
-        bmi = bmi_status(m.get("bmi")) if m else "unknown"
+        bmi = bmi_map.get(sid, "unknown")
         data_points.append({
             "id": sid,
             "name": s.get("fullName"),
@@ -127,29 +105,16 @@ Dữ liệu học sinh:
     """.strip()
 
     try:
-        if engine == "ollama":
-            raw = ollama_generate(prompt)
-        else:
-            raw = gemini_generate(prompt)
-
-        parsed = _parse_ai_json(raw)
-        if not parsed:
-            raise ValueError("AI không trả JSON hoặc kết quả rỗng")
-
-        if not isinstance(parsed, list):
-            raise ValueError("Kết quả không phải danh sách nhóm")
+        parsed, _ = generate_model(prompt, "ollama" if engine == "ollama" else "gemini", Grouping, use_cache=use_cache)
 
         groups = []
-        for idx, g in enumerate(parsed):
-            sid_list = g.get("studentIds") or []
-            if isinstance(sid_list, dict):
-                sid_list = list(sid_list.values())
+        for idx, g in enumerate(parsed.root):
             groups.append({
-                "key": g.get("key") or f"group_{idx+1}",
-                "name": g.get("name") or f"Nhóm {idx+1}",
-                "description": g.get("description", ""),
-                "criteriaSummary": g.get("criteriaSummary", {}),
-                "studentIds": [str(x) for x in sid_list],
+                "key": g.key or f"group_{idx+1}",
+                "name": g.name or f"Nhóm {idx+1}",
+                "description": g.description,
+                "criteriaSummary": g.criteriaSummary,
+                "studentIds": g.studentIds,
             })
 
         return {
@@ -200,23 +165,28 @@ def save_grouping(payload: Dict[str,Any]) -> Tuple[bool, Optional[str]]:
     r = _groupings.insert_one(doc)
     return True, str(r.inserted_id)
 
-def list_groupings(class_id: str, page: int, page_size: int) -> Dict[str,Any]:
+GROUPING_SORT = [("createdAt", -1), ("_id", -1)]
+# view=summary: chỉ tên/key từng nhóm, không có studentIds, mô tả
+GROUPING_SUMMARY = {"classId": 1, "name": 1, "engine": 1, "groupCount": 1, "teacherHint": 1, "createdAt": 1,
+                    "groups.key": 1, "groups.name": 1}
+
+async def list_groupings(class_id: str, page: int, page_size: int, cursor: Optional[str] = None,
+                         view: str = "full", with_total: bool = True) -> Dict[str,Any]:
+    """Keyset theo (createdAt, _id) khi có cursor hoặc page=1; page>1 không cursor vẫn dùng skip để tương thích.
+    Cursor sai -> BadCursor. Document trả nguyên dạng BSON (router encode bằng BSONResponse)."""
     q = {"classId": _oid(class_id)}
-    total = _groupings.count_documents(q)
-    cur = _groupings.find(q).sort([("createdAt",-1)]).skip((page-1)*page_size).limit(page_size)
-    items = []
-    for d in cur:
-        d["_id"] = str(d["_id"])
-        d["classId"] = str(d["classId"])
-        items.append(d)
-    return {"ok": True, "total": total, "items": items}
-
-def get_grouping(group_id: str) -> Optional[Dict[str,Any]]:
-    d = _groupings.find_one({"_id": _oid(group_id)})
-    if not d: return None
-    d["_id"] = str(d["_id"])
-    d["classId"] = str(d["classId"])
-    return d
+    proj = None if view == "full" else GROUPING_SUMMARY
+    if cursor or page == 1:
+        docs, nxt, total = await akeyset_page(_agroupings, q, GROUPING_SORT, page_size, cursor, proj, with_total)
+    else:
+        docs = await _agroupings.find(q, proj).sort(GROUPING_SORT).skip((page-1)*page_size).limit(page_size + 1).to_list()
+        nxt = encode_cursor(docs[page_size-1], GROUPING_SORT) if len(docs) > page_size else None
+        docs = docs[:page_size]
+        total = await acached_total(_agroupings, q) if with_total else None
+    return {"ok": True, "total": total, "nextCursor": nxt, "items": docs}
+
+async def get_grouping(group_id: str) -> Optional[Dict[str,Any]]:
+    return await _agroupings.find_one({"_id": _oid(group_id)})
 
 def regen_grouping(group_id: str) -> Optional[Dict[str,Any]]:
     old = _groupings.find_one({"_id": _oid(group_id)})
@@ -226,5 +196,6 @@ def regen_grouping(group_id: str) -> Optional[Dict[str,Any]]:
         group_count=old.get("groupCount"),
         engine=old.get("engine","gemini"),
         teacher_hint=old.get("teacherHint",""),
+        use_cache=False,
     )
     return data
@@ -2,26 +2,33 @@
 from __future__ import annotations
 import os
 from typing import List, Dict, Any, Literal, Tuple
+from collections import Counter
 from bson import ObjectId
-from datetime import datetime, timedelta, date as _date
+from datetime import datetime, timedelta
 import requests
 
-from common.db import students, classes, food_items, measurements, daily_health_status as health, nutri_recs, daily_food_intake as intake
+from common.db import students, classes
+from services.food_catalog import FoodCatalog, get_catalog
+from services.local_planner import plan_day, default_targets
+from services.measurement_service import latest_bmi_map
+from services.draft_writer import DraftWriter, committed, previews_from_docs, fill_previews
+from services import recent_dishes
 
-from ai.gemini_client import generate as ggen
-from ai.ollama_client import generate as lgen
+from ai import llm
+from ai.structured import generate_json, StructuredOutputError
+from ai.schemas import BatchMenus, DayMenu
+from common.config import LLM_PLAN_DEADLINE_SEC, PLAN_BATCH_SIZE
 
-from utils.bmi import bmi_status
-import json, re
+import time
 
 NEST_API = os.getenv("API_BASE", "http://127.0.0.1:3000")
 CTX_DAYS = 7                             
-ENGINE_MAP = {"gemini": "gemini", "ollama": "ollama", "local": "ollama"}  
+ENGINE_MAP = {"gemini": "gemini", "ollama": "ollama", "local": "local"}  
 
 def _oid(x: str) -> ObjectId:
     return ObjectId(x)
 
-def _normalize_engine(e: str) -> Literal["gemini", "ollama"]:
+def _normalize_engine(e: str) -> Literal["gemini", "ollama", "local"]:
     e = (e or "gemini").strip().lower()
     return ENGINE_MAP.get(e, "gemini")  
 
@@ -37,54 +44,6 @@ def _school_days(start_ymd: str, days: int) -> List[str]:
         cur += timedelta(days=1)
     return out
 
-def _load_food_catalog() -> List[Dict[str, Any]]:
-    cur = food_items.find(
-        {"isActive": {"$ne": False}},
-        {"_id": 1, "name": 1, "unit": 1, "category": 1, "nutrition": 1, "allergens": 1, "isVegetarian": 1, "isHalal": 1},
-    )
-    out: List[Dict[str, Any]] = []
-    for d in cur:
-        d["_id"] = str(d["_id"])
-        out.append(d)
-    return out
-
-def _catalog_index(catalog: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
-    return {it["_id"]: it for it in catalog}
-
-def _pick_id_by_name(name: str, catalog: List[Dict[str, Any]]) -> str | None:
-    if not name:
-        return None
-    n = name.strip().lower()
-    for it in catalog:
-        if it["name"].strip().lower() == n:
-            return it["_id"]
-    for it in catalog:
-        nm = it["name"].strip().lower()
-        if n in nm or nm in n:
-            return it["_id"]
-    return None
-
-def _with_names(items: List[Dict[str, Any]], idx: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
-    out: List[Dict[str, Any]] = []
-    for it in items or []:
-        fid = it.get("foodItemId")
-        nm = it.get("name")
-        if not nm and fid and fid in idx:
-            nm = idx[fid]["name"]
-        out.append({**it, "name": nm})
-    return out
-
-def _filter_catalog_by_allergen(catalog: List[Dict[str, Any]], allergy: str | None) -> List[Dict[str, Any]]:
-    if not allergy or allergy == "none":
-        return catalog
-    key = (allergy or "").lower()
-    def ok(it: Dict[str, Any]) -> bool:
-        for a in it.get("allergens") or []:
-            if key in (a or "").lower():
-                return False
-        return True
-    return [it for it in catalog if ok(it)]
-
 def _fetch_class_context(class_id: str, days: int = CTX_DAYS) -> Dict[str, Any]:
     try:
         r = requests.get(f"{NEST_API}/nutrition/context", params={"classId": class_id, "days": days}, timeout=15)
@@ -92,89 +51,76 @@ def _fetch_class_context(class_id: str, days: int = CTX_DAYS) -> Dict[str, Any]:
             return r.json()
     except Exception:
         pass
-    since = datetime.utcnow() - timedelta(days=days+2)
-    recent_menus: List[str] = []
-    for d in nutri_recs.find({"createdAt": {"$gte": since}}, {"recommendations": 1}).limit(500):
-        meals = ((d.get("recommendations") or {}).get("meals") or {})
-        for k in ("breakfast", "lunch", "snack"):
-            for it in (meals.get(k, {}).get("items") or []):
-                name = (it.get("name") or "").strip().lower()
-                if name:
-                    recent_menus.append(name)
-    return {"menusRecent": recent_menus, "intakeRecent": [], "healthRecent": []}
-
-def _penalize_repeats(candidates: List[Dict[str, Any]], ctx: Dict[str, Any]) -> List[Dict[str, Any]]:
-    recent_names = set([s for s in (ctx.get("menusRecent") or [])])
-    if not recent_names:
+    # chỉ mục món gần đây của riêng lớp này (cập nhật khi ghi menu_draft), món mới hơn nặng hơn
+    weights = recent_dishes.recent(class_id, days + 2)
+    return {"menusRecent": [nm for nm, _ in weights.most_common()], "recentWeights": weights,
+            "intakeRecent": [], "healthRecent": []}
+
+def _recent_weights(ctx: Dict[str, Any]) -> Counter:
+    """Tên món -> trọng số lặp: từ chỉ mục nếu có, nếu không thì đếm menusRecent của NestJS."""
+    w = ctx.get("recentWeights")
+    if w is not None:
+        return w
+    return Counter(recent_dishes.norm_name(x) for x in (ctx.get("menusRecent") or []))
+
+def penalize_repeats(candidates: List[Dict[str, Any]], recent: Counter) -> List[Dict[str, Any]]:
+    """Món chưa gặp gần đây lên trước, sau đó theo trọng số lặp tăng dần (sort ổn định)."""
+    if not recent:
         return candidates
-    def score(x: Dict[str, Any]) -> int:
-        nm = (x.get("name") or "").strip().lower()
-        return 1 if nm and nm not in recent_names else 2  
-    return sorted(candidates, key=score)
-
-def _ai(engine: Literal["gemini", "ollama"], prompt: str) -> str:
-    if engine == "gemini":
-        return ggen(prompt, model="gemini-2.5-flash")
-    return lgen(prompt)
-
-def _parse_ai_json(raw: str) -> Dict[str, Any]:
-    
-    try:
-        return json.loads(raw)
-    except Exception:
-        try:
-            m = re.search(r"\{.*\}", raw, flags=re.S)
-            if m:
-                return json.loads(m.group(0))
-        except Exception:
-            pass
-    return {}
-
-def _menu_from_ai_json(j: Dict[str, Any], catalog: List[Dict[str, Any]]) -> Dict[str, Any]:
-    idx = _catalog_index(catalog)
+    return sorted(candidates, key=lambda x: recent.get(recent_dishes.norm_name(x.get("name")), 0))
+
+def _ai_json(engine: Literal["gemini", "ollama"], prompt: str, cls, deadline: float | None = None) -> Dict[str, Any]:
+    """Gọi LLM ở chế độ JSON, validate theo schema `cls` (1 lần sửa); lỗi -> StructuredOutputError."""
+    model = "gemini-2.5-flash" if engine == "gemini" else None
+    return generate_json(prompt, engine, cls, model=model, deadline=deadline)[0]
+
+def menu_from_ai_json(j: Dict[str, Any], catalog: FoodCatalog) -> Dict[str, Any]:
+    idx = catalog.by_id
+    meals_in = (j.get("meals") or {})
+    raw = {k: [x for x in (meals_in.get(k) or []) if isinstance(x, dict)] for k in ("breakfast", "lunch", "snack")}
+
+    # resolve một lượt mọi tên món chưa có foodItemId trong cả thực đơn
+    pending = [x for k in raw for x in raw[k] if not x.get("foodItemId") and (x.get("name") or "").strip()]
+    matches = dict(zip(map(id, pending), catalog.resolver.resolve_many([x["name"] for x in pending])))
+
     def norm(arr):
         out = []
-        for x in (arr or []):
+        for x in arr:
             fid = x.get("foodItemId")
             nm = (x.get("name") or "").strip()
-            if not fid and nm:
-                fid = _pick_id_by_name(nm, catalog)
             if not fid and not nm:
                 continue
+            hit = matches.get(id(x))
+            if hit:
+                fid = hit["foodItemId"]
             qty = float(x.get("quantity") or 100)
             unit = (idx.get(fid, {}).get("unit") if fid else (x.get("unit") or "g")) or "g"
-            out.append({"foodItemId": fid, "name": nm or (idx.get(fid, {}) or {}).get("name"), "quantity": qty, "unit": unit})
+            it = {"foodItemId": fid, "name": nm or (idx.get(fid, {}) or {}).get("name"), "quantity": qty, "unit": unit}
+            if hit and hit["method"] != "exact":
+                it["matchConfidence"] = hit["confidence"]
+            out.append(it)
         return out
 
-    meals_in = (j.get("meals") or {})
-    return {
-        "breakfast": {"items": norm(meals_in.get("breakfast"))},
-        "lunch":     {"items": norm(meals_in.get("lunch"))},
-        "snack":     {"items": norm(meals_in.get("snack"))},
-    }
+    return {k: {"items": norm(raw[k])} for k in ("breakfast", "lunch", "snack")}
 
-def _save_menu_draft(school_id: ObjectId, class_id: ObjectId, date_ymd: str, group_name: str, meals: Dict[str, Any], engine: str) -> str:
-    doc = {
+def _menu_draft_doc(class_id: ObjectId, date_ymd: str, group_name: str, meals: Dict[str, Any], engine: str, student_count: int) -> Dict[str, Any]:
+    now = datetime.utcnow()
+    return {
         "type": "menu_draft",
         "classId": class_id,
         "date": datetime.fromisoformat(date_ymd),
-        "studentGroup": {"name": group_name},
+        "studentGroup": {"name": group_name, "studentCount": student_count},
         "meals": meals,
         "aiModel": engine,
         "appliedToMenu": False,
-        "createdAt": datetime.utcnow(),
-        "updatedAt": datetime.utcnow(),
+        "createdAt": now,
+        "updatedAt": now,
     }
-    ins = nutri_recs.insert_one(doc)
-    return str(ins.inserted_id)
 
 def _group_class_students_simple(class_id: str) -> List[Dict[str, Any]]:
     """Phân nhóm đơn giản theo BMI + dị ứng (MVP), để fallback khi không có groupId."""
     roster = list(students.find({"classId": _oid(class_id), "isActive": {"$ne": False}}, {"_id": 1, "fullName": 1, "healthInfo": 1}))
-    latest_map: Dict[str, str] = {}
-    for s in roster:
-        m = measurements.find_one({"studentId": s["_id"]}, sort=[("measurementDate", -1)])
-        latest_map[str(s["_id"])] = (m and bmi_status(m.get("bmi"))) or "unknown"
+    latest_map = latest_bmi_map([s["_id"] for s in roster])
 
     def allergy_key(s) -> str:
         arr = ((s.get("healthInfo") or {}).get("allergies") or [])
@@ -210,11 +156,11 @@ def _fetch_saved_grouping(group_id: str) -> Tuple[List[Dict[str, Any]], str]:
         pass
     return [], ""
 
-def _build_prompt_for_group(constraints: Dict[str, Any], ctx: Dict[str, Any]) -> str:
+def _build_prompt_for_group(constraints: Dict[str, Any], ctx: Dict[str, Any], date_ymd: str) -> str:
     recent = ctx.get("menusRecent") or []
     recent_hint = ", ".join(list(dict.fromkeys([x for x in recent]))[:12]) 
     return f"""
-Bạn là chuyên gia dinh dưỡng mầm non. Hãy tạo thực đơn TRONG NGÀY cho nhóm học sinh có đặc điểm:
+Bạn là chuyên gia dinh dưỡng mầm non. Hãy tạo thực đơn TRONG NGÀY {date_ymd} cho nhóm học sinh có đặc điểm:
 - BMI: {constraints.get('bmi')}
 - Dị ứng: {constraints.get('allergy')}
 - Tránh lặp món gần đây: [{recent_hint}]
@@ -228,22 +174,109 @@ Bạn là chuyên gia dinh dưỡng mầm non. Hãy tạo thực đơn TRONG NG
 }}
     """.strip()
 
+def _build_prompt_batch(entries: List[Tuple[str, Dict[str, Any], str]], ctx: Dict[str, Any]) -> str:
+    """Một prompt cho nhiều (nhóm, ngày); entries: (key, constraints, YYYY-MM-DD)."""
+    recent = ctx.get("menusRecent") or []
+    recent_hint = ", ".join(list(dict.fromkeys([x for x in recent]))[:12])
+    lines = "\n".join(
+        f'- "{key}": ngày {ds}, BMI {c.get("bmi")}, dị ứng {c.get("allergy")}' for key, c, ds in entries
+    )
+    return f"""
+Bạn là chuyên gia dinh dưỡng mầm non. Hãy tạo thực đơn TRONG NGÀY cho TỪNG mục sau (mỗi mục là một nhóm học sinh trong một ngày):
+{lines}
+- Các ngày khác nhau của cùng nhóm không lặp món.
+- Tránh lặp món gần đây: [{recent_hint}]
+- Xuất JSON STRICT, đủ tất cả key ở trên:
+{{
+  "menus": {{
+    "<key>": {{
+      "meals": {{
+        "breakfast": [{{"foodItemId":"", "name":"", "quantity":120, "unit":"g"}}],
+        "lunch":     [{{"foodItemId":"", "name":"", "quantity":150, "unit":"g"}}],
+        "snack":     [{{"foodItemId":"", "name":"", "quantity":100, "unit":"g"}}]
+      }}
+    }}
+  }}
+}}
+    """.strip()
+
+def plan_ai_menus(eng: str, entries: List[Tuple[str, Dict[str, Any], str]], ctx: Dict[str, Any], batch_size: int,
+                   deadline: float | None = None) -> Dict[str, Dict[str, Any]]:
+    """JSON thực đơn cho từng key. Gộp tối đa batch_size mục mỗi lời gọi; mục thiếu/hỏng thì gọi lại riêng từng mục.
+    Mục vẫn hỏng sau khi sửa, hoặc khi không còn engine LLM nào dùng được (LLMUnavailable), bị bỏ trống
+    để caller xếp bằng engine local."""
+    out: Dict[str, Dict[str, Any]] = {}
+    batch_size = max(1, int(batch_size))
+    for i in range(0, len(entries), batch_size):
+        chunk = entries[i:i+batch_size]
+        try:
+            if len(chunk) > 1:
+                try:
+                    menus = _ai_json(eng, _build_prompt_batch(chunk, ctx), BatchMenus, deadline)["menus"]
+                    for key, _, _ in chunk:
+                        if key in menus:
+                            out[key] = menus[key]
+                except StructuredOutputError:
+                    pass
+            for key, constraints, ds in chunk:
+                if key not in out:
+                    try:
+                        out[key] = _ai_json(eng, _build_prompt_for_group(constraints, ctx, ds), DayMenu, deadline)
+                    except StructuredOutputError:
+                        pass        # caller xếp mục này bằng engine local
+        except llm.LLMUnavailable:
+            break
+    return out
+
+def _build_prompt_for_student(full_name: str, date_ymd: str) -> str:
+    # có ngày trong prompt để mỗi ngày là một prompt riêng (không trùng cache)
+    return f"""
+Bạn là chuyên gia dinh dưỡng mầm non. Hãy tạo thực đơn TRONG NGÀY {date_ymd} cho học sinh {full_name}
+- Tránh lặp món gần đây trong lớp
+- Xuất JSON STRICT:
+{{
+  "meals": {{
+    "breakfast": [{{"foodItemId":"", "name":"", "quantity":120, "unit":"g"}}],
+    "lunch":     [{{"foodItemId":"", "name":"", "quantity":150, "unit":"g"}}],
+    "snack":     [{{"foodItemId":"", "name":"", "quantity":100, "unit":"g"}}]
+  }}
+}}
+    """.strip()
+
 def plan_menus_for_class(
     class_id: str,
     start_date: str,
     days: int,
     engine: str,
     group_id: str | None,
+    batch_size: int | None = None,
+    idempotency_key: str | None = None,
+    transaction: bool | None = None,
 ) -> Dict[str, Any]:
+    """batch_size: số mục (nhóm x ngày) mỗi lời gọi LLM; 1 = mỗi mục một lời gọi như trước.
+    idempotency_key: request retry với cùng key trả lại các nháp đã lưu, không sinh lại."""
     eng = _normalize_engine(engine)
 
     cls = classes.find_one({"_id": _oid(class_id)}, {"name": 1, "schoolId": 1})
     if not cls:
         return {"ok": False, "message": "Class not found"}
 
-    catalog = _load_food_catalog()
+    key = idempotency_key and f"plan-menus:{class_id}:{idempotency_key}"
+    done = committed(key)
+    if done:
+        return {
+            "ok": True,
+            "schoolId": str(cls["schoolId"]),
+            "class": {"_id": class_id, "name": cls.get("name")},
+            "previews": previews_from_docs(done),
+            "draftIds": [str(d["_id"]) for d in done],
+            "replayed": True,
+        }
+
+    catalog = get_catalog()
     dates = _school_days(start_date, days)
     ctx = _fetch_class_context(class_id, CTX_DAYS)
+    recent = _recent_weights(ctx)
 
     # Lấy nhóm
     groups, grouping_name = ([], "")
@@ -253,34 +286,43 @@ def plan_menus_for_class(
         groups = _group_class_students_simple(class_id)
 
     previews: List[Dict[str, Any]] = []
-    draft_ids: List[str] = []
+    writer = DraftWriter(key, transaction, total=len(groups) * len(dates))
+
+    ai_menus: Dict[str, Dict[str, Any]] = {}
+    if eng != "local":
+        entries = [(f"g{gi+1}_{ds}", g.get("constraints") or {}, ds) for gi, g in enumerate(groups) for ds in dates]
+        ai_menus = plan_ai_menus(eng, entries, ctx, batch_size or PLAN_BATCH_SIZE, time.monotonic() + LLM_PLAN_DEADLINE_SEC)
 
-    for g in groups:
+    for gi, g in enumerate(groups):
         group_name = g.get("name") or "nhóm"
         constraints = g.get("constraints") or {}
-        filtered_catalog = _filter_catalog_by_allergen(catalog, constraints.get("allergy"))
+        filtered_catalog = catalog.without_allergen(constraints.get("allergy"))
+        used: Counter = Counter()
 
         for ds in dates:
-            prompt = _build_prompt_for_group(constraints, ctx)
-            raw = _ai(eng, prompt)
-            j = _parse_ai_json(raw)
-            meals = _menu_from_ai_json(j, filtered_catalog)
+            j = ai_menus.get(f"g{gi+1}_{ds}")
+            if j is not None:
+                meals, src = menu_from_ai_json(j, filtered_catalog), eng
+            else:
+                # engine=local, hoặc LLM không khả dụng cho mục này
+                meals, src = plan_day(filtered_catalog, default_targets(constraints.get("bmi")), recent, used), "local"
 
             for k in ("breakfast", "lunch", "snack"):
                 items = meals[k]["items"]
-                meals[k]["items"] = _penalize_repeats(items, ctx)
-
-            rec_id = _save_menu_draft(cls["schoolId"], _oid(class_id), ds, group_name, meals, eng)
-            draft_ids.append(rec_id)
+                meals[k]["items"] = penalize_repeats(items, recent)
 
+            n = len(g.get("studentIds") or [])
+            writer.add(_menu_draft_doc(_oid(class_id), ds, group_name, meals, src, n))
             previews.append({
-                "recId": rec_id,
                 "date": ds,
                 "groupName": group_name,
-                "studentCount": len(g.get("studentIds") or []),
+                "studentCount": n,
                 "meals": meals, 
             })
 
+    draft_ids = writer.commit()
+    fill_previews(previews, draft_ids, writer.stored)
+
     return {
         "ok": True,
         "schoolId": str(cls["schoolId"]),
@@ -294,61 +336,78 @@ def plan_menus_for_student(
     start_date: str,
     days: int,
     engine: str,
+    idempotency_key: str | None = None,
+    transaction: bool | None = None,
 ) -> Dict[str, Any]:
     eng = _normalize_engine(engine)
 
-    s = students.find_one({"_id": _oid(student_id)}, {"fullName": 1, "classId": 1, "schoolId": 1})
+    s = students.find_one({"_id": _oid(student_id)}, {"fullName": 1, "classId": 1, "schoolId": 1, "healthInfo": 1})
     if not s:
         return {"ok": False, "message": "Student not found"}
 
     cls = classes.find_one({"_id": s.get("classId")}, {"name": 1, "schoolId": 1})
     school_id = s.get("schoolId") or (cls and cls.get("schoolId"))
-    catalog = _load_food_catalog()
+    result = {
+        "ok": True,
+        "student": {"_id": student_id, "fullName": s.get("fullName")},
+        "schoolId": str(school_id),
+        "classId": str(s.get("classId") or ""),
+    }
+    key = idempotency_key and f"plan-student:{student_id}:{idempotency_key}"
+    done = committed(key)
+    if done:
+        return {**result, "previews": previews_from_docs(done), "draftIds": [str(d["_id"]) for d in done], "replayed": True}
+
+    catalog = get_catalog()
     dates = _school_days(start_date, days)
 
     ctx = _fetch_class_context(str(s.get("classId")), CTX_DAYS)
+    recent = _recent_weights(ctx)
+    used: Counter = Counter()
+    local: Tuple[FoodCatalog, Dict[str, Any]] | None = None
+
+    def local_day() -> Dict[str, Any]:
+        nonlocal local
+        if local is None:
+            cat = catalog
+            for a in ((s.get("healthInfo") or {}).get("allergies") or []):
+                cat = cat.without_allergen(a)
+            local = (cat, default_targets(latest_bmi_map([s["_id"]]).get(str(s["_id"]))))
+        return plan_day(local[0], local[1], recent, used)
 
     previews: List[Dict[str, Any]] = []
-    draft_ids: List[str] = []
-
-    base_prompt = f"""
-Bạn là chuyên gia dinh dưỡng mầm non. Hãy tạo thực đơn TRONG NGÀY cho học sinh {s.get('fullName','')}
-- Tránh lặp món gần đây trong lớp
-- Xuất JSON STRICT:
-{{
-  "meals": {{
-    "breakfast": [{{"foodItemId":"", "name":"", "quantity":120, "unit":"g"}}],
-    "lunch":     [{{"foodItemId":"", "name":"", "quantity":150, "unit":"g"}}],
-    "snack":     [{{"foodItemId":"", "name":"", "quantity":100, "unit":"g"}}]
-  }}
-}}
-    """.strip()
+    writer = DraftWriter(key, transaction, total=len(dates))
+    deadline = time.monotonic() + LLM_PLAN_DEADLINE_SEC
+    src = eng
 
     for ds in dates:
-        raw = _ai(eng, base_prompt)
-        j = _parse_ai_json(raw)
-        meals = _menu_from_ai_json(j, catalog)
+        day_src = src
+        if src == "local":
+            meals = local_day()
+        else:
+            try:
+                j = _ai_json(eng, _build_prompt_for_student(s.get("fullName", ""), ds), DayMenu, deadline)
+                meals = menu_from_ai_json(j, catalog)
+            except StructuredOutputError:
+                day_src, meals = "local", local_day()
+            except llm.LLMUnavailable:
+                # các ngày còn lại xếp bằng engine local
+                src = day_src = "local"
+                meals = local_day()
 
         for k in ("breakfast", "lunch", "snack"):
             items = meals[k]["items"]
-            meals[k]["items"] = _penalize_repeats(items, ctx)
-
-        rec_id = _save_menu_draft(school_id, s.get("classId"), ds, s.get("fullName", "Học sinh"), meals, eng)
-        draft_ids.append(rec_id)
+            meals[k]["items"] = penalize_repeats(items, recent)
 
+        writer.add(_menu_draft_doc(s.get("classId"), ds, s.get("fullName", "Học sinh"), meals, day_src, 1))
         previews.append({
-            "recId": rec_id,
             "date": ds,
             "groupName": s.get("fullName") or "HS",
             "studentCount": 1,
             "meals": meals,
         })
 
-    return {
-        "ok": True,
-        "student": {"_id": student_id, "fullName": s.get("fullName")},
-        "schoolId": str(school_id),
-        "classId": str(s.get("classId") or ""),
-        "previews": previews,
-        "draftIds": draft_ids,
-    }
+    draft_ids = writer.commit()
+    fill_previews(previews, draft_ids, writer.stored)
+
+    return {**result, "previews": previews, "draftIds": draft_ids}
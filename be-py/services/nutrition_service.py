@@ -1,21 +1,32 @@
 # be-py/services/nutrition_service.py
-import json
-from typing import Literal, Dict, Any
+import json, asyncio, functools, time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Literal, Dict, Any, AsyncIterator
 from bson import ObjectId
 from utils.bmi import age_in_months, bmi_status
-from common.db import students, measurements, intakes, health, nutri_recs, food_items
+from common.db import students, intakes, health, nutri_recs
+from common import read_cache
+from services.measurement_service import latest_measurements
+from services.food_catalog import FoodCatalog, get_catalog
+from services.local_planner import plan_day, default_targets
+from services.nutrition_planner import CTX_DAYS, plan_ai_menus, menu_from_ai_json, penalize_repeats
+from services import recent_dishes
+from common.config import LLM_PLAN_DEADLINE_SEC, PLAN_BATCH_SIZE
+from services.draft_writer import DraftWriter, committed, stored_docs, previews_from_docs, fill_previews
+from ai import llm
+from ai.structured import generate_json
+from utils.aio import bounded_as_completed
+from ai.schemas import RecommendationResult
 from datetime import datetime, timedelta, date
 from typing import List, Tuple
+from collections import Counter
 
 WEEKDAYS = {0,1,2,3,4} 
+GENERATE_FLUSH_EVERY = 20   # generate-class: số gợi ý mỗi lần insert_many
 
 def _oid(x: str) -> ObjectId: return ObjectId(x)
 
-def load_student_context(student_id: str, days: int = 7) -> Dict[str, Any]:
-    s = students.find_one({"_id": _oid(student_id)})
-    if not s:
-        raise ValueError("Student not found")
-
+def _build_context(s: Dict[str, Any], m: Dict[str, Any] | None, intake_ids: List[str], last_health: Dict[str, Any] | None) -> Dict[str, Any]:
     dob = s.get("dateOfBirth")
     dob_date = dob.date() if hasattr(dob, "date") else dob
     age_months = age_in_months(dob_date)
@@ -23,25 +34,14 @@ def load_student_context(student_id: str, days: int = 7) -> Dict[str, Any]:
     cls_id = s.get("classId")                
     cls_id_str = str(cls_id) if cls_id else None
 
-    m = measurements.find_one({"studentId": s["_id"]}, sort=[("measurementDate", -1)])
     weight, height, bmi = None, None, None
     if m:
         weight, height, bmi = m.get("weight"), m.get("height"), m.get("bmi")
 
-    since = datetime.utcnow() - timedelta(days=days)
-    rec_intakes = list(
-        intakes.find({"studentId": s["_id"], "date": {"$gte": since}}, {"_id": 1})
-    )
-    intake_ids = [str(x["_id"]) for x in rec_intakes]
-
-    recent_health = list(
-        health.find({"studentId": s["_id"], "date": {"$gte": since}})
-    )
     health_conds, activity = [], None
-    if recent_health:
-        last = sorted(recent_health, key=lambda x: x.get("date", datetime.min))[-1]
-        activity = last.get("activityLevel")
-        us = last.get("healthStatus", {}).get("unusualSymptoms") or []
+    if last_health:
+        activity = last_health.get("activityLevel")
+        us = (last_health.get("healthStatus") or {}).get("unusualSymptoms") or []
         health_conds.extend(us)
 
     allergies = (s.get("healthInfo") or {}).get("allergies", []) or []
@@ -70,6 +70,55 @@ def load_student_context(student_id: str, days: int = 7) -> Dict[str, Any]:
         "studentClassIdStr": cls_id_str,   
     }
 
+def load_student_context(student_id: str, days: int = 7) -> Dict[str, Any]:
+    s = students.find_one({"_id": _oid(student_id)})
+    if not s:
+        raise ValueError("Student not found")
+
+    m = latest_measurements([s["_id"]]).get(str(s["_id"]))
+
+    since = datetime.utcnow() - timedelta(days=days)
+    rec_intakes = list(
+        intakes.find({"studentId": s["_id"], "date": {"$gte": since}}, {"_id": 1})
+    )
+    intake_ids = [str(x["_id"]) for x in rec_intakes]
+
+    last_health = health.find_one({"studentId": s["_id"], "date": {"$gte": since}}, sort=[("date", -1)])
+    return _build_context(s, m, intake_ids, last_health)
+
+def load_class_contexts(class_id: str, days: int = 7) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, str]]:
+    """Context cho cả lớp với số truy vấn cố định (roster + 3 aggregation), thay vì 4 truy vấn mỗi học sinh.
+
+    Trả (contexts theo studentId, lỗi theo studentId) — cùng dạng dict với load_student_context.
+    """
+    roster = list(students.find({"classId": _oid(class_id), "isActive": {"$ne": False}}))
+    ids = [s["_id"] for s in roster]
+    if not ids:
+        return {}, {}
+    since = datetime.utcnow() - timedelta(days=days)
+
+    latest_m = latest_measurements(ids)
+    intake_map = {d["_id"]: [str(x) for x in d["ids"]] for d in intakes.aggregate([
+        {"$match": {"studentId": {"$in": ids}, "date": {"$gte": since}}},
+        {"$group": {"_id": "$studentId", "ids": {"$push": "$_id"}}},
+    ])}
+    health_map = {d["_id"]: d for d in health.aggregate([
+        {"$match": {"studentId": {"$in": ids}, "date": {"$gte": since}}},
+        {"$sort": {"studentId": 1, "date": -1}},
+        {"$group": {"_id": "$studentId", "activityLevel": {"$first": "$activityLevel"},
+                    "healthStatus": {"$first": "$healthStatus"}}},
+    ])}
+
+    out: Dict[str, Dict[str, Any]] = {}
+    errors: Dict[str, str] = {}
+    for s in roster:
+        sid = s["_id"]
+        try:
+            out[str(sid)] = _build_context(s, latest_m.get(str(sid)), intake_map.get(sid, []), health_map.get(sid))
+        except Exception as e:
+            errors[str(sid)] = str(e)
+    return out, errors
+
 def build_prompt_single(ctx: Dict[str, Any], period: Literal["day","week"]) -> str:
     return f"""
 Bạn là chuyên gia dinh dưỡng cho trẻ mầm non. Hãy tạo gợi ý dinh dưỡng cá nhân hoá cho học sinh sau theo dạng JSON STRICT, KHÔNG thêm giải thích.
@@ -113,13 +162,8 @@ YÊU CẦU:
 - Chỉ in JSON hợp lệ.
 """
 
-def parse_json(text: str) -> Dict[str, Any]:
-    i, j = text.find("{"), text.rfind("}")
-    if i >= 0 and j > i: text = text[i:j+1]
-    return json.loads(text)
-
-def save_nutrition(student_id: str, model_name: str, ctx: Dict[str,Any], obj: Dict[str,Any]) -> str:
-    doc = {
+def _nutrition_doc(student_id: str, model_name: str, ctx: Dict[str,Any], obj: Dict[str,Any]) -> Dict[str,Any]:
+    return {
         "studentId": ObjectId(student_id),
         "generatedDate": datetime.utcnow(),
         "inputData": ctx["inputData"],
@@ -130,55 +174,90 @@ def save_nutrition(student_id: str, model_name: str, ctx: Dict[str,Any], obj: Di
         "createdAt": datetime.utcnow(),
         "updatedAt": datetime.utcnow(),
     }
-    rid = nutri_recs.insert_one(doc).inserted_id
+
+def save_nutrition(student_id: str, model_name: str, ctx: Dict[str,Any], obj: Dict[str,Any]) -> str:
+    rid = nutri_recs.insert_one(_nutrition_doc(student_id, model_name, ctx, obj)).inserted_id
+    read_cache.invalidate(("latest", str(ObjectId(student_id))))
     return str(rid)
 
-def generate_single(student_id: str, period: str, engine: Literal["gemini","ollama"]) -> Dict[str,Any]:
+def _call_engine(engine: str, prompt: str, use_cache: bool = True) -> Tuple[Dict[str, Any], str]:
+    """Gọi qua ai.llm ở chế độ JSON, validate theo RecommendationResult; trả (object, model thực sự đã dùng).
+    use_cache=False: bỏ qua cache (tạo lại gợi ý)."""
+    data, res = generate_json(prompt, engine, RecommendationResult, model="gemini-2.5-flash" if engine == "gemini" else None,
+                              use_cache=use_cache)
+    return data, res.model if res.engine == "gemini" else "ollama"
+
+def generate_single(student_id: str, period: str, engine: Literal["gemini","ollama"], use_cache: bool = True) -> Dict[str,Any]:
     ctx = load_student_context(student_id, days=7)
     prompt = build_prompt_single(ctx, period)
-
-    if engine == "gemini":
-        from ai.gemini_client import generate
-        raw = generate(prompt, model="gemini-2.5-flash")
-        model_name = "gemini-2.5-flash"
-    else:
-        from ai.ollama_client import generate
-        raw = generate(prompt)
-        model_name = "ollama"
-
-    data = parse_json(raw)
+    data, model_name = _call_engine(engine, prompt, use_cache)
     rec_id = save_nutrition(student_id, model_name, ctx, data)
     return {"ok": True, "recommendationId": rec_id, "model": model_name}
 
-def generate_for_class(class_id: str, period: str, engine: Literal["gemini","ollama"]) -> Dict[str,Any]:
-    cur = students.find({"classId": ObjectId(class_id), "isActive": {"$ne": False}}, {"_id": 1})
-    ids = [str(x["_id"]) for x in cur]
-
+def _generate_for_student(sid: str, ctx: Dict[str,Any], period: str, engine: str,
+                          use_cache: bool = True) -> Tuple[Dict[str,Any], Dict[str,Any] | None]:
+    """(item kết quả, doc chờ ghi); doc None khi lỗi."""
+    try:
+        grp = ctx.get("bmiStatus") or "normal"
+        prompt = build_prompt_single(ctx, period)
+        data, model = _call_engine(engine, prompt, use_cache)
+        doc = _nutrition_doc(sid, model, ctx, data)
+        doc["_id"] = ObjectId()
+        return {"studentId": sid, "bmiStatus": grp, "recommendationId": str(doc["_id"])}, doc
+    except Exception as e:
+        return {"studentId": sid, "error": str(e)}, None
+
+async def iter_generate_for_class(class_id: str, period: str, engine: Literal["gemini","ollama"],
+                                  should_stop: Callable[[], bool] | None = None,
+                                  use_cache: bool = True) -> AsyncIterator[Dict[str,Any]]:
+    """Sinh gợi ý cho cả lớp song song, trả từng kết quả ngay khi xong. Chỉ dispatch tối đa
+    llm.concurrency(engine) học sinh cùng lúc; should_stop() đúng thì không dispatch thêm."""
+    ctx_map, errors = await asyncio.to_thread(load_class_contexts, class_id, 7)
+    total = len(ctx_map) + len(errors)
+    done = 0
+    for sid, err in errors.items():
+        done += 1
+        yield {"studentId": sid, "error": err, "progress": {"done": done, "total": total}}
+    sids = list(ctx_map)
+    calls = [functools.partial(llm.run_blocking, _generate_for_student, sid, ctx_map[sid], period, engine,
+                                   use_cache) for sid in sids]
+    # gom kết quả, ghi theo lô (id gán sẵn nên item trả về ngay được); phần còn lại ghi khi kết thúc/bị huỷ
+    writer = DraftWriter()
+    try:
+        async for i, res in bounded_as_completed(calls, llm.concurrency(engine), should_stop):
+            item, doc = ({"studentId": sids[i], "error": str(res)}, None) if isinstance(res, Exception) else res
+            if doc is not None:
+                writer.add(doc)
+                if len(writer) >= GENERATE_FLUSH_EVERY:
+                    await asyncio.to_thread(writer.commit)
+            done += 1
+            item["progress"] = {"done": done, "total": total}
+            yield item
+    finally:
+        if len(writer):
+            await asyncio.to_thread(writer.commit)
+
+async def agenerate_for_class(class_id: str, period: str, engine: Literal["gemini","ollama"],
+                              use_cache: bool = True) -> Dict[str,Any]:
     groups = {"underweight": [], "normal": [], "overweight": [], "obese": []}
     items = []
-
-    for sid in ids:
-        try:
-            ctx = load_student_context(sid, days=7)
-            grp = ctx.get("bmiStatus") or "normal"
-            groups.setdefault(grp, []).append(sid)
-
-            prompt = build_prompt_single(ctx, period)
-            if engine == "gemini":
-                from ai.gemini_client import generate
-                raw = generate(prompt, model="gemini-2.5-flash"); model = "gemini-2.5-flash"
-            else:
-                from ai.ollama_client import generate
-                raw = generate(prompt); model = "ollama"
-
-            data = parse_json(raw)
-            rid = save_nutrition(sid, model, ctx, data)
-            items.append({"studentId": sid, "recommendationId": rid})
-        except Exception as e:
-            items.append({"studentId": sid, "error": str(e)})
-
+    async for it in iter_generate_for_class(class_id, period, engine, use_cache=use_cache):
+        it.pop("progress", None)
+        grp = it.pop("bmiStatus", None)
+        if grp:
+            groups.setdefault(grp, []).append(it["studentId"])
+        items.append(it)
     return {"ok": True, "classId": class_id, "groups": groups, "items": items}
 
+def generate_for_class(class_id: str, period: str, engine: Literal["gemini","ollama"], use_cache: bool = True) -> Dict[str,Any]:
+    """Bản sync (job, script). Nếu thread hiện tại đang chạy event loop thì chạy loop riêng ở thread khác."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(agenerate_for_class(class_id, period, engine, use_cache))
+    with ThreadPoolExecutor(max_workers=1) as ex:
+        return ex.submit(asyncio.run, agenerate_for_class(class_id, period, engine, use_cache)).result()
+
 def _weekday_dates_from(start_iso: str, days: int) -> List[date]:
     d0 = datetime.fromisoformat(start_iso).date()
     out = []
@@ -206,93 +285,91 @@ def _group_name(bmi: str, sig: str) -> str:
     if sig != "no-allergy": label += f" - tránh({sig})"
     return label
 
-def _load_food_catalog(excluded_allergens: List[str]) -> List[Dict[str,Any]]:
-    cur = food_items.find({
-        "isActive": True,
-        "allergens": {"$nin": excluded_allergens}
-    }).limit(50)
-    return list(cur)
-
-def _pick_meal(items: List[Dict[str,Any]], names: List[str], qty=100):
-    by_name = {i["name"].lower(): i for i in items}
-    chosen = []
-    for n in names:
-        it = by_name.get(n.lower())
-        if it: chosen.append({"foodItemId": str(it["_id"]), "quantity": qty, "name": it["name"]})
-    if not chosen:
-        for it in items[:3]:
-            chosen.append({"foodItemId": str(it["_id"]), "quantity": qty, "name": it["name"]})
-    return chosen
-
-def _menu_from_ai_targets(ai_rec: Dict[str,Any], items: List[Dict[str,Any]]):
-    sugg = [ (x.get("foodItemId") or "").strip() for x in (ai_rec.get("suggestedFoods") or []) ]
-    breakfast = _pick_meal(items, sugg[:3])
-    lunch     = _pick_meal(items, sugg[3:6])
-    snack     = _pick_meal(items, sugg[6:8], qty=80)
-    return {"breakfast":{"items":breakfast}, "lunch":{"items":lunch}, "snack":{"items":snack}}
-
-def plan_menus_for_class(class_id: str, start_date: str, days: int, engine: Literal["gemini","ollama"]):
-    cur = students.find({"classId": ObjectId(class_id), "isActive": {"$ne": False}}, {"_id":1})
-    sids = [str(x["_id"]) for x in cur]
+def _load_food_catalog(excluded_allergens: List[str]) -> FoodCatalog:
+    cat = get_catalog()
+    for a in excluded_allergens:
+        cat = cat.without_allergen(a)
+    return cat
 
-    groups: Dict[Tuple[str,str], List[str]] = {}
-    ctx_map: Dict[str,Dict[str,Any]] = {}
-    for sid in sids:
-        try:
-            ctx = load_student_context(sid, days=7)
-            ctx_map[sid] = ctx
-            key = _group_key(ctx) 
-            groups.setdefault(key, []).append(sid)
-        except Exception:
-            continue
+def _draft_doc(class_id, bmi: str, sig: str, name: str, member_ids: List[str], d: date, meals, model: str) -> Dict[str,Any]:
+    return {
+        "type": "menu_draft",
+        "classId": class_id,
+        "studentGroup": {
+            "bmi": bmi, "allergySig": sig, "name": name, "studentIds": [ObjectId(x) for x in member_ids]
+        },
+        "date": datetime(d.year, d.month, d.day),
+        "meals": meals,
+        "aiModel": model,
+        "generatedDate": datetime.utcnow(),
+        "appliedToMenu": False,
+        "createdAt": datetime.utcnow(),
+        "updatedAt": datetime.utcnow(),
+    }
+
+def _plan_group(class_id, bmi: str, sig: str, name: str, members: List[str],
+                dates: List[date], engine: str) -> List[Tuple[Dict[str,Any], Dict[str,Any]]]:
+    """Thực đơn nhóm theo từng ngày, trả [(doc menu_draft, preview)] (preview chưa có recId).
+
+    LLM: gộp tối đa PLAN_BATCH_SIZE ngày mỗi lời gọi (JSON theo schema), ngày thiếu/hỏng thì gọi lại riêng
+    (nutrition_planner.plan_ai_menus). engine="local", hoặc ngày vẫn không có kết quả / không còn engine
+    LLM nào dùng được: xếp bằng services.local_planner."""
+    allergies = [] if sig=="no-allergy" else sig.split(",")
+    catalog = _load_food_catalog(allergies)
+    # món lớp đã ăn/đã lên nháp gần đây (class_recent_dishes), món mới hơn nặng hơn
+    recent = recent_dishes.recent(class_id, CTX_DAYS + 2)
+    ai_menus: Dict[str, Dict[str,Any]] = {}
+    if engine != "local":
+        constraints = {"bmi": bmi, "allergy": ", ".join(allergies) or "không"}
+        entries = [(d.isoformat(), constraints, d.isoformat()) for d in dates]
+        ctx = {"menusRecent": [nm for nm, _ in recent.most_common()]}
+        ai_menus = plan_ai_menus(engine, entries, ctx, PLAN_BATCH_SIZE, time.monotonic() + LLM_PLAN_DEADLINE_SEC)
+    used: Counter = Counter()
+    out = []
+    for d in dates:
+        j = ai_menus.get(d.isoformat())
+        if j is not None:
+            meals, model = menu_from_ai_json(j, catalog), engine
+            for k in ("breakfast", "lunch", "snack"):
+                meals[k]["items"] = penalize_repeats(meals[k]["items"], recent)
+        else:
+            meals, model = plan_day(catalog, default_targets(bmi), recent, used), "local"
+        doc = _draft_doc(class_id, bmi, sig, name, members, d, meals, model)
+        out.append((doc, {"date": d.isoformat(), "groupName": name, "studentCount": len(members), "meals": meals}))
+    return out
 
+def _class_plan_groups(class_id: str, start_date: str, days: int):
+    ctx_map, _ = load_class_contexts(class_id, days=7)
+    groups: Dict[Tuple[str,str], List[str]] = {}
+    for sid, ctx in ctx_map.items():
+        groups.setdefault(_group_key(ctx), []).append(sid)
     days = max(1, min(5, int(days)))
-    dates = _weekday_dates_from(start_date, days)
+    # thứ tự nhóm cố định (seq idempotency = nhóm * số ngày + ngày)
+    return dict(sorted(groups.items())), _weekday_dates_from(start_date, days)
 
-    previews = []
-    draft_ids = []
+def _replayed(done: List[Dict[str,Any]]) -> Dict[str,Any]:
+    return {"draftIds": [str(d["_id"]) for d in done], "previews": previews_from_docs(done), "replayed": True}
+
+PLAN_NOTE = "Các bản nháp đã lưu vào nutritional_recommendations.type=menu_draft. Dùng API save để đẩy sang menus."
+
+def plan_menus_for_class(class_id: str, start_date: str, days: int, engine: Literal["gemini","ollama","local"],
+                         idempotency_key: str | None = None, transaction: bool | None = None):
+    key = idempotency_key and f"plan-menus:{class_id}:{idempotency_key}"
+    done = committed(key)
+    if done:
+        return {"ok": True, "classId": class_id, "startDate": start_date, "days": len({d["date"] for d in done}), **_replayed(done)}
+
+    groups, dates = _class_plan_groups(class_id, start_date, days)
 
+    previews = []
+    writer = DraftWriter(key, transaction, total=len(groups) * len(dates))
     for (bmi, sig), members in groups.items():
-        allergies = [] if sig=="no-allergy" else sig.split(",")
-        catalog = _load_food_catalog(allergies)
-
-        rep_ctx = ctx_map[members[0]]
-        prompt = build_prompt_single(rep_ctx, "day")  
-        if engine == "gemini":
-            from ai.gemini_client import generate
-            raw = generate(prompt, model="gemini-2.5-flash"); model="gemini-2.5-flash"
-        else:
-            from ai.ollama_client import generate
-            raw = generate(prompt); model="ollama"
-        ai_obj = parse_json(raw)["recommendations"]
-
-        for d in dates:
-            meals = _menu_from_ai_targets(ai_obj, catalog)
-
-            doc = {
-                "type": "menu_draft",
-                "classId": ObjectId(class_id),
-                "studentGroup": {
-                    "bmi": bmi, "allergySig": sig, "name": _group_name(bmi, sig), "studentIds": [ObjectId(x) for x in members]
-                },
-                "date": datetime(d.year, d.month, d.day),
-                "meals": meals,
-                "aiModel": model,
-                "generatedDate": datetime.utcnow(),
-                "appliedToMenu": False,
-                "createdAt": datetime.utcnow(),
-                "updatedAt": datetime.utcnow(),
-            }
-            rid = nutri_recs.insert_one(doc).inserted_id
-            draft_ids.append(str(rid))
-
-            previews.append({
-                "recId": str(rid),
-                "date": d.isoformat(),
-                "groupName": _group_name(bmi, sig),
-                "studentCount": len(members),
-                "meals": meals
-            })
+        for doc, preview in _plan_group(ObjectId(class_id), bmi, sig, _group_name(bmi, sig), members, dates, engine):
+            writer.add(doc)
+            previews.append(preview)
+
+    draft_ids = writer.commit()
+    fill_previews(previews, draft_ids, writer.stored)
 
     return {
         "ok": True,
@@ -301,54 +378,119 @@ def plan_menus_for_class(class_id: str, start_date: str, days: int, engine: Lite
         "days": len(dates),
         "draftIds": draft_ids,
         "previews": previews,
-        "note": "Các bản nháp đã lưu vào nutritional_recommendations.type=menu_draft. Dùng API save để đẩy sang menus."
+        "note": PLAN_NOTE,
     }
 
-def plan_menus_for_student(student_id: str, start_date: str, days: int, engine: Literal["gemini","ollama"]):
+async def iter_plan_menus_for_class(class_id: str, start_date: str, days: int, engine: Literal["gemini","ollama","local"],
+                                    idempotency_key: str | None = None, transaction: bool | None = None,
+                                    should_stop: Callable[[], bool] | None = None) -> AsyncIterator[Dict[str,Any]]:
+    """Như plan_menus_for_class nhưng các nhóm chạy song song, trả từng preview (kèm seq, progress) ngay khi
+    nhóm có kết quả; bản ghi cuối {"summary": True, ...} mang draftIds và previews (có recId) sau khi ghi.
+    Lỗi/ngắt giữa chừng (hoặc should_stop() đúng: không dispatch nhóm mới): phần đã sinh vẫn được ghi, retry
+    cùng key chỉ sinh các nhóm còn thiếu."""
+    key = idempotency_key and f"plan-menus:{class_id}:{idempotency_key}"
+    done = await asyncio.to_thread(committed, key)
+    if done:
+        rep = _replayed(done)
+        for n, p in enumerate(rep["previews"], 1):
+            yield {**p, "progress": {"done": n, "total": len(done)}}
+        yield {"summary": True, "ok": True, "classId": class_id, "draftIds": rep["draftIds"], "replayed": True}
+        return
+
+    groups, dates = await asyncio.to_thread(_class_plan_groups, class_id, start_date, days)
+    total = len(groups) * len(dates)
+    cid = ObjectId(class_id)
+    # lần trước cùng key dừng giữa chừng: nhóm đã ghi đủ các ngày thì dùng lại, chỉ sinh các seq còn thiếu
+    prior = {d["idempotencySeq"]: d for d in await asyncio.to_thread(stored_docs, key)}
+    by_seq: Dict[int, Dict[str,Any]] = {}
+    todo = []
+    for gi, ((bmi, sig), members) in enumerate(groups.items()):
+        seqs = range(gi * len(dates), (gi + 1) * len(dates))
+        if all(q in prior for q in seqs):
+            by_seq.update({q: previews_from_docs([prior[q]])[0] for q in seqs})
+        else:
+            todo.append((gi, functools.partial(llm.run_blocking, _plan_group, cid, bmi, sig, _group_name(bmi, sig),
+                                               members, dates, engine)))
+    n = 0
+    for q in sorted(by_seq):
+        n += 1
+        yield {"seq": q, **by_seq[q], "progress": {"done": n, "total": total}}
+
+    writer = DraftWriter(key, transaction, total=total)
+    seqs: List[int] = []
+    previews: List[Dict[str,Any]] = []
+    errors: List[str] = []
+    try:
+        async for i, pairs in bounded_as_completed([c for _, c in todo], llm.concurrency(engine), should_stop):
+            if isinstance(pairs, Exception):
+                errors.append(str(pairs))
+                n += len(dates)
+                yield {"error": str(pairs), "progress": {"done": n, "total": total}}
+                continue
+            gi = todo[i][0]
+            for di, (doc, preview) in enumerate(pairs):
+                # seq theo (nhóm, ngày), không theo thứ tự hoàn thành: retry cùng key khớp đúng bản đã ghi
+                seq = gi * len(dates) + di
+                writer.add(doc, seq)
+                seqs.append(seq)
+                previews.append(preview)
+                n += 1
+                # recId chỉ có sau khi ghi (retry có thể trả bản đã lưu) -> xem summary
+                yield {"seq": seq, **preview, "progress": {"done": n, "total": total}}
+    finally:
+        # ghi cả khi lỗi/bị ngắt: idempotencyTotal = total nên key chưa "xong", retry sinh tiếp phần thiếu
+        draft_ids = await asyncio.to_thread(writer.commit)
+    by_seq.update(zip(seqs, fill_previews(previews, draft_ids, writer.stored)))
+    ordered = [by_seq[q] for q in sorted(by_seq)]
+    yield {"summary": True, "ok": len(ordered) == total, "classId": class_id, "startDate": start_date,
+           "days": len(dates), "draftIds": [p["recId"] for p in ordered], "previews": ordered, "errors": errors,
+           "note": PLAN_NOTE}
+
+def _student_plan(student_id: str, start_date: str, days: int, engine: str):
     ctx = load_student_context(student_id, days=7)
     allergies = ctx["inputData"].get("allergies") or []
-    catalog = _load_food_catalog(allergies)
-
     days = max(1, min(5, int(days)))
     dates = _weekday_dates_from(start_date, days)
+    name = f"bé {ctx['student'].get('fullName') or 'không tên'}"
+    sig = ",".join(allergies) or "no-allergy"
+    return _plan_group(ctx.get("studentClassId"), ctx.get("bmiStatus") or "normal", sig, name, [student_id], dates, engine)
 
-    prompt = build_prompt_single(ctx, "day")
-    if engine == "gemini":
-        from ai.gemini_client import generate
-        raw = generate(prompt, model="gemini-2.5-flash"); model="gemini-2.5-flash"
-    else:
-        from ai.ollama_client import generate
-        raw = generate(prompt); model="ollama"
-    ai_obj = parse_json(raw)["recommendations"]
+def plan_menus_for_student(student_id: str, start_date: str, days: int, engine: Literal["gemini","ollama","local"],
+                           idempotency_key: str | None = None, transaction: bool | None = None):
+    key = idempotency_key and f"plan-student:{student_id}:{idempotency_key}"
+    done = committed(key)
+    if done:
+        return {"ok": True, "studentId": student_id, "startDate": start_date, "days": len(done), **_replayed(done)}
 
-    previews, draft_ids = [], []
-    for d in dates:
-        meals = _menu_from_ai_targets(ai_obj, catalog)
-        doc = {
-            "type": "menu_draft",
-            "classId": ctx.get("studentClassId"),
-            "studentGroup": {
-                "bmi": ctx.get("bmiStatus") or "normal",
-                "allergySig": ",".join(allergies) or "no-allergy",
-                "name": f"bé {ctx['student'].get('fullName') or 'không tên'}",
-                "studentIds": [ObjectId(student_id)]
-            },
-            "date": datetime(d.year, d.month, d.day),
-            "meals": meals,
-            "aiModel": model,
-            "generatedDate": datetime.utcnow(),
-            "appliedToMenu": False,
-            "createdAt": datetime.utcnow(),
-            "updatedAt": datetime.utcnow(),
-        }
-        rid = nutri_recs.insert_one(doc).inserted_id
-        draft_ids.append(str(rid))
-        previews.append({
-            "recId": str(rid),
-            "date": d.isoformat(),
-            "groupName": f"bé {ctx['student'].get('fullName') or 'không tên'}",
-            "studentCount": 1,
-            "meals": meals
-        })
-    return {"ok": True, "studentId": student_id, "startDate": start_date, "days": len(dates),
-            "draftIds": draft_ids, "previews": previews}
\ No newline at end of file
+    previews = []
+    writer = DraftWriter(key, transaction)
+    for doc, preview in _student_plan(student_id, start_date, days, engine):
+        writer.add(doc)
+        previews.append(preview)
+    draft_ids = writer.commit()
+    fill_previews(previews, draft_ids, writer.stored)
+    return {"ok": True, "studentId": student_id, "startDate": start_date, "days": len(previews),
+            "draftIds": draft_ids, "previews": previews}
+
+async def iter_plan_menus_for_student(student_id: str, start_date: str, days: int, engine: Literal["gemini","ollama","local"],
+                                      idempotency_key: str | None = None, transaction: bool | None = None) -> AsyncIterator[Dict[str,Any]]:
+    """Bản stream của plan_menus_for_student: từng ngày một dòng, cuối cùng là summary."""
+    key = idempotency_key and f"plan-student:{student_id}:{idempotency_key}"
+    done = await asyncio.to_thread(committed, key)
+    if done:
+        rep = _replayed(done)
+        for n, p in enumerate(rep["previews"], 1):
+            yield {**p, "progress": {"done": n, "total": len(done)}}
+        yield {"summary": True, "ok": True, "studentId": student_id, "draftIds": rep["draftIds"], "replayed": True}
+        return
+
+    pairs = await asyncio.to_thread(_student_plan, student_id, start_date, days, engine)
+    writer = DraftWriter(key, transaction)
+    for doc, _ in pairs:
+        writer.add(doc)
+    # ghi trước khi trả: với 1 học sinh chỉ có 1 lời gọi LLM, các ngày xong cùng lúc
+    draft_ids = await asyncio.to_thread(writer.commit)
+    previews = fill_previews([p for _, p in pairs], draft_ids, writer.stored)
+    for n, preview in enumerate(previews, 1):
+        yield {**preview, "progress": {"done": n, "total": len(pairs)}}
+    yield {"summary": True, "ok": True, "studentId": student_id, "startDate": start_date, "days": len(pairs), "draftIds": draft_ids}
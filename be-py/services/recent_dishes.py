@@ -0,0 +1,82 @@
+# be-py/services/recent_dishes.py
+"""Chỉ mục "món gần đây" theo lớp, dùng khi NestJS /nutrition/context không trả được.
+
+Mỗi bản ghi class_recent_dishes là (classId, date, name) -> count, cộng dồn mỗi khi DraftWriter ghi
+menu_draft; TTL index tự xoá sau RECENT_DISHES_KEEP_DAYS. `recent(class_id, days)` trả Counter
+tên món -> trọng số (count giảm dần theo tuổi, bán rã RECENT_DISHES_HALF_LIFE_DAYS), tra O(1).
+"""
+from typing import Any, Dict, Iterable, Optional
+from collections import Counter
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import UpdateOne
+from common.db import db
+from common.lru import TTLCache
+from common.config import RECENT_DISHES_KEEP_DAYS, RECENT_DISHES_HALF_LIFE_DAYS, RECENT_DISHES_CACHE_TTL_SEC
+
+MEALS = ("breakfast", "lunch", "snack")
+
+_coll = db["class_recent_dishes"]
+_HALF_LIFE = max(RECENT_DISHES_HALF_LIFE_DAYS, 0.1)
+_cache = TTLCache(maxsize=2048, ttl=RECENT_DISHES_CACHE_TTL_SEC or 1)
+
+def norm_name(name: Any) -> str:
+    return (name or "").strip().lower() if isinstance(name, str) else ""
+
+def _day(d: Any) -> Optional[datetime]:
+    if isinstance(d, datetime):
+        return datetime(d.year, d.month, d.day)
+    if isinstance(d, str):
+        try:
+            return datetime.fromisoformat(d[:10])
+        except ValueError:
+            return None
+    return None
+
+def record(docs: Iterable[Dict[str, Any]]) -> int:
+    """Cộng món của các menu_draft vừa ghi vào chỉ mục (1 bulk_write); trả số (lớp, ngày, món) đã cập nhật."""
+    counts: Counter = Counter()
+    for d in docs:
+        cid, day = d.get("classId"), _day(d.get("date"))
+        if d.get("type") != "menu_draft" or not cid or day is None:
+            continue
+        meals = d.get("meals") or {}
+        for k in MEALS:
+            for it in ((meals.get(k) or {}).get("items") or []):
+                nm = norm_name(it.get("name"))
+                if nm:
+                    counts[(ObjectId(cid), day, nm)] += 1
+    if not counts:
+        return 0
+    now = datetime.utcnow()
+    ops = [
+        UpdateOne(
+            {"classId": cid, "date": day, "name": nm},
+            {"$inc": {"count": n}, "$set": {"updatedAt": now},
+             "$max": {"expiresAt": max(day, now) + timedelta(days=RECENT_DISHES_KEEP_DAYS)}},
+            upsert=True,
+        )
+        for (cid, day, nm), n in counts.items()
+    ]
+    _coll.bulk_write(ops, ordered=False)
+    classes = {str(cid) for cid, _, _ in counts}
+    _cache.pop_where(lambda key: key[0] in classes)
+    return len(ops)
+
+def recent(class_id: Any, days: int, today: Optional[datetime] = None) -> Counter:
+    """Tên món -> trọng số lặp của lớp trong `days` ngày gần nhất (kể cả ngày đã lên thực đơn phía trước)."""
+    if not class_id:
+        return Counter()
+    cid = str(class_id)
+    today = _day(today or datetime.utcnow())
+    key = (cid, int(days), today)
+    hit = _cache.get(key)
+    if hit is not None:
+        return Counter(hit)
+    out: Counter = Counter()
+    since = today - timedelta(days=days)
+    for r in _coll.find({"classId": ObjectId(cid), "date": {"$gte": since}}, {"_id": 0, "date": 1, "name": 1, "count": 1}):
+        age = max(0, (today - r["date"]).days)
+        out[r["name"]] += r.get("count", 1) * 0.5 ** (age / _HALF_LIFE)
+    _cache.set(key, out)
+    return Counter(out)
@@ -0,0 +1,51 @@
+# be-py/utils/aio.py
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+import asyncio
+
+async def bounded_as_completed(
+    calls: Iterable[Callable[[], Awaitable[Any]]],
+    limit: int,
+    should_stop: Optional[Callable[[], bool]] = None,
+) -> AsyncIterator[Tuple[int, Any]]:
+    """Chạy tối đa `limit` call cùng lúc, trả (vị trí, kết quả) theo thứ tự xong; lỗi của call được trả
+    như kết quả (Exception). Chỉ khởi chạy call tiếp theo khi có chỗ trống và should_stop() chưa đúng.
+    Đóng generator giữa chừng thì huỷ các call đang chạy và chờ chúng kết thúc."""
+    todo = iter(enumerate(calls))
+    pending: Dict[asyncio.Future, int] = {}
+
+    def fill() -> None:
+        while len(pending) < max(1, limit):
+            if should_stop is not None and should_stop():
+                return
+            nxt = next(todo, None)
+            if nxt is None:
+                return
+            pending[asyncio.ensure_future(nxt[1]())] = nxt[0]
+
+    try:
+        fill()
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for fut in done:
+                i = pending.pop(fut)
+                try:
+                    res = fut.result()
+                except Exception as e:
+                    res = e
+                yield i, res
+            fill()
+    finally:
+        for fut in pending:
+            fut.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+async def finish_on_cancel(aw: Awaitable[Any]) -> Any:
+    """await aw; bị huỷ thì vẫn chờ aw chạy xong rồi mới ném CancelledError (vd. thread đang đọc một file
+    mà caller sẽ đóng ngay sau khi huỷ)."""
+    task = asyncio.ensure_future(aw)
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        await asyncio.wait([task])
+        raise
@@ -0,0 +1,21 @@
+# be-py/utils/stream.py
+from typing import Any, AsyncIterator, Dict
+from fastapi.responses import StreamingResponse
+from common.responses import dumps
+
+def wants_sse(fmt: str | None, accept: str | None) -> bool:
+    return (fmt or "").lower() == "sse" or "text/event-stream" in (accept or "")
+
+def stream_records(records: AsyncIterator[Dict[str, Any]], sse: bool = False) -> StreamingResponse:
+    """NDJSON (mặc định) hoặc Server-Sent Events; bản ghi có "summary" gửi với event: summary."""
+    async def gen():
+        async for rec in records:
+            line = dumps(rec)
+            if sse:
+                yield b"event: " + (b"summary" if rec.get("summary") else b"item") + b"\ndata: " + line + b"\n\n"
+            else:
+                yield line + b"\n"
+
+    media = "text/event-stream" if sse else "application/x-ndjson"
+    # X-Accel-Buffering: nginx không gom response, client nhận từng dòng ngay
+    return StreamingResponse(gen(), media_type=media, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -0,0 +1,12 @@
+# be-py/utils/text.py
+import re
+import unicodedata
+
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+
+def fold(s: str) -> str:
+    """Bỏ dấu tiếng Việt + lowercase: "Phở Bò Tái" -> "pho bo tai"."""
+    s = unicodedata.normalize("NFD", s or "")
+    s = "".join(ch for ch in s if unicodedata.category(ch) != "Mn")
+    s = s.replace("đ", "d").replace("Đ", "D").lower()
+    return _NON_ALNUM.sub(" ", s).strip()